@@ -4,6 +4,9 @@ NYC Taxi Airport Pattern Analysis
 Analyzes differences between JFK and LaGuardia taxi trips including
 timing patterns, fares, distances, and passenger characteristics.
 
+Results are memoized in the result cache, so reruns on unchanged data
+skip loading the trips entirely.
+
 Author: Henrik
 Date: November 2024
 """
@@ -12,49 +15,115 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+from result_cache import ResultCache, dataset_fingerprint, code_version
+from zone_windows import ZoneWindows
 
 # Set style
 sns.set_style("whitegrid")
 
+LATE_NIGHT_HOURS = [22, 23, 0, 1, 2, 3, 4, 5]
+RESULT_NAMES = ['airport_hourly', 'airport_summary', 'airport_passengers', 'airport_queue']
+QUEUE_WINDOW = 15
+
+
+def compute_airport_results(data_file, zones_file, late_night_hours, queue_window=QUEUE_WINDOW):
+    """Load, clean and summarize JFK vs LaGuardia pickups"""
+    df = pd.read_parquet(data_file)
+    zones = pd.read_csv(zones_file)
+
+    # Clean data
+    df_clean = df[
+        (df['fare_amount'] >= 0) &
+        (df['trip_distance'] > 0) &
+        (df['trip_distance'] <= 100) &
+        (df['passenger_count'] > 0) &
+        (df['passenger_count'] <= 6)
+    ].copy()
+
+    # Join with zones
+    df_clean = df_clean.merge(
+        zones[['LocationID', 'Zone']],
+        left_on='PULocationID',
+        right_on='LocationID',
+        how='left'
+    ).rename(columns={'Zone': 'PU_Zone'}).drop('LocationID', axis=1)
+
+    # Extract time info
+    df_clean['pickup_hour'] = pd.to_datetime(df_clean['tpep_pickup_datetime']).dt.hour
+
+    # Filter for airport pickups
+    airports = {
+        'JFK': df_clean[df_clean['PU_Zone'].str.contains('JFK', case=False, na=False)],
+        'LaGuardia': df_clean[df_clean['PU_Zone'].str.contains('LaGuardia', case=False, na=False)],
+    }
+
+    hourly = pd.DataFrame({
+        name: trips['pickup_hour'].value_counts().reindex(range(24), fill_value=0)
+        for name, trips in airports.items()
+    }).rename_axis('pickup_hour')
+
+    summary = {}
+    for name, trips in airports.items():
+        late = trips['pickup_hour'].isin(late_night_hours)
+        summary[name] = {
+            'pickups': len(trips),
+            'fare_mean': trips['fare_amount'].mean(),
+            'fare_median': trips['fare_amount'].median(),
+            'distance_mean': trips['trip_distance'].mean(),
+            'distance_median': trips['trip_distance'].median(),
+            'late_night_pickups': int(late.sum()),
+            'late_night_pct': late.sum() / len(trips) * 100,
+        }
+
+    passengers = pd.DataFrame({
+        name: trips['passenger_count'].value_counts().sort_index()
+        for name, trips in airports.items()
+    }).fillna(0).astype(int).rename_axis('passenger_count')
+
+    # Queue build-up: trailing-window pickups at each airport minute by minute,
+    # averaged over the days of the month
+    windows = ZoneWindows.from_trips(df_clean, 'pickup')
+    queue = {}
+    for name in airports:
+        ids = zones.loc[zones['Zone'].str.contains(name, case=False, na=False), 'LocationID']
+        rolling = windows.rolling(queue_window, zones=ids.to_numpy()).sum(axis=0, keepdims=True)
+        queue[name] = windows.daily_profile(rolling)[0]
+    queue = pd.DataFrame(queue).rename_axis('minute_of_day')
+
+    return {
+        'airport_hourly': hourly,
+        'airport_summary': pd.DataFrame(summary),
+        'airport_passengers': passengers,
+        'airport_queue': queue,
+    }
+
+
 print("=" * 70)
 print("AIRPORT PATTERN ANALYSIS - JFK vs LaGuardia")
 print("=" * 70)
 
-# Load data
 data_file = os.path.join('data', 'yellow_tripdata_2024-01.parquet')
-df = pd.read_parquet(data_file)
-
-# Load zones
 zones_file = os.path.join('data', 'taxi_zone_lookup.csv')
-zones = pd.read_csv(zones_file)
-
-# Clean data
-df_clean = df[
-    (df['fare_amount'] >= 0) &
-    (df['trip_distance'] > 0) &
-    (df['trip_distance'] <= 100) &
-    (df['passenger_count'] > 0) &
-    (df['passenger_count'] <= 6)
-].copy()
-
-# Join with zones
-df_clean = df_clean.merge(
-    zones[['LocationID', 'Zone']],
-    left_on='PULocationID',
-    right_on='LocationID',
-    how='left'
-).rename(columns={'Zone': 'PU_Zone'}).drop('LocationID', axis=1)
-
-# Extract time info
-df_clean['pickup_hour'] = pd.to_datetime(df_clean['tpep_pickup_datetime']).dt.hour
-df_clean['pickup_day'] = pd.to_datetime(df_clean['tpep_pickup_datetime']).dt.day_name()
-
-# Filter for airport pickups
-jfk_trips = df_clean[df_clean['PU_Zone'].str.contains('JFK', case=False, na=False)]
-lga_trips = df_clean[df_clean['PU_Zone'].str.contains('LaGuardia', case=False, na=False)]
-
-print(f"\nJFK Airport pickups: {len(jfk_trips):,}")
-print(f"LaGuardia pickups: {len(lga_trips):,}")
+
+# Load cached results, or run the full pipeline if the data or code changed
+cache = ResultCache()
+results = cache.get_or_compute_many(
+    RESULT_NAMES,
+    lambda: compute_airport_results(data_file, zones_file, LATE_NIGHT_HOURS),
+    params={'late_night_hours': LATE_NIGHT_HOURS, 'queue_window': QUEUE_WINDOW},
+    fingerprint=dataset_fingerprint(data_file, zones_file),
+    version=code_version(compute_airport_results, ZoneWindows),
+)
+hourly = results['airport_hourly']
+summary = results['airport_summary']
+passengers = results['airport_passengers']
+queue = results['airport_queue']
+
+print(f"\nJFK Airport pickups: {int(summary.loc['pickups', 'JFK']):,}")
+print(f"LaGuardia pickups: {int(summary.loc['pickups', 'LaGuardia']):,}")
 
 # Create figures directory
 os.makedirs('docs/figures', exist_ok=True)
@@ -64,8 +133,8 @@ print("\n" + "=" * 70)
 print("PICKUP HOUR DISTRIBUTION")
 print("=" * 70)
 
-jfk_hourly = jfk_trips['pickup_hour'].value_counts().sort_index()
-lga_hourly = lga_trips['pickup_hour'].value_counts().sort_index()
+jfk_hourly = hourly['JFK']
+lga_hourly = hourly['LaGuardia']
 
 print("\nJFK pickups by hour:")
 print(jfk_hourly)
@@ -99,20 +168,20 @@ print("\n" + "=" * 70)
 print("FARE ANALYSIS")
 print("=" * 70)
 
-print(f"\nJFK Average Fare: ${jfk_trips['fare_amount'].mean():.2f}")
-print(f"JFK Median Fare: ${jfk_trips['fare_amount'].median():.2f}")
-print(f"\nLaGuardia Average Fare: ${lga_trips['fare_amount'].mean():.2f}")
-print(f"LaGuardia Median Fare: ${lga_trips['fare_amount'].median():.2f}")
+print(f"\nJFK Average Fare: ${summary.loc['fare_mean', 'JFK']:.2f}")
+print(f"JFK Median Fare: ${summary.loc['fare_median', 'JFK']:.2f}")
+print(f"\nLaGuardia Average Fare: ${summary.loc['fare_mean', 'LaGuardia']:.2f}")
+print(f"LaGuardia Median Fare: ${summary.loc['fare_median', 'LaGuardia']:.2f}")
 
 # Analysis 3: Distance Comparison
 print("\n" + "=" * 70)
 print("DISTANCE ANALYSIS")
 print("=" * 70)
 
-print(f"\nJFK Average Distance: {jfk_trips['trip_distance'].mean():.2f} miles")
-print(f"JFK Median Distance: {jfk_trips['trip_distance'].median():.2f} miles")
-print(f"\nLaGuardia Average Distance: {lga_trips['trip_distance'].mean():.2f} miles")
-print(f"LaGuardia Median Distance: {lga_trips['trip_distance'].median():.2f} miles")
+print(f"\nJFK Average Distance: {summary.loc['distance_mean', 'JFK']:.2f} miles")
+print(f"JFK Median Distance: {summary.loc['distance_median', 'JFK']:.2f} miles")
+print(f"\nLaGuardia Average Distance: {summary.loc['distance_mean', 'LaGuardia']:.2f} miles")
+print(f"LaGuardia Median Distance: {summary.loc['distance_median', 'LaGuardia']:.2f} miles")
 
 # Analysis 4: Passenger Count
 print("\n" + "=" * 70)
@@ -120,25 +189,51 @@ print("PASSENGER PATTERNS")
 print("=" * 70)
 
 print("\nJFK Passenger Distribution:")
-print(jfk_trips['passenger_count'].value_counts().sort_index())
+print(passengers['JFK'][passengers['JFK'] > 0])
 
 print("\nLaGuardia Passenger Distribution:")
-print(lga_trips['passenger_count'].value_counts().sort_index())
+print(passengers['LaGuardia'][passengers['LaGuardia'] > 0])
 
 # Analysis 5: Late Night International Pattern
 print("\n" + "=" * 70)
 print("LATE NIGHT PATTERN (Potential International Arrivals)")
 print("=" * 70)
 
-late_night_hours = [22, 23, 0, 1, 2, 3, 4, 5]
-jfk_late = jfk_trips[jfk_trips['pickup_hour'].isin(late_night_hours)]
-lga_late = lga_trips[lga_trips['pickup_hour'].isin(late_night_hours)]
+jfk_late = int(summary.loc['late_night_pickups', 'JFK'])
+lga_late = int(summary.loc['late_night_pickups', 'LaGuardia'])
+jfk_late_pct = summary.loc['late_night_pct', 'JFK']
+lga_late_pct = summary.loc['late_night_pct', 'LaGuardia']
 
-jfk_late_pct = (len(jfk_late) / len(jfk_trips)) * 100
-lga_late_pct = (len(lga_late) / len(lga_trips)) * 100
+print(f"\nJFK late-night pickups (10PM-5AM): {jfk_late:,} ({jfk_late_pct:.1f}%)")
+print(f"LaGuardia late-night pickups (10PM-5AM): {lga_late:,} ({lga_late_pct:.1f}%)")
 
-print(f"\nJFK late-night pickups (10PM-5AM): {len(jfk_late):,} ({jfk_late_pct:.1f}%)")
-print(f"LaGuardia late-night pickups (10PM-5AM): {len(lga_late):,} ({lga_late_pct:.1f}%)")
+# Analysis 6: Queue Build-Up
+print("\n" + "=" * 70)
+print(f"QUEUE BUILD-UP (pickups in the trailing {QUEUE_WINDOW} minutes, daily average)")
+print("=" * 70)
+
+for name in ['JFK', 'LaGuardia']:
+    profile = queue[name]
+    busiest = profile.nlargest(3)
+    print(f"\n{name}: average {profile.mean():.1f}, quietest at "
+          f"{profile.idxmin() // 60:02d}:{profile.idxmin() % 60:02d} ({profile.min():.1f})")
+    for minute, value in busiest.items():
+        print(f"   Peak at {minute // 60:02d}:{minute % 60:02d} - {value:.1f} pickups")
+
+fig, ax = plt.subplots(figsize=(14, 5))
+hours = queue.index / 60
+ax.plot(hours, queue['JFK'], color='steelblue', label='JFK')
+ax.plot(hours, queue['LaGuardia'], color='coral', label='LaGuardia')
+ax.set_xlabel('Hour of Day', fontsize=12)
+ax.set_ylabel(f'Pickups in trailing {QUEUE_WINDOW} min', fontsize=12)
+ax.set_title('Airport Queue Build-Up by Time of Day', fontsize=13, fontweight='bold')
+ax.set_xticks(range(25))
+ax.legend()
+ax.grid(True, alpha=0.3)
+plt.tight_layout()
+plt.savefig('docs/figures/airport_queue_buildup.png', dpi=300, bbox_inches='tight')
+print("\n   Saved: docs/figures/airport_queue_buildup.png")
+plt.close()
 
 print("\n" + "=" * 70)
 print("✓ Airport analysis complete!")
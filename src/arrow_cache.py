@@ -0,0 +1,142 @@
+"""
+Memory-Mapped Arrow Cache
+
+Keeps an uncompressed Arrow IPC (Feather v2) copy of the cleaned,
+compactly typed trip table. Opening it is a memory map rather than a
+Parquet decode, so an analysis starts almost instantly and concurrent
+processes share the same OS page cache. Columns are written as a single
+contiguous chunk so the pandas view can reference the mapped buffers
+directly for every null-free numeric and timestamp column.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from taxi_data import CLEAN_FILE, DATA_FILE, load_clean_snapshot
+
+ARROW_FILE = os.path.splitext(CLEAN_FILE)[0] + '.arrow'
+
+# Compact types for the yellow taxi columns (only applied when lossless)
+COMPACT_TYPES = {
+    'VendorID': pa.int8(),
+    'passenger_count': pa.int8(),
+    'RatecodeID': pa.int8(),
+    'PULocationID': pa.int16(),
+    'DOLocationID': pa.int16(),
+    'payment_type': pa.int8(),
+    'store_and_fwd_flag': pa.dictionary(pa.int8(), pa.string()),
+}
+
+
+def compact_table(table):
+    """Downcast columns to compact types where no information is lost"""
+    for name, target in COMPACT_TYPES.items():
+        if name not in table.column_names:
+            continue
+        column = table.column(name)
+        if pa.types.is_floating(column.type):
+            # Float-coded integers (e.g. passenger_count) must be whole and null-free
+            whole = pc.all(pc.equal(column, pc.floor(column))).as_py()
+            if column.null_count or not whole:
+                continue
+        if pa.types.is_integer(target):
+            bounds = pc.min_max(column)
+            info = {8: (-2**7, 2**7 - 1), 16: (-2**15, 2**15 - 1)}[target.bit_width]
+            if bounds['min'].as_py() is not None and (
+                    bounds['min'].as_py() < info[0] or bounds['max'].as_py() > info[1]):
+                continue
+        index = table.column_names.index(name)
+        table = table.set_column(index, name, column.cast(target))
+    return table
+
+
+def write_arrow_cache(arrow_file=ARROW_FILE, snapshot_file=CLEAN_FILE, data_file=DATA_FILE):
+    """Write the cleaned snapshot as an uncompressed, single-chunk Arrow file"""
+    if not os.path.exists(snapshot_file):
+        load_clean_snapshot([], snapshot_file, data_file)
+    table = compact_table(pq.read_table(snapshot_file)).combine_chunks()
+
+    tmp_file = arrow_file + '.tmp'
+    options = pa.ipc.IpcWriteOptions(compression=None)
+    with pa.OSFile(tmp_file, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+    os.replace(tmp_file, arrow_file)  # Atomic for concurrent readers
+    return arrow_file
+
+
+def is_current(arrow_file=ARROW_FILE, snapshot_file=CLEAN_FILE):
+    """True when the Arrow cache exists and is newer than the snapshot"""
+    return (os.path.exists(arrow_file) and os.path.exists(snapshot_file) and
+            os.path.getmtime(arrow_file) >= os.path.getmtime(snapshot_file))
+
+
+def open_arrow_table(columns=None, arrow_file=ARROW_FILE, snapshot_file=CLEAN_FILE):
+    """Memory-map the cache as an Arrow table (no decode, no copy)"""
+    if not is_current(arrow_file, snapshot_file):
+        print(f"Writing Arrow cache {arrow_file}...")
+        write_arrow_cache(arrow_file, snapshot_file)
+    source = pa.memory_map(arrow_file, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+def load_trips_mmap(columns=None, arrow_file=ARROW_FILE, snapshot_file=CLEAN_FILE):
+    """
+    Cleaned trips as a pandas DataFrame backed by the memory map.
+
+    `split_blocks` keeps one block per column so pandas does not
+    consolidate (copy) them; null-free numeric and timestamp columns are
+    views of the mapped file, the rest are converted as usual.
+    """
+    table = open_arrow_table(columns, arrow_file, snapshot_file)
+    return table.to_pandas(split_blocks=True, date_as_object=False)
+
+
+def zero_copy_columns(df, table):
+    """Names of DataFrame columns that point straight into the Arrow buffers"""
+    shared = []
+    for name in df.columns:
+        chunks = table.column(name).chunks
+        if len(chunks) != 1 or len(chunks[0].buffers()) < 2 or chunks[0].buffers()[1] is None:
+            continue
+        values = df[name].to_numpy(copy=False)
+        if getattr(values, 'ctypes', None) is not None and \
+                values.ctypes.data == chunks[0].buffers()[1].address:
+            shared.append(name)
+    return shared
+
+
+# Main execution
+if __name__ == "__main__":
+    print("=" * 70)
+    print("ARROW IPC CACHE")
+    print("=" * 70)
+
+    start = time.perf_counter()
+    write_arrow_cache()
+    print(f"\nWrote {ARROW_FILE} in {time.perf_counter() - start:.2f}s "
+          f"({os.path.getsize(ARROW_FILE) / 1024**2:.1f} MB)")
+
+    start = time.perf_counter()
+    parquet_df = load_clean_snapshot()
+    print(f"\nParquet snapshot load: {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    table = open_arrow_table()
+    df = table.to_pandas(split_blocks=True, date_as_object=False)
+    print(f"Memory-mapped Arrow load: {time.perf_counter() - start:.3f}s")
+
+    shared = zero_copy_columns(df, table)
+    print(f"\nZero-copy columns ({len(shared)}/{len(df.columns)}): {shared}")
+    print("\nCompact schema:")
+    print(table.schema)
@@ -0,0 +1,260 @@
+"""
+Execution Backends: pandas vs Arrow compute
+
+The same small set of operations - load, filter, derive the pickup hour,
+value counts, grouped aggregation and top-k - implemented twice:
+
+  - PandasBackend converts the Parquet data to NumPy-backed DataFrames
+    and uses the usual pandas methods,
+  - ArrowBackend keeps the data as Arrow tables and runs pyarrow.compute
+    kernels (hash aggregation, select_k), converting only the small final
+    result to pandas.
+
+Analyses written against the backend interface can switch between the
+two with get_backend(name), and the main block times each workload on
+both so the faster one can be picked per workload.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from taxi_data import DATA_FILE
+from trip_query import CLEAN_PREDICATES, evaluate_predicate, predicate_expression
+
+# pandas aggregation name -> Arrow hash aggregation (and its options)
+ARROW_AGGREGATIONS = {
+    'count': ('count', None),
+    'sum': ('sum', None),
+    'mean': ('mean', None),
+    'min': ('min', None),
+    'max': ('max', None),
+    'var': ('variance', pc.VarianceOptions(ddof=1)),
+    'std': ('stddev', pc.VarianceOptions(ddof=1)),
+    'approx_median': ('approximate_median', None),  # t-digest
+    'nunique': ('count_distinct', None),
+}
+
+# Aggregations whose name differs between the backends
+PANDAS_AGGREGATIONS = {'approx_median': 'median'}  # the exact median is a valid approximation
+
+
+class PandasBackend:
+    """Operations on pandas DataFrames"""
+
+    name = 'pandas'
+
+    def load(self, path, columns=None):
+        return pd.read_parquet(path, columns=columns)
+
+    def num_rows(self, data):
+        return len(data)
+
+    def filter(self, data, predicates):
+        mask = None
+        for column, op, value in predicates:
+            part = evaluate_predicate(data[column], op, value)
+            mask = part if mask is None else mask & part
+        return data if mask is None else data[mask]
+
+    def clean(self, data):
+        return self.filter(data, CLEAN_PREDICATES)
+
+    def with_hour(self, data, column='tpep_pickup_datetime', name='pickup_hour'):
+        return data.assign(**{name: data[column].dt.hour})
+
+    def value_counts(self, data, column):
+        return data[column].value_counts()
+
+    def group_agg(self, data, keys, aggs):
+        """Named aggregations {name: (column, func)}; func may be 'size'"""
+        aggs = {name: (column, PANDAS_AGGREGATIONS.get(func, func)) for name, (column, func) in aggs.items()}
+        return data.groupby(keys, observed=True).agg(**aggs).sort_index()
+
+    def top_k(self, data, column, k):
+        return data.nlargest(k, column).reset_index(drop=True)
+
+    def to_pandas(self, data):
+        return data
+
+
+class ArrowBackend:
+    """Operations on Arrow tables with pyarrow.compute kernels"""
+
+    name = 'arrow'
+
+    def load(self, path, columns=None):
+        return pq.read_table(path, columns=columns)
+
+    def num_rows(self, data):
+        return data.num_rows
+
+    def filter(self, data, predicates):
+        expression = None
+        for predicate in predicates:
+            part = predicate_expression(*predicate)
+            if part is None:
+                raise ValueError(f"Predicate not supported by the Arrow backend: {predicate!r}")
+            expression = part if expression is None else expression & part
+        return data if expression is None else data.filter(expression)
+
+    def clean(self, data):
+        return self.filter(data, CLEAN_PREDICATES)
+
+    def with_hour(self, data, column='tpep_pickup_datetime', name='pickup_hour'):
+        return data.append_column(name, pc.hour(data[column]))
+
+    def value_counts(self, data, column):
+        counts = pc.value_counts(data[column])
+        order = pc.sort_indices(counts.field('counts'), sort_keys=[('', 'descending')])
+        counts = counts.take(order)
+        return pd.Series(counts.field('counts').to_numpy(zero_copy_only=False),
+                         index=pd.Index(counts.field('values').to_pandas(), name=column),
+                         name='count')
+
+    def group_agg(self, data, keys, aggs):
+        """Named aggregations {name: (column, func)}; func may be 'size'"""
+        specs, outputs = [], {}
+        for name, (column, func) in aggs.items():
+            if func == 'size':
+                spec, output = ([], 'count_all'), 'count_all'
+            else:
+                if func == 'median':
+                    raise ValueError("The Arrow backend has no exact median; use 'approx_median' (t-digest)")
+                kernel, options = ARROW_AGGREGATIONS[func]
+                spec = (column, kernel, options) if options else (column, kernel)
+                output = f"{column}_{kernel}"
+            # Arrow names outputs by column and kernel; compute each once and copy it to every name
+            if output not in outputs.values():
+                specs.append(spec)
+            outputs[name] = output
+        result = data.group_by(keys, use_threads=True).aggregate(specs)
+        frame = result.to_pandas().set_index(keys).sort_index()
+        return pd.DataFrame({name: frame[output] for name, output in outputs.items()}, index=frame.index)
+
+    def top_k(self, data, column, k):
+        indices = pc.select_k_unstable(data, k, sort_keys=[(column, 'descending')])
+        return data.take(indices).to_pandas()
+
+    def to_pandas(self, data):
+        return data.to_pandas() if isinstance(data, pa.Table) else data
+
+
+BACKENDS = {'pandas': PandasBackend, 'arrow': ArrowBackend}
+
+
+def get_backend(name='pandas'):
+    """Backend instance by name ('pandas' or 'arrow')"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name} (available: {sorted(BACKENDS)})")
+    return BACKENDS[name]()
+
+
+# ----------------------------------------------------------------------
+# Workloads from the existing analyses, written against the interface
+# ----------------------------------------------------------------------
+def top_pickup_zones(backend, data, n=15):
+    return backend.value_counts(backend.clean(data), 'PULocationID').head(n)
+
+
+def hourly_pickups(backend, data):
+    hours = backend.with_hour(backend.clean(data))
+    return backend.value_counts(hours, 'pickup_hour').sort_index()
+
+
+def tips_by_passengers(backend, data):
+    trips = backend.filter(backend.clean(data), [('payment_type', '==', 1), ('fare_amount', '>', 0),
+                                                 ('tip_amount', '>=', 0)])
+    return backend.group_agg(trips, ['passenger_count'], {
+        'trips': ('tip_amount', 'size'),
+        'avg_tip': ('tip_amount', 'mean'),
+        'tip_std': ('tip_amount', 'std'),
+        'avg_fare': ('fare_amount', 'mean'),
+    })
+
+
+def od_pairs(backend, data):
+    return backend.group_agg(backend.clean(data), ['PULocationID', 'DOLocationID'],
+                             {'trips': ('fare_amount', 'size'), 'avg_fare': ('fare_amount', 'mean')})
+
+
+def repeated_aggregations(backend, data):
+    """Several names for the same size/column aggregation"""
+    return backend.group_agg(backend.clean(data), ['passenger_count'], {
+        'trips': ('fare_amount', 'size'),
+        'trips_again': ('tip_amount', 'size'),
+        'avg_fare': ('fare_amount', 'mean'),
+        'mean_fare': ('fare_amount', 'mean'),
+    })
+
+
+def highest_fares(backend, data, k=10):
+    return backend.top_k(backend.clean(data), 'fare_amount', k)[['PULocationID', 'DOLocationID', 'fare_amount']]
+
+
+WORKLOADS = {
+    'top pickup zones': top_pickup_zones,
+    'hourly pickups': hourly_pickups,
+    'tips by passengers': tips_by_passengers,
+    'OD pair stats': od_pairs,
+    'repeated aggs': repeated_aggregations,
+    'top-10 fares': highest_fares,
+}
+
+WORKLOAD_COLUMNS = ['tpep_pickup_datetime', 'PULocationID', 'DOLocationID', 'passenger_count',
+                    'trip_distance', 'payment_type', 'fare_amount', 'tip_amount']
+
+
+def compare_backends(path=DATA_FILE, workloads=None, repeats=3):
+    """Time every workload on every backend; returns (timings, results)"""
+    workloads = workloads or WORKLOADS
+    timings, results = {}, {}
+    for name in BACKENDS:
+        backend = get_backend(name)
+        start = time.perf_counter()
+        data = backend.load(path, columns=WORKLOAD_COLUMNS)
+        timings[('load', name)] = time.perf_counter() - start
+        for workload, run in workloads.items():
+            best = float('inf')
+            for _ in range(repeats):
+                start = time.perf_counter()
+                results[(workload, name)] = run(backend, data)
+                best = min(best, time.perf_counter() - start)
+            timings[(workload, name)] = best
+    table = pd.Series(timings).unstack().reindex(['load'] + list(workloads))[list(BACKENDS)]
+    table['speedup'] = table['pandas'] / table['arrow']
+    return table, results
+
+
+# Main execution
+if __name__ == "__main__":
+    print("=" * 70)
+    print("BACKEND COMPARISON - pandas vs Arrow compute")
+    print("=" * 70)
+
+    timings, results = compare_backends()
+    print("\nBest time per workload (seconds):")
+    print(timings.round(3).to_string())
+
+    print("\nResults agree:")
+    for workload in WORKLOADS:
+        expected = results[(workload, 'pandas')]
+        actual = results[(workload, 'arrow')]
+        if workload == 'top pickup zones':
+            # Ties may be ordered differently; compare the counts
+            same = (expected.to_numpy() == actual.to_numpy()).all()
+        elif workload == 'top-10 fares':
+            same = (expected['fare_amount'].to_numpy() == actual['fare_amount'].to_numpy()).all()
+        else:
+            expected, actual = expected.align(actual, join='outer')
+            same = ((expected - actual).abs() <= 1e-9 * (1 + expected.abs())).all(axis=None)
+        print(f"   {workload:<20} {'yes' if same else 'NO'}")
+
+    print("\nTipping by passenger count (Arrow backend):")
+    print(results[('tips by passengers', 'arrow')].round(2))
@@ -0,0 +1,241 @@
+"""
+Vectorized Bootstrap Significance Testing
+
+Bootstrap confidence intervals and permutation p-values for differences
+in group means (Solo vs Group, late-night vs daytime, per hour) on
+millions of rows.
+
+Resamples are processed in batches: a Poisson(1) bootstrap weight matrix
+is generated for a batch of resamples and a chunk of rows at a time, and
+the weighted sums come out of one matrix product, so memory stays bounded
+by `memory_mb` regardless of the row count. Batches are spread over a
+process pool with independent random streams.
+
+Poisson weights are drawn from a 16-bit lookup table (one uint16 random
+number and one table gather per weight), which matches Poisson(1) to
+within 2^-16 per probability and is several times faster than
+`Generator.poisson`.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_RESAMPLES = 2000
+
+# Shared arrays for the current job (set in the parent, inherited by workers)
+_ARRAYS = {}
+
+
+def _poisson_table(bits=16):
+    """Lookup table mapping uniform integers to Poisson(1) counts"""
+    size = 1 << bits
+    k = np.arange(16)
+    pmf = np.exp(-1.0) / np.array([math.factorial(i) for i in k])
+    edges = np.round(np.cumsum(pmf) * size).astype(np.int64)
+    edges[-1] = size
+    return np.searchsorted(edges, np.arange(size), side='right').astype(np.uint8)
+
+
+_POISSON_TABLE = _poisson_table()
+
+
+def _poisson_weights(rng, shape):
+    """Poisson(1) bootstrap weights as uint8"""
+    return _POISSON_TABLE[rng.integers(0, 1 << 16, size=shape, dtype=np.uint16)]
+
+
+def _bootstrap_task(args):
+    """Weighted sums and total weights for one batch of resamples"""
+    key, n_resamples, seed, row_chunk = args
+    values = _ARRAYS[key]
+    rng = np.random.default_rng(seed)
+    sums = np.zeros(n_resamples)
+    weights = np.zeros(n_resamples)
+    for start in range(0, len(values), row_chunk):
+        chunk = values[start:start + row_chunk]
+        w = _poisson_weights(rng, (n_resamples, len(chunk))).astype(np.float64)
+        sums += w @ chunk
+        weights += w.sum(axis=1)
+    return sums, weights
+
+
+def _permutation_task(args):
+    """Mean differences for one batch of label permutations"""
+    n_resamples, seed, n_a = args
+    pooled = _ARRAYS['pooled']
+    rng = np.random.default_rng(seed)
+    labels = np.zeros(len(pooled), dtype=bool)
+    labels[:n_a] = True
+    shuffled = rng.permuted(np.broadcast_to(labels, (n_resamples, len(pooled))), axis=1)
+    sum_a = np.where(shuffled, pooled, 0.0).sum(axis=1)
+    total = pooled.sum()
+    return sum_a / n_a - (total - sum_a) / (len(pooled) - n_a)
+
+
+class BootstrapEngine:
+    """Batched, chunked and parallel resampling of group means"""
+
+    def __init__(self, n_resamples=DEFAULT_RESAMPLES, batch_size=100, n_jobs=None,
+                 memory_mb=256, seed=42):
+        self.n_resamples = n_resamples
+        self.batch_size = batch_size
+        self.memory_mb = memory_mb
+        self.seed = np.random.SeedSequence(seed)
+
+        # Worker processes inherit the arrays by forking. Without fork (e.g.
+        # Windows) workers would re-run top-level analysis scripts, so the
+        # default falls back to a single process there.
+        self.can_fork = 'fork' in multiprocessing.get_all_start_methods()
+        if n_jobs is None:
+            n_jobs = os.cpu_count() if self.can_fork else 1
+        self.n_jobs = max(1, n_jobs)
+
+    def _batches(self, total):
+        sizes = [self.batch_size] * (total // self.batch_size)
+        if total % self.batch_size:
+            sizes.append(total % self.batch_size)
+        return sizes, self.seed.spawn(len(sizes))
+
+    def _map(self, func, tasks):
+        if self.n_jobs == 1 or len(tasks) == 1:
+            return [func(task) for task in tasks]
+        context = multiprocessing.get_context('fork' if self.can_fork else None)
+        with ProcessPoolExecutor(max_workers=self.n_jobs, mp_context=context) as pool:
+            return list(pool.map(func, tasks))
+
+    def _resampled_means(self, arrays):
+        """Bootstrap distribution of the mean for each named array"""
+        _ARRAYS.clear()
+        _ARRAYS.update(arrays)
+        # float64 weights plus the uint16/uint8 intermediates per cell
+        row_chunk = max(1, int(self.memory_mb * 1024**2 / (11 * self.batch_size)))
+        tasks = []
+        for key in arrays:
+            sizes, seeds = self._batches(self.n_resamples)
+            tasks += [(key, size, seed, row_chunk) for size, seed in zip(sizes, seeds)]
+        results = self._map(_bootstrap_task, tasks)
+        _ARRAYS.clear()
+
+        means, position = {}, 0
+        n_batches = math.ceil(self.n_resamples / self.batch_size)
+        for key in arrays:
+            sums = np.concatenate([r[0] for r in results[position:position + n_batches]])
+            weights = np.concatenate([r[1] for r in results[position:position + n_batches]])
+            means[key] = sums / np.where(weights > 0, weights, np.nan)
+            position += n_batches
+        return means
+
+    def mean_diff(self, a, b, confidence=0.95):
+        """Bootstrap CI and p-value for mean(a) - mean(b)"""
+        a = np.asarray(a, dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        a, b = a[~np.isnan(a)], b[~np.isnan(b)]
+        observed = a.mean() - b.mean()
+
+        means = self._resampled_means({'a': a, 'b': b})
+        diffs = means['a'] - means['b']
+        alpha = (1 - confidence) / 2
+        # Two-sided p-value from the bootstrap distribution shifted to the null
+        p_value = (np.sum(np.abs(diffs - observed) >= abs(observed)) + 1) / (len(diffs) + 1)
+        return {
+            'mean_a': a.mean(),
+            'mean_b': b.mean(),
+            'diff': observed,
+            'ci_low': np.nanquantile(diffs, alpha),
+            'ci_high': np.nanquantile(diffs, 1 - alpha),
+            'p_value': p_value,
+            'n_a': len(a),
+            'n_b': len(b),
+            'n_resamples': len(diffs),
+        }
+
+    def permutation_test(self, a, b, n_resamples=None):
+        """Two-sided permutation p-value for mean(a) - mean(b)"""
+        a = np.asarray(a, dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        a, b = a[~np.isnan(a)], b[~np.isnan(b)]
+        pooled = np.concatenate([a, b])
+        observed = a.mean() - b.mean()
+
+        # The label matrix is materialized per batch, so size it from the budget
+        total = n_resamples or self.n_resamples
+        per_batch = max(1, int(self.memory_mb * 1024**2 / (10 * len(pooled))))
+        sizes = [per_batch] * (total // per_batch) + ([total % per_batch] if total % per_batch else [])
+        seeds = self.seed.spawn(len(sizes))
+
+        _ARRAYS.clear()
+        _ARRAYS['pooled'] = pooled
+        diffs = np.concatenate(self._map(_permutation_task,
+                                         [(size, seed, len(a)) for size, seed in zip(sizes, seeds)]))
+        _ARRAYS.clear()
+
+        p_value = (np.sum(np.abs(diffs) >= abs(observed)) + 1) / (len(diffs) + 1)
+        return {'diff': observed, 'p_value': p_value, 'n_resamples': len(diffs)}
+
+    def group_means(self, values, groups, confidence=0.95):
+        """Bootstrap CI of the mean for every group (e.g. pickup hour)"""
+        frame = pd.DataFrame({'value': np.asarray(values, dtype=np.float64),
+                              'group': np.asarray(groups)}).dropna()
+        arrays = {key: part['value'].to_numpy() for key, part in frame.groupby('group')}
+        means = self._resampled_means(arrays)
+        alpha = (1 - confidence) / 2
+        rows = {
+            key: {
+                'count': len(arrays[key]),
+                'mean': arrays[key].mean(),
+                'ci_low': np.nanquantile(means[key], alpha),
+                'ci_high': np.nanquantile(means[key], 1 - alpha),
+            }
+            for key in arrays
+        }
+        return pd.DataFrame.from_dict(rows, orient='index').rename_axis('group')
+
+
+def print_comparison(label_a, label_b, result, permutation=None):
+    """Print a mean-difference test in the style of the analysis scripts"""
+    print(f"\n{label_a} vs {label_b}:")
+    print(f"  Means: {result['mean_a']:.2f} vs {result['mean_b']:.2f} "
+          f"(n = {result['n_a']:,} / {result['n_b']:,})")
+    print(f"  Difference: {result['diff']:+.3f} "
+          f"[95% CI {result['ci_low']:+.3f} to {result['ci_high']:+.3f}]")
+    print(f"  Bootstrap p-value: {result['p_value']:.4f} ({result['n_resamples']:,} resamples)")
+    if permutation is not None:
+        print(f"  Permutation p-value: {permutation['p_value']:.4f} "
+              f"({permutation['n_resamples']:,} permutations)")
+    significant = result['ci_low'] > 0 or result['ci_high'] < 0
+    print(f"  → {'Statistically significant' if significant else 'Not significant'} at the 5% level")
+
+
+# Main execution
+if __name__ == "__main__":
+    import time
+    from feature_store import load_trips_with_features
+
+    print("=" * 70)
+    print("BOOTSTRAP SIGNIFICANCE TESTS")
+    print("=" * 70)
+
+    df = load_trips_with_features(['payment_type', 'tip_amount'],
+                                  ['tip_percentage', 'rider_type', 'pickup_hour'])
+    df = df[(df['payment_type'] == 1) & (df['tip_amount'] >= 0) & (df['tip_percentage'] <= 100)]
+    print(f"\nCredit card trips: {len(df):,}")
+
+    engine = BootstrapEngine()
+    start = time.perf_counter()
+    solo = df.loc[df['rider_type'] == 'Solo', 'tip_percentage']
+    group = df.loc[df['rider_type'] == 'Group', 'tip_percentage']
+    print_comparison('Group', 'Solo', engine.mean_diff(group, solo))
+    print(f"  ({time.perf_counter() - start:.1f}s with {engine.n_jobs} worker(s))")
+
+    start = time.perf_counter()
+    hourly = engine.group_means(df['tip_percentage'], df['pickup_hour'])
+    print(f"\nMean tip % by pickup hour ({time.perf_counter() - start:.1f}s):")
+    print(hourly.round(2))
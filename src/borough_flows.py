@@ -12,6 +12,11 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+from spill_groupby import groupby_agg
+from zone_graph import ZoneGraph
 
 # Set style
 sns.set_style("whitegrid")
@@ -135,15 +140,39 @@ print("\n" + "=" * 70)
 print("TRIP CHARACTERISTICS BY TYPE")
 print("=" * 70)
 
+type_stats = groupby_agg(df_clean, 'trip_type', {'fare_amount': 'mean', 'trip_distance': 'mean'})
+
 print("\nWithin-Borough Trips:")
-within = df_clean[df_clean['trip_type'] == 'Within Borough']
-print(f"  Average fare: ${within['fare_amount'].mean():.2f}")
-print(f"  Average distance: {within['trip_distance'].mean():.2f} miles")
+within = type_stats.loc['Within Borough']
+print(f"  Average fare: ${within['fare_amount']:.2f}")
+print(f"  Average distance: {within['trip_distance']:.2f} miles")
 
 print("\nCross-Borough Trips:")
-cross = df_clean[df_clean['trip_type'] == 'Cross-Borough']
-print(f"  Average fare: ${cross['fare_amount'].mean():.2f}")
-print(f"  Average distance: {cross['trip_distance'].mean():.2f} miles")
+cross = type_stats.loc['Cross-Borough']
+print(f"  Average fare: ${cross['fare_amount']:.2f}")
+print(f"  Average distance: {cross['trip_distance']:.2f} miles")
+
+# Analysis 6: Zone-level network beneath the borough routes
+print("\n" + "=" * 70)
+print("ZONE NETWORK: IMBALANCE, ATTRACTIVENESS, CLUSTERS")
+print("=" * 70)
+
+graph = ZoneGraph.from_trips(df_clean)
+zone_names = zones.set_index('LocationID')['Zone']
+network = pd.DataFrame({'net_inflow': graph.net_inflow(), 'pagerank': graph.pagerank()})
+network = network[graph.in_strength() + graph.out_strength() > 0]
+network.insert(0, 'Zone', network.index.map(zone_names))
+
+print("\nZones drawing the most net arrivals:")
+print(network.nlargest(5, 'net_inflow').round(4).to_string())
+print("\nZones sending out the most net departures:")
+print(network.nsmallest(5, 'net_inflow').round(4).to_string())
+print("\nMost attractive zones (PageRank):")
+print(network.nlargest(5, 'pagerank').round(4).to_string())
+
+cluster_sizes = pd.Series(graph.strongly_connected_components()[network.index]).value_counts()
+print(f"\nStrongly connected clusters: {len(cluster_sizes)} "
+      f"(largest covers {cluster_sizes.iloc[0]} of {len(network)} active zones)")
 
 print("\n" + "=" * 70)
 print("✓ Borough flow analysis complete!")
@@ -0,0 +1,231 @@
+"""
+As-Of Context Join
+
+Attaches time-indexed context tables (hourly weather, holiday calendars,
+event schedules - any local CSV with a timestamp column) to trips.
+Instead of one pd.merge_asof per table on a re-sorted copy of the trips:
+
+  - the trips' pickup times are sorted once (argsort of an int64 array),
+  - every context table is sorted once when loaded and its columns are
+    encoded as compact float32 / int8 / int16 category codes,
+  - each table is joined with one searchsorted of the sorted pickup times
+    into its timestamps (most recent row at or before the pickup, within
+    a tolerance), and the looked-up values are scattered back to the
+    original trip order.
+
+Batches can be streamed through the same joiner, so a month (or a year)
+never has to be in memory at once.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from taxi_data import DATA_DIR, DATA_FILE
+
+CONTEXT_DIR = os.path.join(DATA_DIR, 'context')
+
+
+class ContextTable:
+    """A time-indexed table prepared for repeated as-of lookups"""
+
+    def __init__(self, name, data, time_column='time', columns=None, tolerance='1h', direction='backward'):
+        if direction not in ('backward', 'forward', 'nearest'):
+            raise ValueError(f"Unknown direction: {direction}")
+        frame = pd.read_csv(data) if isinstance(data, str) else data
+        frame = frame.dropna(subset=[time_column])
+        times = pd.to_datetime(frame[time_column]).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        order = np.argsort(times, kind='stable')
+
+        self.name = name
+        self.direction = direction
+        self.tolerance = pd.Timedelta(tolerance).value if tolerance is not None else None
+        self.times = times[order]
+        self.columns = {}
+        self.categories = {}
+        for column in columns or [c for c in frame.columns if c != time_column]:
+            values = frame[column].iloc[order]
+            self.columns[column], categories = self._encode(values)
+            if categories is not None:
+                self.categories[column] = categories
+
+    @classmethod
+    def from_csv(cls, name, path=None, **kwargs):
+        """Load data/context/<name>.csv (or an explicit path)"""
+        return cls(name, path or os.path.join(CONTEXT_DIR, f"{name}.csv"), **kwargs)
+
+    @staticmethod
+    def _encode(values):
+        """Compact representation: float32, int8 flags or integer category codes"""
+        if pd.api.types.is_bool_dtype(values):
+            return values.to_numpy(dtype=np.int8), None
+        if pd.api.types.is_numeric_dtype(values):
+            return values.to_numpy(dtype=np.float32, na_value=np.nan), None
+        codes, categories = pd.factorize(values)
+        dtype = np.int8 if len(categories) < 127 else np.int16 if len(categories) < 32767 else np.int32
+        return codes.astype(dtype), pd.Index(categories)
+
+    def lookup(self, sorted_times):
+        """Row index in this table for each (sorted) pickup time, -1 if none"""
+        times = self.times
+        if self.direction == 'forward':
+            index = np.searchsorted(times, sorted_times, side='left')
+            found = index < len(times)
+        else:
+            index = np.searchsorted(times, sorted_times, side='right') - 1
+            found = index >= 0
+            if self.direction == 'nearest':
+                after = np.minimum(index + 1, len(times) - 1)
+                before_gap = np.where(found, sorted_times - times[np.maximum(index, 0)], np.iinfo(np.int64).max)
+                after_gap = np.where(after > index, times[after] - sorted_times, np.iinfo(np.int64).max)
+                use_after = (after_gap < before_gap) & (after > index)
+                index = np.where(use_after, after, index)
+                found = found | use_after
+        index = np.where(found, index, -1)
+        if self.tolerance is not None:
+            gap = np.abs(sorted_times - times[np.maximum(index, 0)])
+            index = np.where((index >= 0) & (gap <= self.tolerance), index, -1)
+        return index
+
+    def take(self, column, index):
+        """Values of a column at looked-up rows (NaN / -1 where missing)"""
+        values = self.columns[column]
+        result = values[np.maximum(index, 0)]
+        if np.issubdtype(values.dtype, np.floating):
+            result = np.where(index >= 0, result, np.nan).astype(values.dtype)
+        else:
+            result = np.where(index >= 0, result, -1).astype(values.dtype)
+        return result
+
+
+class ContextJoiner:
+    """Join any number of context tables onto trips by pickup time"""
+
+    def __init__(self, tables, time_column='tpep_pickup_datetime', prefix=True):
+        self.tables = list(tables)
+        self.time_column = time_column
+        self.prefix = prefix
+
+    def _name(self, table, column):
+        return f"{table.name}_{column}" if self.prefix else column
+
+    def features(self, times):
+        """{feature name: array in the original order} for pickup times"""
+        times = np.asarray(times, dtype='datetime64[ns]').astype(np.int64)
+        order = np.argsort(times, kind='stable')  # the one sort of the trips
+        sorted_times = times[order]
+
+        features = {}
+        for table in self.tables:
+            index = table.lookup(sorted_times)
+            for column in table.columns:
+                values = np.empty(len(times), dtype=table.columns[column].dtype)
+                values[order] = table.take(column, index)
+                features[self._name(table, column)] = values
+        return features
+
+    def join(self, df):
+        """Copy of `df` with the context features appended"""
+        features = self.features(df[self.time_column].to_numpy())
+        return df.assign(**features)
+
+    def decode(self, df):
+        """Replace category codes with their labels (for display)"""
+        decoded = df.copy()
+        for table in self.tables:
+            for column, categories in table.categories.items():
+                name = self._name(table, column)
+                if name in decoded:
+                    decoded[name] = pd.Categorical.from_codes(decoded[name].to_numpy(), categories=categories)
+        return decoded
+
+    def join_batches(self, batches):
+        """Streaming join of an iterable of DataFrames"""
+        for df in batches:
+            yield self.join(df)
+
+    def iter_parquet(self, path=DATA_FILE, columns=None, batch_size=500_000):
+        """Stream a Parquet file in record batches with context attached"""
+        parquet = pq.ParquetFile(path)
+        batches = (batch.to_pandas() for batch in parquet.iter_batches(batch_size=batch_size, columns=columns))
+        return self.join_batches(batches)
+
+
+def holiday_table(start='2019-01-01', end='2025-12-31'):
+    """US federal holidays as a daily context table"""
+    from pandas.tseries.holiday import USFederalHolidayCalendar
+
+    calendar = USFederalHolidayCalendar()
+    days = pd.date_range(start, end, freq='D')
+    holidays = calendar.holidays(start, end)
+    return ContextTable('holiday', pd.DataFrame({'time': days, 'is_holiday': days.isin(holidays)}),
+                        tolerance='1D')
+
+
+def available_tables():
+    """Holiday calendar plus every CSV in data/context (time column 'time')"""
+    tables = [holiday_table()]
+    if os.path.isdir(CONTEXT_DIR):
+        for file_name in sorted(os.listdir(CONTEXT_DIR)):
+            if file_name.endswith('.csv'):
+                tables.append(ContextTable.from_csv(os.path.splitext(file_name)[0]))
+    return tables
+
+
+# Main execution
+if __name__ == "__main__":
+    import time
+    from taxi_data import load_clean_trips
+
+    print("=" * 70)
+    print("CONTEXT JOIN - trips x time-indexed context tables")
+    print("=" * 70)
+
+    df = load_clean_trips(columns=['tpep_pickup_datetime', 'PULocationID', 'fare_amount'])
+    print(f"\nTrips: {len(df):,}")
+
+    tables = available_tables()
+    # An hourly table to join alongside the calendar: the month's own hourly pickup volume
+    hourly = df.set_index('tpep_pickup_datetime').resample('h').size().rename('pickups').reset_index()
+    tables.append(ContextTable('volume', hourly.rename(columns={'tpep_pickup_datetime': 'time'})))
+    for table in tables:
+        print(f"   {table.name}: {len(table.times):,} rows, columns {list(table.columns)}")
+    if not os.path.isdir(CONTEXT_DIR):
+        print(f"   (put weather/event CSVs with a 'time' column in {CONTEXT_DIR} to join them too)")
+
+    joiner = ContextJoiner(tables)
+    start = time.perf_counter()
+    joined = joiner.join(df)
+    join_time = time.perf_counter() - start
+    print(f"\nsearchsorted join of {len(tables)} tables: {join_time:.2f}s")
+
+    start = time.perf_counter()
+    reference = df.sort_values('tpep_pickup_datetime')
+    reference['tpep_pickup_datetime'] = reference['tpep_pickup_datetime'].astype('datetime64[ns]')
+    for table in tables:
+        right = pd.DataFrame({'time': table.times.astype('datetime64[ns]'),
+                              **{f"{table.name}_{c}": v for c, v in table.columns.items()}})
+        reference = pd.merge_asof(reference, right, left_on='tpep_pickup_datetime', right_on='time',
+                                  tolerance=pd.Timedelta(table.tolerance), direction=table.direction) \
+            .drop(columns='time')
+    merge_time = time.perf_counter() - start
+    print(f"pd.merge_asof per table:            {merge_time:.2f}s ({merge_time / join_time:.1f}x slower)")
+
+    check = joined.sort_values('tpep_pickup_datetime', kind='stable')
+    same = all(np.allclose(check[c].to_numpy(dtype=float), reference[c].to_numpy(dtype=float), equal_nan=True)
+               for c in ['holiday_is_holiday', 'volume_pickups'])
+    print(f"Results match merge_asof: {same}")
+
+    streamed = sum(len(batch) for batch in joiner.iter_parquet(columns=['tpep_pickup_datetime'],
+                                                                batch_size=100_000))
+    print(f"Streamed batches joined: {streamed:,} rows")
+
+    print("\nTrips and average fare on holidays vs other days:")
+    summary = joined.groupby('holiday_is_holiday').agg(trips=('fare_amount', 'size'),
+                                                       avg_fare=('fare_amount', 'mean'))
+    print(summary.rename(index={0: 'Regular day', 1: 'Holiday', -1: 'Outside calendar'}).round(2))
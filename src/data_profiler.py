@@ -4,21 +4,103 @@ Automated Data Quality Profiler
 Analyzes dataset and automatically generates quality rules based on
 statistical patterns, distributions, and data characteristics.
 
+Also recommends the most compact safe representation for each column
+(integer downcast, float32 within a tolerance, categorical for low
+cardinality, boolean for Y/N flags, int32 cents for money), estimates
+the in-memory and on-disk savings, and emits a CompactSchema that the
+trip loaders apply directly.
+
 Author: Henrik
 Date: November 2024
 """
 
 import pandas as pd
 import numpy as np
+import io
+import json
 import os
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime
 
+# Column name fragments that mark money columns (stored as int32 cents when cent-exact)
+MONEY_HINTS = ('amount', 'fare', 'price', 'tip', 'toll', 'fee', 'surcharge', 'tax', 'extra')
+FLAG_VALUES = {'Y': True, 'N': False}
+INTEGER_TYPES = [np.int8, np.int16, np.int32, np.int64]
+FLOAT_TOLERANCE = 0.005  # max absolute error accepted for float32
+
+
+class CompactSchema:
+    """Per-column target dtypes recommended by DataProfiler, applied at load time"""
+    
+    def __init__(self, columns):
+        # {column: {'dtype': ..., 'kind': ...}}
+        self.columns = columns
+        
+    def apply(self, df):
+        """Convert the columns of df that the schema covers; raises ValueError
+        if the data no longer fits the recommended representation"""
+        converted = {}
+        for column, spec in self.columns.items():
+            if column not in df.columns:
+                continue
+            original = df[column]
+            values = original
+            if spec['kind'] == 'cents':
+                values = (values * 100).round()
+                if (np.abs(original * 100 - values) > 1e-6).any():
+                    raise ValueError(f"{column} has fractions of a cent; re-profile this data")
+            elif spec['kind'] == 'boolean':
+                values = values.map(FLAG_VALUES)
+                if (original.notna() & values.isna()).any():
+                    raise ValueError(f"{column} has values other than {list(FLAG_VALUES)}; re-profile this data")
+            elif spec['kind'] == 'integer downcast':
+                if (values.dropna() != np.round(values.dropna())).any():
+                    raise ValueError(f"{column} has non-integer values; re-profile this data")
+            elif spec['kind'] == 'float32':
+                error = np.abs(values.astype(np.float32).astype(np.float64) - values).max()
+                if error > spec.get('tolerance', FLOAT_TOLERANCE):
+                    raise ValueError(f"{column} loses {error:g} as float32; re-profile this data")
+            if spec['kind'] in ('cents', 'integer downcast'):
+                limits = np.iinfo(spec['dtype'].lower())
+                if values.min() < limits.min or values.max() > limits.max:
+                    raise ValueError(f"{column} does not fit in {spec['dtype']}; re-profile this data")
+            if (spec['dtype'] == 'bool' or spec['dtype'].startswith('int')) and values.isna().any():
+                raise ValueError(f"{column} has missing values but {spec['dtype']} is not nullable; "
+                                 f"re-profile this data")
+            converted[column] = values.astype(spec['dtype'])
+        return df.assign(**converted)
+    
+    def decode(self, df):
+        """Money columns back to dollars (float64)"""
+        money = {column: df[column].astype('float64') / 100
+                 for column, spec in self.columns.items() if spec['kind'] == 'cents' and column in df.columns}
+        return df.assign(**money)
+    
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.columns, f, indent=2)
+            
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+    
+
+def _parquet_bytes(values):
+    """Snappy Parquet size of a single column"""
+    buffer = io.BytesIO()
+    pq.write_table(pa.table({'column': values}), buffer)
+    return buffer.tell()
+
+
 class DataProfiler:
     """Automatically profile a dataset and suggest quality rules"""
     
-    def __init__(self, df):
+    def __init__(self, df, float_tolerance=FLOAT_TOLERANCE):
         self.df = df
         self.profile = {}
+        self.float_tolerance = float_tolerance  # max absolute error accepted for float32
         
     def generate_profile(self):
         """Generate comprehensive data profile"""
@@ -88,13 +170,74 @@ class DataProfiler:
         else:
             profile['most_common'] = col_data.value_counts().head(5).to_dict()
             
+        profile.update(self._recommend_dtype(column, col_data, profile))
         return profile
     
+    def _recommend_dtype(self, column, col_data, profile):
+        """Most compact safe dtype for a column and its estimated memory"""
+        rows = len(col_data)
+        nullable = profile['null_count'] > 0
+        recommendation = {'recommended_dtype': str(col_data.dtype), 'encoding': 'keep',
+                          'memory_bytes': int(col_data.memory_usage(index=False, deep=True))}
+        non_null = col_data.dropna()
+        
+        if len(non_null) == 0 or pd.api.types.is_bool_dtype(col_data) or \
+                pd.api.types.is_datetime64_any_dtype(col_data):
+            pass
+        
+        elif pd.api.types.is_numeric_dtype(col_data):
+            values = non_null.to_numpy(dtype=np.float64)
+            is_money = any(hint in column.lower() for hint in MONEY_HINTS)
+            
+            if is_money and np.abs(values * 100 - np.round(values * 100)).max() < 1e-6 and \
+                    np.abs(values).max() * 100 < np.iinfo(np.int32).max:
+                # Money is stored as cents even when this sample happens to hold whole dollars
+                recommendation.update(recommended_dtype='Int32' if nullable else 'int32',
+                                      encoding='cents')
+                
+            elif np.array_equal(values, np.round(values)):
+                # Integer-valued: smallest integer type that holds min..max
+                dtype = next(t for t in INTEGER_TYPES if np.iinfo(t).min <= profile['min'] and
+                             profile['max'] <= np.iinfo(t).max)
+                name = np.dtype(dtype).name
+                recommendation.update(recommended_dtype=name.capitalize() if nullable else name,
+                                      encoding='integer downcast')
+                
+            elif col_data.dtype == np.float64 and \
+                    np.abs(values.astype(np.float32) - values).max() <= self.float_tolerance:
+                recommendation.update(recommended_dtype='float32', encoding='float32')
+                
+        elif profile['unique_count'] <= 2 and set(non_null.unique()) <= set(FLAG_VALUES):
+            recommendation.update(recommended_dtype='boolean' if nullable else 'bool', encoding='boolean')
+            
+        elif profile['unique_count'] < 2 ** 15 and profile['unique_count'] <= 0.5 * len(non_null):
+            recommendation.update(recommended_dtype='category', encoding='categorical')
+            
+        if recommendation['recommended_dtype'] == str(col_data.dtype):
+            recommendation['encoding'] = 'keep'
+        recommendation['recommended_memory_bytes'] = self._estimate_memory(
+            col_data, recommendation['recommended_dtype'], recommendation['encoding'], rows, nullable)
+        return recommendation
+    
+    def _estimate_memory(self, col_data, dtype, encoding, rows, nullable):
+        """In-memory size of the column after conversion"""
+        if encoding == 'keep':
+            return int(col_data.memory_usage(index=False, deep=True))
+        if encoding == 'categorical':
+            uniques = pd.Series(col_data.dropna().unique())
+            code_bytes = 1 if len(uniques) < 2 ** 7 else 2
+            return int(rows * code_bytes + uniques.memory_usage(index=False, deep=True))
+        width = {'boolean': 1, 'bool': 1, 'float32': 4}.get(dtype) or np.dtype(dtype.lower()).itemsize
+        return int(rows * (width + (1 if nullable and dtype != 'float32' else 0)))
+    
     def _print_column_profile(self, column, profile):
         """Print profile for a column"""
         print(f"  Data Type: {profile['dtype']}")
         print(f"  Null Values: {profile['null_count']:,} ({profile['null_percentage']:.2f}%)")
         print(f"  Unique Values: {profile['unique_count']:,}")
+        if profile['encoding'] != 'keep':
+            saved = (profile['memory_bytes'] - profile['recommended_memory_bytes']) / 1024 ** 2
+            print(f"  Recommended Type: {profile['recommended_dtype']} ({profile['encoding']}, saves {saved:.1f} MB)")
         
         if 'min' in profile:  # Numeric
             print(f"\n  Statistics:")
@@ -165,6 +308,63 @@ class DataProfiler:
                 print(f"  [{severity.upper()}] {rule['description']}")
                 
         return rules
+    
+    def dtype_report(self, disk_sample=200_000):
+        """Recommended representation per column with memory and Parquet size estimates"""
+        if not self.profile:
+            self.profile = {column: self._profile_column(column) for column in self.df.columns}
+        schema = self.compact_schema()
+        sample = self.df.sample(n=min(disk_sample, len(self.df)), random_state=0)
+        scale = len(self.df) / max(len(sample), 1)
+        
+        rows = []
+        for column, profile in self.profile.items():
+            row = {
+                'column': column,
+                'dtype': profile['dtype'],
+                'recommended': profile['recommended_dtype'],
+                'encoding': profile['encoding'],
+                'memory_mb': profile['memory_bytes'] / 1024 ** 2,
+                'recommended_memory_mb': profile['recommended_memory_bytes'] / 1024 ** 2,
+            }
+            # On-disk estimate: write the column sample as Parquet before and after conversion
+            try:
+                row['disk_mb'] = _parquet_bytes(sample[column]) * scale / 1024 ** 2
+                converted = schema.apply(sample[[column]])[column] if column in schema.columns else sample[column]
+                row['recommended_disk_mb'] = _parquet_bytes(converted) * scale / 1024 ** 2
+            except (pa.ArrowException, TypeError, ValueError):
+                row['disk_mb'] = row['recommended_disk_mb'] = np.nan  # e.g. mixed int/str object columns
+            rows.append(row)
+            
+        report = pd.DataFrame(rows).set_index('column')
+        report['memory_saved_pct'] = (1 - report['recommended_memory_mb'] / report['memory_mb']) * 100
+        report['disk_saved_pct'] = (1 - report['recommended_disk_mb'] / report['disk_mb']) * 100
+        return report
+    
+    def compact_schema(self):
+        """CompactSchema with every column whose representation should change"""
+        if not self.profile:
+            self.profile = {column: self._profile_column(column) for column in self.df.columns}
+        columns = {}
+        for column, profile in self.profile.items():
+            if profile['encoding'] == 'keep':
+                continue
+            columns[column] = {'dtype': profile['recommended_dtype'], 'kind': profile['encoding']}
+            if profile['encoding'] == 'float32':
+                columns[column]['tolerance'] = self.float_tolerance  # re-checked on every apply
+        return CompactSchema(columns)
+
+
+def print_dtype_report(report):
+    """Print a dtype report with totals"""
+    print("\n" + "=" * 70)
+    print("COMPACT REPRESENTATION")
+    print("=" * 70)
+    print(report.round(2).to_string())
+    memory, recommended = report['memory_mb'].sum(), report['recommended_memory_mb'].sum()
+    print(f"\nIn memory: {memory:.1f} MB -> {recommended:.1f} MB ({(1 - recommended / memory) * 100:.0f}% smaller)")
+    disk = report[['disk_mb', 'recommended_disk_mb']].dropna().sum()
+    print(f"On disk (Parquet estimate): {disk['disk_mb']:.1f} MB -> {disk['recommended_disk_mb']:.1f} MB")
 
 
 # Main execution
@@ -185,6 +385,20 @@ if __name__ == "__main__":
     # Generate quality rule suggestions
     rules = profiler.suggest_quality_rules()
     
+    # Compact dtypes for the trips, applied by the loader
+    print_dtype_report(profiler.dtype_report())
+    schema = profiler.compact_schema()
+    schema.save(os.path.join('data', 'yellow_tripdata.schema.json'))
+    
+    import sys
+    sys.path.append(os.path.dirname(__file__))
+    from taxi_data import load_trips
+    compact = load_trips(data_file, schema=schema)
+    print(f"\nload_trips with the schema: {df.memory_usage(deep=True).sum() / 1024 ** 2:.1f} MB -> "
+          f"{compact.memory_usage(deep=True).sum() / 1024 ** 2:.1f} MB")
+    print(f"Fares identical after decoding cents: "
+          f"{schema.decode(compact)['fare_amount'].equals(df['fare_amount'])}")
+    
     print("\n" + "=" * 70)
     print("✓ Profiling complete!")
     print("=" * 70)
\ No newline at end of file
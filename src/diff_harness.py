@@ -0,0 +1,365 @@
+"""
+Differential Test Harness
+
+Runs every analysis twice - once through the straightforward pandas
+logic the scripts were written with, once through each optimized engine
+(row-group map-reduce, lazy TripQuery, Arrow backend, out-of-core
+group-by, grouped quantiles, sliding windows, sweep-line occupancy) - on
+a synthetic dataset and on the real month, compares the results within
+float tolerances and reports per-path speedups side by side.
+
+    python src/diff_harness.py                     # synthetic + real
+    python src/diff_harness.py --dataset synthetic --rows 1000000
+    python src/diff_harness.py --checks hourly_counts median_fare_by_hour
+
+Exits with status 1 if any path disagrees with the reference.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(__file__))
+from taxi_data import DATA_FILE, ZONES_FILE, load_clean_trips, make_synthetic_trips
+from rowgroup_mapreduce import MapReduceExecutor, HourlyCounts, ODCounts, FareHistogram
+from trip_query import TripQuery
+from backends import ArrowBackend, WORKLOAD_COLUMNS
+from spill_groupby import groupby_agg, groupby_size
+from grouped_quantile import grouped_quantile
+from zone_windows import ZoneWindows, month_bounds
+from occupancy import OccupancyAccumulator, CITYWIDE
+
+FARE_BINS = np.arange(0, 102, 2.0)
+
+
+def reference_clean(data_file, columns=None):
+    """The cleaning step exactly as the analysis scripts write it"""
+    df = pd.read_parquet(data_file, columns=columns)
+    return df[
+        (df['fare_amount'] >= 0) &
+        (df['trip_distance'] > 0) &
+        (df['trip_distance'] <= 100) &
+        (df['passenger_count'] > 0) &
+        (df['passenger_count'] <= 6)
+    ].copy()
+
+
+def credit_card_tips(df):
+    return df[(df['payment_type'] == 1) & (df['fare_amount'] > 0) & (df['tip_amount'] >= 0)]
+
+
+class Check:
+    """One analysis: a reference implementation and optimized candidates"""
+
+    def __init__(self, name, reference, candidates, rtol=1e-9, atol=1e-9, fill_value=None):
+        self.name = name
+        self.reference = reference
+        self.candidates = candidates  # {path: fn} or {path: (fn, rtol)}
+        self.rtol = rtol
+        self.atol = atol
+        self.fill_value = fill_value  # e.g. 0 for counts where a path reports empty groups
+
+    def candidate(self, path):
+        entry = self.candidates[path]
+        return entry if isinstance(entry, tuple) else (entry, self.rtol)
+
+
+def compare(expected, actual, rtol, atol, fill_value=None):
+    """(ok, max abs difference, detail) for Series, DataFrames or arrays"""
+    if isinstance(expected, (pd.Series, pd.DataFrame)):
+        if not isinstance(actual, type(expected)):
+            return False, np.nan, f"type {type(actual).__name__}"
+        if isinstance(expected, pd.DataFrame):
+            missing = set(expected.columns) - set(actual.columns)
+            if missing:
+                return False, np.nan, f"missing columns {sorted(missing)}"
+            actual = actual[expected.columns]
+        expected, actual = expected.align(actual, join='outer')
+        if fill_value is not None:
+            expected, actual = expected.fillna(fill_value), actual.fillna(fill_value)
+        expected = expected.to_numpy(dtype=np.float64)
+        actual = actual.to_numpy(dtype=np.float64)
+    else:
+        expected = np.asarray(expected, dtype=np.float64)
+        actual = np.asarray(actual, dtype=np.float64)
+        if expected.shape != actual.shape:
+            return False, np.nan, f"shape {actual.shape} != {expected.shape}"
+    close = np.isclose(actual, expected, rtol=rtol, atol=atol, equal_nan=True)
+    both = ~np.isnan(expected) & ~np.isnan(actual)
+    max_diff = float(np.abs(actual - expected)[both].max()) if both.any() else 0.0
+    detail = '' if close.all() else f"{int((~close).sum())} of {close.size} values differ"
+    return bool(close.all()), max_diff, detail
+
+
+def _timed(fn, args, repeats):
+    best, value = float('inf'), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        value = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return value, best
+
+
+# ----------------------------------------------------------------------
+# Checks
+# ----------------------------------------------------------------------
+def _hourly_reference(data_file, zones_file):
+    df = reference_clean(data_file)
+    return pd.to_datetime(df['tpep_pickup_datetime']).dt.hour.value_counts().sort_index()
+
+
+def _od_reference(data_file, zones_file):
+    return reference_clean(data_file).groupby(['PULocationID', 'DOLocationID']).size()
+
+
+def _od_mapreduce(data_file, zones_file):
+    (matrix,), _ = MapReduceExecutor(n_workers=1).run(data_file, [ODCounts()])
+    counts = matrix.stack()
+    return counts[counts > 0]
+
+
+def _tips_reference(data_file, zones_file):
+    tips = credit_card_tips(reference_clean(data_file))
+    return tips.groupby('passenger_count').agg(trips=('tip_amount', 'size'), avg_tip=('tip_amount', 'mean'),
+                                               avg_fare=('fare_amount', 'mean'))
+
+
+def _tips_arrow(data_file, zones_file):
+    backend = ArrowBackend()
+    trips = backend.filter(backend.clean(backend.load(data_file, WORKLOAD_COLUMNS)),
+                           [('payment_type', '==', 1), ('fare_amount', '>', 0), ('tip_amount', '>=', 0)])
+    return backend.group_agg(trips, ['passenger_count'], {
+        'trips': ('tip_amount', 'size'), 'avg_tip': ('tip_amount', 'mean'), 'avg_fare': ('fare_amount', 'mean')})
+
+
+def _tips_spill(data_file, zones_file):
+    tips = credit_card_tips(load_clean_trips(data_file, ['passenger_count', 'payment_type',
+                                                         'fare_amount', 'tip_amount']))
+    result = groupby_agg(tips, 'passenger_count', {'tip_amount': ['count', 'mean'], 'fare_amount': ['mean']},
+                         memory_budget_mb=1)
+    result.columns = ['trips', 'avg_tip', 'avg_fare']
+    return result
+
+
+def _tips_query(mode):
+    def run(data_file, zones_file):
+        query = TripQuery(data_file, zones_file).clean() \
+            .filter(('payment_type', '==', 1), ('fare_amount', '>', 0), ('tip_amount', '>=', 0)) \
+            .group_by('passenger_count') \
+            .agg(trips='size', avg_tip=('tip_amount', 'mean'), avg_fare=('fare_amount', 'mean'))
+        return query.collect(mode=mode, batch_size=100_000)
+    return run
+
+
+def _median_reference(data_file, zones_file):
+    df = reference_clean(data_file)
+    df['pickup_hour'] = pd.to_datetime(df['tpep_pickup_datetime']).dt.hour
+    return df.groupby('pickup_hour')['fare_amount'].median()
+
+
+def _median_engine(method):
+    def run(data_file, zones_file):
+        df = load_clean_trips(data_file, ['tpep_pickup_datetime', 'fare_amount'])
+        df['pickup_hour'] = df['tpep_pickup_datetime'].dt.hour
+        return grouped_quantile(df, 'pickup_hour', 'fare_amount', 0.5, method=method)[0.5]
+    return run
+
+
+def _median_spill(data_file, zones_file):
+    df = load_clean_trips(data_file, ['tpep_pickup_datetime', 'fare_amount'])
+    df['pickup_hour'] = df['tpep_pickup_datetime'].dt.hour
+    return groupby_agg(df, 'pickup_hour', {'fare_amount': 'median'}, memory_budget_mb=1)['fare_amount']
+
+
+def _histogram_reference(data_file, zones_file):
+    return np.histogram(reference_clean(data_file)['fare_amount'], bins=FARE_BINS)[0]
+
+
+def _histogram_mapreduce(data_file, zones_file):
+    (histogram,), _ = MapReduceExecutor(n_workers=1).run(data_file, [FareHistogram(FARE_BINS)])
+    return histogram.to_numpy()
+
+
+def _zones_reference(data_file, zones_file):
+    return reference_clean(data_file)['PULocationID'].value_counts().sort_index()
+
+
+def _zones_arrow(data_file, zones_file):
+    backend = ArrowBackend()
+    return backend.value_counts(backend.clean(backend.load(data_file, WORKLOAD_COLUMNS)), 'PULocationID').sort_index()
+
+
+def _routes_reference(data_file, zones_file):
+    df = reference_clean(data_file)
+    zones = pd.read_csv(zones_file)
+    df = df.merge(zones[['LocationID', 'Borough']], left_on='PULocationID', right_on='LocationID', how='left') \
+        .rename(columns={'Borough': 'PU_Borough'}).drop('LocationID', axis=1)
+    df = df.merge(zones[['LocationID', 'Borough']], left_on='DOLocationID', right_on='LocationID', how='left') \
+        .rename(columns={'Borough': 'DO_Borough'}).drop('LocationID', axis=1)
+    df['route'] = df['PU_Borough'] + ' → ' + df['DO_Borough']
+    return df['route'].value_counts().sort_index()
+
+
+def _window_zones(df, count=3):
+    return df['PULocationID'].value_counts().index[:count].tolist()
+
+
+def _windows_reference(data_file, zones_file):
+    df = reference_clean(data_file)
+    start, end = month_bounds(df['tpep_pickup_datetime'].to_numpy())
+    minutes = pd.date_range(pd.Timestamp(start), pd.Timestamp(end), freq='min', inclusive='left')
+    result = {}
+    for zone in _window_zones(df):
+        counts = df.loc[df['PULocationID'] == zone, 'tpep_pickup_datetime'].dt.floor('min').value_counts()
+        result[zone] = counts.reindex(minutes, fill_value=0).rolling(15, min_periods=1).sum().to_numpy()
+    return pd.DataFrame(result)
+
+
+def _windows_engine(data_file, zones_file):
+    df = load_clean_trips(data_file, ['tpep_pickup_datetime', 'PULocationID'])
+    zones = _window_zones(df)
+    rolling = ZoneWindows.from_trips(df, 'pickup').rolling(15, zones=zones)
+    return pd.DataFrame(rolling.T, columns=zones)
+
+
+def _occupancy_sample(start, end):
+    return np.arange(np.datetime64(start, 'm'), np.datetime64(end, 'm'), 61).astype('datetime64[ns]')
+
+
+def _occupancy_reference(data_file, zones_file):
+    df = pd.read_parquet(data_file, columns=['tpep_pickup_datetime', 'tpep_dropoff_datetime'])
+    duration = df['tpep_dropoff_datetime'] - df['tpep_pickup_datetime']
+    df = df[(duration >= pd.Timedelta(0)) & (duration <= pd.Timedelta(hours=24))]
+    start, end = month_bounds(df['tpep_pickup_datetime'].to_numpy())
+    first = df['tpep_pickup_datetime'].dt.floor('min').to_numpy()
+    last = np.maximum(df['tpep_dropoff_datetime'].dt.ceil('min').to_numpy(), first + np.timedelta64(1, 'm'))
+    return np.array([((first <= m) & (last > m)).sum() for m in _occupancy_sample(start, end)])
+
+
+def _occupancy_engine(data_file, zones_file):
+    df = pd.read_parquet(data_file, columns=['tpep_pickup_datetime', 'tpep_dropoff_datetime'])
+    start, end = month_bounds(df['tpep_pickup_datetime'].to_numpy())
+    series = OccupancyAccumulator().add_trips(df).series(start, end)[CITYWIDE]
+    return series.loc[_occupancy_sample(start, end)].to_numpy()
+
+
+def _query_series(build, column):
+    def run(data_file, zones_file):
+        return build(TripQuery(data_file, zones_file).clean()).collect(mode='memory')[column]
+    return run
+
+
+CHECKS = [
+    Check('hourly_counts', _hourly_reference, {
+        'mapreduce': lambda d, z: MapReduceExecutor(n_workers=1).run(d, [HourlyCounts()])[0][0],
+        'trip_query': _query_series(lambda q: q.group_by('pickup_hour').agg(trips='size'), 'trips'),
+        'arrow_backend': lambda d, z: ArrowBackend().value_counts(
+            ArrowBackend().with_hour(ArrowBackend().clean(ArrowBackend().load(d, WORKLOAD_COLUMNS))),
+            'pickup_hour').sort_index(),
+    }, fill_value=0),
+    Check('od_counts', _od_reference, {
+        'mapreduce': _od_mapreduce,
+        'trip_query': _query_series(lambda q: q.group_by('PULocationID', 'DOLocationID').agg(trips='size'),
+                                    'trips'),
+        'spill_groupby': lambda d, z: groupby_size(load_clean_trips(d, ['PULocationID', 'DOLocationID']),
+                                                   ['PULocationID', 'DOLocationID'], memory_budget_mb=1),
+    }, fill_value=0),
+    Check('tips_by_passengers', _tips_reference, {
+        'arrow_backend': _tips_arrow,
+        'spill_groupby': _tips_spill,
+        'trip_query': _tips_query('memory'),
+        'trip_query_streaming': _tips_query('streaming'),
+    }),
+    Check('median_fare_by_hour', _median_reference, {
+        'grouped_quantile': _median_engine('exact'),
+        'quantile_sketch': (_median_engine('sketch'), 0.01),
+        'spill_groupby': _median_spill,
+    }),
+    Check('fare_histogram', _histogram_reference, {'mapreduce': _histogram_mapreduce}),
+    Check('pickup_zone_counts', _zones_reference, {
+        'arrow_backend': _zones_arrow,
+        'trip_query': _query_series(lambda q: q.group_by('PULocationID').agg(trips='size'), 'trips'),
+    }, fill_value=0),
+    Check('borough_routes', _routes_reference, {
+        'trip_query': _query_series(lambda q: q.group_by('route').agg(trips='size'), 'trips'),
+    }, fill_value=0),
+    Check('rolling_15min_pickups', _windows_reference, {'zone_windows': _windows_engine}),
+    Check('occupancy', _occupancy_reference, {'sweep_line': _occupancy_engine}),
+]
+
+
+def run_checks(data_file, zones_file=ZONES_FILE, checks=None, repeats=1):
+    """Run reference and candidate paths; returns one row per (check, path)"""
+    rows = []
+    for check in checks or CHECKS:
+        expected, reference_time = _timed(check.reference, (data_file, zones_file), repeats)
+        for path in check.candidates:
+            fn, rtol = check.candidate(path)
+            try:
+                actual, path_time = _timed(fn, (data_file, zones_file), repeats)
+                ok, max_diff, detail = compare(expected, actual, rtol, check.atol, check.fill_value)
+            except Exception as error:  # A crashing path is a failed check, not a crashed harness
+                ok, max_diff, detail, path_time = False, np.nan, f"{type(error).__name__}: {error}", np.nan
+            rows.append({
+                'check': check.name,
+                'path': path,
+                'ok': ok,
+                'max_abs_diff': max_diff,
+                'reference_s': reference_time,
+                'path_s': path_time,
+                'speedup': reference_time / path_time if path_time else np.nan,
+                'detail': detail,
+            })
+    return pd.DataFrame(rows)
+
+
+def datasets(choice, rows, work_dir):
+    """{name: parquet path} for the requested datasets"""
+    result = {}
+    if choice in ('synthetic', 'all'):
+        path = os.path.join(work_dir, 'synthetic_trips.parquet')
+        make_synthetic_trips(rows).to_parquet(path, row_group_size=max(rows // 8, 1))
+        result['synthetic'] = path
+    if choice in ('real', 'all'):
+        if os.path.exists(DATA_FILE):
+            result['real'] = DATA_FILE
+        else:
+            print(f"Skipping real dataset: {DATA_FILE} not found")
+    return result
+
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare optimized engines against the pandas reference")
+    parser.add_argument('--dataset', choices=['synthetic', 'real', 'all'], default='all')
+    parser.add_argument('--rows', type=int, default=200_000, help="Rows in the synthetic dataset")
+    parser.add_argument('--repeats', type=int, default=1, help="Timing repeats (best is reported)")
+    parser.add_argument('--checks', nargs='*', help=f"Subset of: {', '.join(c.name for c in CHECKS)}")
+    args = parser.parse_args()
+
+    selected = [c for c in CHECKS if not args.checks or c.name in args.checks]
+    failures = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, path in datasets(args.dataset, args.rows, work_dir).items():
+            print("=" * 70)
+            print(f"DIFFERENTIAL CHECKS - {name} ({path})")
+            print("=" * 70)
+            results = run_checks(path, checks=selected, repeats=args.repeats)
+            table = results.drop(columns='detail').copy()
+            table['ok'] = table['ok'].map({True: 'PASS', False: 'FAIL'})
+            print(table.to_string(index=False, float_format=lambda v: f"{v:.3g}"))
+            for _, row in results[~results['ok']].iterrows():
+                print(f"   {row['check']} / {row['path']}: {row['detail']}")
+            failures += int((~results['ok']).sum())
+            print()
+
+    print(f"{'All paths agree with the reference.' if not failures else f'{failures} path(s) disagree.'}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,329 @@
+"""
+Monthly Drift Monitor
+
+Keeps a baseline profile of the trip data as small mergeable sketches
+and compares each new monthly file against it, without reloading the
+baseline data:
+
+  - numeric columns: null count plus a QuantileSketch (signed log bins,
+    1% relative accuracy); PSI over the baseline deciles and a KS
+    statistic computed on the shared bin grid,
+  - categorical columns (strings, flags, integer codes such as
+    passenger_count, RatecodeID or zone IDs): null count plus value
+    counts; PSI over the categories, new/vanished values and the change
+    in distinct count,
+  - timestamps: null count plus the hour-of-day mix.
+
+Profiles are built batch by batch, merge across files (a baseline can
+span several months) and are stored as JSON of a few tens of KB.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from grouped_quantile import QuantileSketch
+from taxi_data import DATA_DIR, DATA_FILE
+
+DRIFT_DIR = os.path.join(DATA_DIR, 'cache', 'drift')
+BASELINE_FILE = os.path.join(DRIFT_DIR, 'baseline.json')
+
+CATEGORY_LIMIT = 1000     # integer columns with at most this many values are categorical
+PSI_BUCKETS = 10
+PSI_EPSILON = 1e-4        # floor for empty buckets
+THRESHOLDS = {'psi': 0.2, 'ks': 0.1, 'median_shift_pct': 5.0, 'null_rate_pp': 1.0, 'new_category_pct': 0.1}
+
+
+def _is_integer_coded(values):
+    """Integer-valued numeric column with few distinct values"""
+    values = values.dropna()
+    if not pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return False
+    array = values.to_numpy(dtype=np.float64)
+    return np.array_equal(array, np.round(array)) and values.nunique() <= CATEGORY_LIMIT
+
+
+def column_kind(values):
+    """'numeric', 'categorical' or 'datetime'"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return 'datetime'
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values) \
+            and not _is_integer_coded(values):
+        return 'numeric'
+    return 'categorical'
+
+
+def _category_labels(values):
+    """Stable string labels for distinct values (1.0 and 1 are the same category)"""
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        array = np.asarray(values, dtype=np.float64)
+        whole = array == np.round(array)
+        return np.where(whole, np.where(whole, array, 0).astype(np.int64).astype(str), array.astype(str))
+    return np.asarray(values).astype(str)
+
+
+class ColumnSketch:
+    """Null count plus a distribution sketch for one column"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.nulls = 0
+        self.sketch = QuantileSketch() if kind == 'numeric' else None
+        self.counts = {}
+
+    def add(self, values):
+        self.rows += len(values)
+        self.nulls += int(values.isna().sum())
+        if self.kind == 'numeric':
+            array = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            self.sketch.add(np.zeros(len(array), dtype=np.int64), array)
+            return self
+        # Count raw values first, so only the distinct values are turned into labels
+        counts = (values.dt.hour if self.kind == 'datetime' else values).value_counts()
+        for label, count in zip(_category_labels(counts.index).tolist(), counts.to_numpy()):
+            self.counts[label] = self.counts.get(label, 0) + int(count)
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.nulls += other.nulls
+        if self.kind == 'numeric':
+            self.sketch.merge(other.sketch)
+        for label, count in other.counts.items():
+            self.counts[label] = self.counts.get(label, 0) + count
+        return self
+
+    @property
+    def null_rate(self):
+        return self.nulls / self.rows * 100 if self.rows else 0.0
+
+    def to_dict(self):
+        data = {'kind': self.kind, 'rows': self.rows, 'nulls': self.nulls, 'counts': self.counts}
+        if self.kind == 'numeric':
+            data['sketch'] = {'relative_accuracy': self.sketch.relative_accuracy,
+                              'min_value': self.sketch.min_value, 'max_value': self.sketch.max_value,
+                              'bins': (self.sketch.keys % self.sketch.width).tolist(),
+                              'counts': self.sketch.counts.tolist()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        column = cls(data['kind'])
+        column.rows, column.nulls, column.counts = data['rows'], data['nulls'], data['counts']
+        if column.kind == 'numeric':
+            settings = data['sketch']
+            column.sketch = QuantileSketch(settings['relative_accuracy'], settings['min_value'],
+                                           settings['max_value'])
+            column.sketch.keys = np.asarray(settings['bins'], dtype=np.int64)
+            column.sketch.counts = np.asarray(settings['counts'], dtype=np.int64)
+        return column
+
+
+class DriftProfile:
+    """Mergeable sketches for every column of a dataset"""
+
+    def __init__(self, columns=None, sources=None):
+        self.columns = columns or {}
+        self.sources = sources or []
+
+    @classmethod
+    def from_frame(cls, df, kinds=None, source=None):
+        """Profile a DataFrame; `kinds` pins column kinds to those of a baseline"""
+        profile = cls(sources=[source] if source else [])
+        return profile.add(df, kinds)
+
+    @classmethod
+    def from_parquet(cls, path, kinds=None, batch_size=1_000_000):
+        """Profile a Parquet file batch by batch (all columns, so new ones are reported)"""
+        profile = cls(sources=[os.path.basename(path)])
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            profile.add(batch.to_pandas(), kinds)
+        return profile
+
+    def add(self, df, kinds=None):
+        for column in df.columns:
+            if column not in self.columns:
+                kind = (kinds or {}).get(column) or column_kind(df[column])
+                self.columns[column] = ColumnSketch(kind)
+            self.columns[column].add(df[column])
+        return self
+
+    def merge(self, other):
+        for column, sketch in other.columns.items():
+            if column in self.columns:
+                self.columns[column].merge(sketch)
+            else:
+                self.columns[column] = sketch
+        self.sources += other.sources
+        return self
+
+    def kinds(self):
+        return {column: sketch.kind for column, sketch in self.columns.items()}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'sources': self.sources,
+                       'columns': {c: s.to_dict() for c, s in self.columns.items()}}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls({c: ColumnSketch.from_dict(d) for c, d in data['columns'].items()}, data['sources'])
+
+
+def psi(expected, actual, epsilon=PSI_EPSILON):
+    """Population stability index between two count vectors over the same buckets"""
+    expected = np.maximum(np.asarray(expected, dtype=np.float64) / max(np.sum(expected), 1), epsilon)
+    actual = np.maximum(np.asarray(actual, dtype=np.float64) / max(np.sum(actual), 1), epsilon)
+    return float(((actual - expected) * np.log(actual / expected)).sum())
+
+
+def _bin_counts(sketch, bins):
+    """Counts of a numeric sketch on a given sorted bin grid"""
+    counts = np.zeros(len(bins), dtype=np.int64)
+    counts[np.searchsorted(bins, sketch.sketch.keys)] = sketch.sketch.counts
+    return counts
+
+
+def numeric_drift(base, new, buckets=PSI_BUCKETS):
+    """PSI over the baseline's quantile buckets and KS on the shared bin grid"""
+    if base.sketch.counts.sum() == 0 or new.sketch.counts.sum() == 0:
+        return {'psi': np.nan, 'ks': np.nan}
+    bins = np.union1d(base.sketch.keys, new.sketch.keys)
+    base_counts, new_counts = _bin_counts(base, bins), _bin_counts(new, bins)
+    base_cdf = np.cumsum(base_counts) / base_counts.sum()
+    new_cdf = np.cumsum(new_counts) / new_counts.sum()
+
+    # Bucket edges: the bins where the baseline CDF crosses each decile
+    edges = np.unique(np.searchsorted(base_cdf, np.arange(1, buckets) / buckets))
+    bucket = np.searchsorted(edges, np.arange(len(bins)), side='left')
+    _, quantiles, _ = base.sketch.quantiles([0.5])
+    _, new_quantiles, _ = new.sketch.quantiles([0.5])
+    base_median, new_median = float(quantiles[0, 0]), float(new_quantiles[0, 0])
+    return {
+        'psi': psi(np.bincount(bucket, weights=base_counts), np.bincount(bucket, weights=new_counts)),
+        'ks': float(np.abs(base_cdf - new_cdf).max()),
+        'baseline_median': base_median,
+        'median': new_median,
+        # Level shifts (e.g. a fare increase) that move every value a little and barely register in PSI/KS
+        'median_shift_pct': (new_median - base_median) / abs(base_median) * 100 if base_median else np.nan,
+    }
+
+
+def categorical_drift(base, new):
+    """PSI over categories, new/vanished values and distinct-count change"""
+    labels = sorted(set(base.counts) | set(new.counts))
+    base_counts = np.asarray([base.counts.get(label, 0) for label in labels])
+    new_counts = np.asarray([new.counts.get(label, 0) for label in labels])
+    new_labels = [label for label in labels if label not in base.counts]
+    total = max(new_counts.sum(), 1)
+    return {
+        'psi': psi(base_counts, new_counts) if len(labels) else np.nan,
+        'new_categories': new_labels[:10],
+        'new_category_pct': sum(new.counts[label] for label in new_labels) / total * 100,
+        'vanished_categories': [label for label in labels if label not in new.counts][:10],
+        'distinct_change': len(new.counts) - len(base.counts),
+    }
+
+
+def drift_report(baseline, profile, thresholds=THRESHOLDS):
+    """One row per column with drift metrics and the alerts they trigger"""
+    rows = []
+    for column, base in baseline.columns.items():
+        new = profile.columns.get(column)
+        if new is None:
+            rows.append({'column': column, 'kind': base.kind, 'alerts': 'missing column'})
+            continue
+        row = {'column': column, 'kind': base.kind, 'baseline_null_pct': base.null_rate,
+               'null_pct': new.null_rate}
+        row.update(numeric_drift(base, new) if base.kind == 'numeric' else categorical_drift(base, new))
+
+        alerts = []
+        if abs(new.null_rate - base.null_rate) > thresholds['null_rate_pp']:
+            alerts.append('null rate')
+        if row.get('psi', 0) > thresholds['psi']:
+            alerts.append('distribution (PSI)')
+        if row.get('ks', 0) > thresholds['ks']:
+            alerts.append('distribution (KS)')
+        if abs(row.get('median_shift_pct', 0)) > thresholds['median_shift_pct']:
+            alerts.append('median shift')
+        if row.get('new_category_pct', 0) > thresholds['new_category_pct']:
+            alerts.append('new values')
+        row['alerts'] = ', '.join(alerts)
+        rows.append(row)
+    for column in profile.columns:
+        if column not in baseline.columns:
+            rows.append({'column': column, 'kind': profile.columns[column].kind, 'alerts': 'new column'})
+    return pd.DataFrame(rows).set_index('column')
+
+
+def print_drift_report(report, title):
+    print("\n" + "=" * 70)
+    print(f"DRIFT: {title}")
+    print("=" * 70)
+    columns = [c for c in ['kind', 'baseline_null_pct', 'null_pct', 'psi', 'ks', 'baseline_median',
+                           'median', 'median_shift_pct', 'new_category_pct', 'distinct_change', 'alerts'] if c in report]
+    print(report[columns].round(3).fillna('').to_string())
+    alerted = report[report['alerts'] != '']
+    for column, row in alerted.iterrows():
+        detail = f" {row['new_categories']}" if isinstance(row.get('new_categories'), list) and row['new_categories'] else ''
+        print(f"  ! {column}: {row['alerts']}{detail}")
+    if alerted.empty:
+        print("  No drift alerts")
+
+
+# Main execution
+if __name__ == "__main__":
+    import tempfile
+    import time
+    from fleet_schema import find_trip_files
+    from taxi_data import make_synthetic_trips
+
+    parser = argparse.ArgumentParser(description="Compare monthly trip files against a baseline profile")
+    parser.add_argument('files', nargs='*', help="Parquet files to check (default: yellow files + a synthetic month)")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="Baseline profile (JSON)")
+    parser.add_argument('--build', nargs='*', help="Rebuild the baseline from these files first")
+    args = parser.parse_args()
+
+    if args.build or not os.path.exists(args.baseline):
+        sources = args.build or [DATA_FILE]
+        start = time.perf_counter()
+        baseline = DriftProfile()
+        for path in sources:
+            baseline.merge(DriftProfile.from_parquet(path, baseline.kinds() or None))
+        baseline.save(args.baseline)
+        print(f"Baseline from {', '.join(sources)}: {time.perf_counter() - start:.2f}s, "
+              f"{os.path.getsize(args.baseline) / 1024:.0f} KB at {args.baseline}")
+    baseline = DriftProfile.load(args.baseline)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        files = args.files
+        if not files:
+            files = find_trip_files(fleets=['yellow']).get('yellow', [])
+            # A synthetic month with drift to detect: a fare increase, a new rate code,
+            # more missing passenger counts and a new fee column
+            synthetic = os.path.join(work_dir, 'yellow_tripdata_synthetic.parquet')
+            month = make_synthetic_trips(300_000, seed=7, month='2024-02')
+            rng = np.random.default_rng(7)
+            month['fare_amount'] = (month['fare_amount'] * 1.15).round(2)
+            month.loc[rng.random(len(month)) < 0.03, 'RatecodeID'] = 6.0
+            month.loc[rng.random(len(month)) < 0.08, 'passenger_count'] = np.nan
+            month['cbd_congestion_fee'] = np.where(rng.random(len(month)) < 0.6, 0.75, 0.0)
+            month.to_parquet(synthetic)
+            files = files + [synthetic]
+
+        for path in files:
+            start = time.perf_counter()
+            profile = DriftProfile.from_parquet(path, baseline.kinds())
+            report = drift_report(baseline, profile)
+            print_drift_report(report, f"{os.path.basename(path)} ({time.perf_counter() - start:.2f}s)")
@@ -0,0 +1,248 @@
+"""
+Fare Audit Engine
+
+Computes the fare every yellow taxi trip should have been charged and
+flags trips whose fare_amount falls outside it, in one vectorized pass
+over NumPy arrays (no row-wise apply):
+
+  - standard metered trips: $3.00 initial charge plus $0.70 per 1/5 mile
+    above 12 mph or per minute below it. Distance and duration alone do
+    not say how the trip split between the two, so the fare must lie
+    between the all-distance and distance-plus-every-minute bounds; the
+    constant-speed fare is reported as the expected value,
+  - JFK <-> Manhattan (RatecodeID 2, or a metered trip between the two):
+    flat fare,
+  - Newark (RatecodeID 3, or a dropoff at EWR): metered fare plus the
+    Newark surcharge,
+  - Nassau/Westchester (RatecodeID 4): metered inside the city, double
+    outside, so anywhere between one and two times the meter,
+  - negotiated and group rides, unknown rate codes and impossible
+    durations are not audited.
+
+Time-of-day surcharges (overnight, weekday rush hour) are expected in
+`extra` and audited separately. Tariffs are looked up per trip by pickup
+date, so a year spanning a fare change is audited in one pass.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Effective date -> tariff (TLC fare increase of 19 December 2022)
+TARIFFS = pd.DataFrame([
+    {'start': '2000-01-01', 'initial': 2.50, 'per_mile': 2.50, 'per_minute': 0.50,
+     'jfk_flat': 52.00, 'newark_surcharge': 17.50, 'night': 0.50, 'rush': 1.00},
+    {'start': '2022-12-19', 'initial': 3.00, 'per_mile': 3.50, 'per_minute': 0.70,
+     'jfk_flat': 70.00, 'newark_surcharge': 20.00, 'night': 1.00, 'rush': 2.50},
+])
+
+JFK_ZONE = 132
+NEWARK_ZONE = 1
+
+RULES = ['metered', 'jfk_flat', 'newark', 'nassau_westchester', 'not_audited']
+
+AUDIT_COLUMNS = ['VendorID', 'tpep_pickup_datetime', 'tpep_dropoff_datetime', 'RatecodeID',
+                 'trip_distance', 'PULocationID', 'DOLocationID', 'fare_amount', 'extra']
+
+
+def tariff_arrays(pickup_times, tariffs=TARIFFS):
+    """Per-trip tariff columns, selected by pickup date"""
+    starts = pd.to_datetime(tariffs['start']).to_numpy(dtype='datetime64[ns]')
+    row = np.searchsorted(starts, np.asarray(pickup_times, dtype='datetime64[ns]'), side='right') - 1
+    row = np.maximum(row, 0)
+    return {column: tariffs[column].to_numpy(dtype=np.float64)[row]
+            for column in tariffs.columns if column != 'start'}
+
+
+def expected_surcharge(pickup_times, tariff):
+    """Overnight (8pm-6am) and weekday rush hour (4pm-8pm) surcharges"""
+    times = pd.DatetimeIndex(np.asarray(pickup_times, dtype='datetime64[ns]'))
+    hour = times.hour.to_numpy()
+    weekday = times.dayofweek.to_numpy() < 5
+    night = (hour >= 20) | (hour < 6)
+    rush = weekday & (hour >= 16) & (hour < 20)
+    return np.where(night, tariff['night'], 0.0) + np.where(rush, tariff['rush'], 0.0)
+
+
+class FareAudit:
+    """Expected fare bounds and deviation flags for trip DataFrames"""
+
+    def __init__(self, zones, tolerance=1.00, relative_tolerance=0.05, tariffs=TARIFFS):
+        self.tolerance = tolerance
+        self.relative_tolerance = relative_tolerance
+        self.tariffs = tariffs
+        self.manhattan = np.zeros(max(zones.index.max() + 1, 266), dtype=bool)
+        self.manhattan[zones.index[zones['Borough'] == 'Manhattan'].to_numpy()] = True
+
+    def _is_manhattan(self, zone_ids):
+        zone_ids = np.asarray(zone_ids, dtype=np.int64)
+        inside = (zone_ids >= 0) & (zone_ids < len(self.manhattan))
+        return inside & self.manhattan[np.where(inside, zone_ids, 0)]
+
+    def rules(self, df):
+        """Fare rule that applies to each trip (index into RULES)"""
+        ratecode = df['RatecodeID'].to_numpy(dtype=np.float64, na_value=np.nan)
+        pickup = df['PULocationID'].to_numpy(dtype=np.int64)
+        dropoff = df['DOLocationID'].to_numpy(dtype=np.int64)
+        jfk_manhattan = (((pickup == JFK_ZONE) & self._is_manhattan(dropoff)) |
+                         ((dropoff == JFK_ZONE) & self._is_manhattan(pickup)))
+        conditions = [
+            ratecode == 2,
+            (ratecode == 1) & jfk_manhattan,
+            (ratecode == 3) | ((ratecode == 1) & (dropoff == NEWARK_ZONE)),
+            ratecode == 4,
+            ratecode == 1,
+        ]
+        choices = [RULES.index('jfk_flat'), RULES.index('jfk_flat'), RULES.index('newark'),
+                   RULES.index('nassau_westchester'), RULES.index('metered')]
+        return np.select(conditions, choices, default=RULES.index('not_audited'))
+
+    def audit(self, df):
+        """Per-trip expected fare, bounds, deviation and flags"""
+        pickup_times = df['tpep_pickup_datetime'].to_numpy(dtype='datetime64[ns]')
+        dropoff_times = df['tpep_dropoff_datetime'].to_numpy(dtype='datetime64[ns]')
+        distance = df['trip_distance'].to_numpy(dtype=np.float64)
+        fare = df['fare_amount'].to_numpy(dtype=np.float64)
+        minutes = (dropoff_times - pickup_times) / np.timedelta64(1, 'm')
+        tariff = tariff_arrays(pickup_times, self.tariffs)
+
+        # Meter: one unit per 1/5 mile above 12 mph or per minute below, same price per unit
+        distance_units = distance * tariff['per_mile'] / tariff['per_minute']
+        constant_speed = tariff['initial'] + tariff['per_minute'] * np.maximum(distance_units, minutes)
+        meter_low = tariff['initial'] + tariff['per_mile'] * distance
+        meter_high = meter_low + tariff['per_minute'] * minutes
+
+        rule = self.rules(df)
+        expected = np.select(
+            [rule == RULES.index('jfk_flat'), rule == RULES.index('newark'),
+             rule == RULES.index('nassau_westchester'), rule == RULES.index('metered')],
+            [tariff['jfk_flat'], constant_speed + tariff['newark_surcharge'],
+             constant_speed, constant_speed], default=np.nan)
+        low = np.select(
+            [rule == RULES.index('jfk_flat'), rule == RULES.index('newark')],
+            [tariff['jfk_flat'], meter_low + tariff['newark_surcharge']], default=meter_low)
+        high = np.select(
+            [rule == RULES.index('jfk_flat'), rule == RULES.index('newark'),
+             rule == RULES.index('nassau_westchester')],
+            [tariff['jfk_flat'], meter_high + tariff['newark_surcharge'], 2 * meter_high - tariff['initial']],
+            default=meter_high)
+
+        invalid = np.isnan(distance) | np.isnan(minutes) | (minutes < 0) | (distance < 0) | np.isnan(fare)
+        rule = np.where(invalid, RULES.index('not_audited'), rule)
+        audited = rule != RULES.index('not_audited')
+
+        slack_low = self.tolerance + self.relative_tolerance * low
+        slack_high = self.tolerance + self.relative_tolerance * high
+        under = audited & (fare < low - slack_low)
+        over = audited & (fare > high + slack_high)
+
+        result = pd.DataFrame({
+            'rule': pd.Categorical.from_codes(rule, RULES),
+            'expected_fare': np.where(audited, expected, np.nan),
+            'fare_low': np.where(audited, low, np.nan),
+            'fare_high': np.where(audited, high, np.nan),
+            'deviation': np.where(audited, fare - expected, np.nan),
+            'undercharged': under,
+            'overcharged': over,
+            'flagged': under | over,
+        }, index=df.index)
+        if 'extra' in df:
+            surcharge = expected_surcharge(pickup_times, tariff)
+            extra = df['extra'].to_numpy(dtype=np.float64, na_value=np.nan)
+            result['expected_surcharge'] = surcharge
+            result['surcharge_missing'] = audited & (extra < surcharge - 0.01)
+        return result
+
+    def summarize(self, df, audited, by):
+        """Audited trips, flag counts and flag rate per group (column names or Series)"""
+        frame = audited[['flagged', 'undercharged', 'overcharged']].copy()
+        frame['audited'] = audited['rule'] != 'not_audited'
+        frame['abs_deviation'] = audited['deviation'].abs()
+        by = [by] if isinstance(by, (str, pd.Series)) else by
+        keys = [df[key] if isinstance(key, str) else key for key in by]
+        summary = frame.groupby(keys, observed=True).agg(
+            trips=('audited', 'size'), audited=('audited', 'sum'), flagged=('flagged', 'sum'),
+            undercharged=('undercharged', 'sum'), overcharged=('overcharged', 'sum'),
+            mean_abs_deviation=('abs_deviation', 'mean'))
+        summary['flag_rate_pct'] = summary['flagged'] / summary['audited'].where(summary['audited'] > 0) * 100
+        return summary
+
+
+def audit_parquet(path, audit, group_columns=('PULocationID', 'VendorID', 'hour'), batch_size=1_000_000):
+    """
+    Stream a trip file and return per-(zone, vendor, hour) flag counts;
+    batches are audited independently and their counts added, so a year
+    of files never has to be in memory at once
+    """
+    parquet = pq.ParquetFile(path)
+    columns = [c for c in AUDIT_COLUMNS if c in parquet.schema_arrow.names]
+    partials = []
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+        df = batch.to_pandas()
+        df['hour'] = df['tpep_pickup_datetime'].dt.hour
+        summary = audit.summarize(df, audit.audit(df), list(group_columns))
+        summary['deviation_sum'] = summary['mean_abs_deviation'].fillna(0) * summary['audited']
+        partials.append(summary.drop(columns=['mean_abs_deviation', 'flag_rate_pct']))
+    combined = pd.concat(partials).groupby(level=list(range(len(group_columns)))).sum()
+    combined['mean_abs_deviation'] = combined.pop('deviation_sum') / combined['audited'].where(combined['audited'] > 0)
+    combined['flag_rate_pct'] = combined['flagged'] / combined['audited'].where(combined['audited'] > 0) * 100
+    return combined
+
+
+def rollup(combined, level):
+    """Collapse a streamed (zone, vendor, hour) summary to one of its levels"""
+    summary = combined.drop(columns=['mean_abs_deviation', 'flag_rate_pct']).groupby(level=level).sum()
+    summary['flag_rate_pct'] = summary['flagged'] / summary['audited'].where(summary['audited'] > 0) * 100
+    return summary
+
+
+# Main execution
+if __name__ == "__main__":
+    import time
+    from taxi_data import DATA_FILE, load_clean_trips, load_zones
+
+    print("=" * 70)
+    print("FARE AUDIT - expected vs charged fares")
+    print("=" * 70)
+
+    df = load_clean_trips(columns=AUDIT_COLUMNS + ['payment_type'])
+    zones = load_zones()
+    audit = FareAudit(zones)
+    print(f"\nTrips: {len(df):,}")
+
+    start = time.perf_counter()
+    audited = audit.audit(df)
+    print(f"Vectorized audit: {time.perf_counter() - start:.2f}s")
+
+    print("\nTrips by fare rule:")
+    rule_summary = audit.summarize(df, audited, audited['rule'])
+    print(rule_summary.round(2).to_string())
+
+    # The $68-72 spike from investigate_spike.py, now explained by rule
+    spike = df['fare_amount'].between(68, 72)
+    print(f"\nTrips with $68-72 fares: {spike.sum():,}")
+    print(audited.loc[spike, 'rule'].value_counts().to_string())
+
+    print("\nFlag rate by vendor:")
+    print(audit.summarize(df, audited, 'VendorID').round(2).to_string())
+
+    by_zone = audit.summarize(df, audited, 'PULocationID')
+    by_zone = by_zone[by_zone['audited'] >= 500]
+    by_zone.insert(0, 'Zone', by_zone.index.map(zones['Zone']))
+    print("\nPickup zones with the highest flag rate (500+ audited trips):")
+    print(by_zone.nlargest(10, 'flag_rate_pct').round(2).to_string())
+
+    hours = audit.summarize(df, audited, df['tpep_pickup_datetime'].dt.hour.rename('hour'))
+    print("\nFlag rate and missing surcharges by hour:")
+    hours['surcharge_missing'] = audited['surcharge_missing'].groupby(
+        df['tpep_pickup_datetime'].dt.hour).sum()
+    print(hours[['audited', 'flagged', 'flag_rate_pct', 'surcharge_missing']].round(2).to_string())
+
+    start = time.perf_counter()
+    streamed = audit_parquet(DATA_FILE, audit, batch_size=250_000)
+    print(f"\nStreamed audit of the raw file by zone x vendor x hour: {time.perf_counter() - start:.2f}s "
+          f"({len(streamed):,} groups, {int(streamed['flagged'].sum()):,} flagged trips)")
+    print(rollup(streamed, 'VendorID').round(2).to_string())
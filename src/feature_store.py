@@ -0,0 +1,171 @@
+"""
+Derived-Column Feature Store
+
+Computes the derived fields the analysis scripts keep recreating
+(tip percentage, pickup hour/day, rider type, time period, borough route,
+trip type) plus trip duration, average speed and outlier flags, in one
+vectorized pass over the cleaned snapshot.
+
+The features are persisted as a sidecar Parquet file next to the
+snapshot, row-aligned with it, so an analysis can project just the
+columns it needs and place them beside the trip columns without a join.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from taxi_data import (CLEAN_FILE, DATA_FILE, ZONES_FILE, DAY_ORDER, TIME_PERIODS,
+                       load_clean_snapshot, load_zones)
+
+# Plausibility limits for the duration/speed outlier flags
+MIN_DURATION_MIN = 1.0
+MAX_DURATION_MIN = 180.0
+MAX_SPEED_MPH = 80.0
+
+SOURCE_COLUMNS = [
+    'tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count',
+    'trip_distance', 'fare_amount', 'tip_amount', 'PULocationID', 'DOLocationID',
+]
+
+FEATURE_COLUMNS = [
+    'tip_percentage', 'pickup_hour', 'pickup_day', 'rider_type', 'time_period',
+    'route', 'trip_type', 'trip_duration_min', 'avg_speed_mph',
+    'duration_outlier', 'speed_outlier',
+]
+
+METADATA_KEY = b'feature_store'
+
+
+def sidecar_path(snapshot_file=CLEAN_FILE):
+    """Feature file that belongs to a snapshot"""
+    root, _ = os.path.splitext(snapshot_file)
+    return root + '.features.parquet'
+
+
+def build_features(trips, zones):
+    """Compute every derived feature for the given trips (vectorized)"""
+    pickup = pd.to_datetime(trips['tpep_pickup_datetime'])
+    dropoff = pd.to_datetime(trips['tpep_dropoff_datetime'])
+    fare = trips['fare_amount'].to_numpy(np.float64)
+    tip = trips['tip_amount'].to_numpy(np.float64)
+    distance = trips['trip_distance'].to_numpy(np.float64)
+
+    features = pd.DataFrame(index=trips.index)
+
+    # Tip percentage (undefined for zero fares)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        features['tip_percentage'] = np.where(fare > 0, tip / fare * 100, np.nan).astype(np.float32)
+
+    # Time keys
+    hour = pickup.dt.hour.to_numpy(np.int8)
+    features['pickup_hour'] = hour
+    features['pickup_day'] = pd.Categorical.from_codes(pickup.dt.dayofweek.to_numpy(np.int8),
+                                                       categories=DAY_ORDER)
+    features['time_period'] = pd.Categorical.from_codes(hour // 6, categories=TIME_PERIODS)
+
+    # Solo (1 passenger) vs Group (2+)
+    features['rider_type'] = pd.Categorical.from_codes(
+        (trips['passenger_count'].to_numpy() != 1).astype(np.int8), categories=['Solo', 'Group']
+    )
+
+    # Borough route and trip type via the zone dimension
+    borough = zones['Borough']
+    pu_borough = trips['PULocationID'].map(borough)
+    do_borough = trips['DOLocationID'].map(borough)
+    known = pu_borough.notna() & do_borough.notna()
+    route = (pu_borough + ' → ' + do_borough).where(known)
+    features['route'] = route.astype('category')
+    trip_type = np.where(pu_borough == do_borough, 'Within Borough', 'Cross-Borough')
+    features['trip_type'] = pd.Categorical(np.where(known, trip_type, None),
+                                           categories=['Within Borough', 'Cross-Borough'])
+
+    # Duration, speed and plausibility flags
+    duration = ((dropoff - pickup).dt.total_seconds() / 60).to_numpy(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.where(duration > 0, distance / (duration / 60), np.nan)
+    features['trip_duration_min'] = duration.astype(np.float32)
+    features['avg_speed_mph'] = speed.astype(np.float32)
+    features['duration_outlier'] = (duration < MIN_DURATION_MIN) | (duration > MAX_DURATION_MIN)
+    features['speed_outlier'] = ~(speed <= MAX_SPEED_MPH)
+
+    return features.reset_index(drop=True)
+
+
+def _snapshot_signature(snapshot_file):
+    """Row count and modification time identifying a snapshot version"""
+    return {
+        'rows': pq.ParquetFile(snapshot_file).metadata.num_rows,
+        'snapshot_mtime': os.path.getmtime(snapshot_file),
+    }
+
+
+def write_features(snapshot_file=CLEAN_FILE, zones_file=ZONES_FILE, data_file=DATA_FILE):
+    """Build features for the snapshot and persist the sidecar file"""
+    trips = load_clean_snapshot(SOURCE_COLUMNS, snapshot_file, data_file)
+    features = build_features(trips, load_zones(zones_file))
+
+    table = pa.Table.from_pandas(features, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[METADATA_KEY] = json.dumps(_snapshot_signature(snapshot_file)).encode('utf-8')
+    pq.write_table(table.replace_schema_metadata(metadata), sidecar_path(snapshot_file))
+    return features
+
+
+def is_current(snapshot_file=CLEAN_FILE):
+    """True when the sidecar exists and is aligned with the snapshot"""
+    path = sidecar_path(snapshot_file)
+    if not os.path.exists(path) or not os.path.exists(snapshot_file):
+        return False
+    metadata = pq.read_schema(path).metadata or {}
+    if METADATA_KEY not in metadata:
+        return False
+    return json.loads(metadata[METADATA_KEY]) == _snapshot_signature(snapshot_file)
+
+
+def load_features(columns=None, snapshot_file=CLEAN_FILE, rebuild=True):
+    """Load (a projection of) the feature sidecar, rebuilding it if stale"""
+    if not is_current(snapshot_file):
+        if not rebuild:
+            raise FileNotFoundError(f"No current feature sidecar for {snapshot_file}")
+        print(f"Building feature sidecar {sidecar_path(snapshot_file)}...")
+        write_features(snapshot_file)
+    return pd.read_parquet(sidecar_path(snapshot_file), columns=columns)
+
+
+def load_trips_with_features(trip_columns, feature_columns, snapshot_file=CLEAN_FILE):
+    """Trip columns from the snapshot placed beside the requested features"""
+    features = load_features(feature_columns, snapshot_file)
+    trips = pd.read_parquet(snapshot_file, columns=trip_columns)
+    return pd.concat([trips, features], axis=1)
+
+
+# Main execution
+if __name__ == "__main__":
+    print("=" * 70)
+    print("FEATURE STORE")
+    print("=" * 70)
+
+    features = write_features()
+    print(f"\nWrote {len(features):,} rows × {features.shape[1]} features to {sidecar_path()}")
+    print(f"In-memory size: {features.memory_usage(deep=True).sum() / 1024**2:.1f} MB")
+
+    print("\nDuration (minutes):")
+    print(features['trip_duration_min'].describe().round(2))
+    print("\nAverage speed (mph):")
+    print(features['avg_speed_mph'].describe().round(2))
+
+    print(f"\nDuration outliers: {features['duration_outlier'].sum():,} "
+          f"({features['duration_outlier'].mean() * 100:.2f}%)")
+    print(f"Speed outliers: {features['speed_outlier'].sum():,} "
+          f"({features['speed_outlier'].mean() * 100:.2f}%)")
+
+    print("\nExample projection (tip_percentage, rider_type):")
+    print(load_features(['tip_percentage', 'rider_type']).head())
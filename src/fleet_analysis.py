@@ -0,0 +1,182 @@
+"""
+Multi-Fleet Trip Analysis
+
+Runs the borough flow, airport, time and tipping analyses over every
+yellow, green and HVFHV file in data/ combined. Files are streamed
+through the fleet schema adapters batch by batch and reduced into small
+per-fleet count/sum arrays, so memory stays bounded no matter how many
+20M-row HVFHV months are included.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(__file__))
+from fleet_schema import FLEET_COLUMNS, find_trip_files, canonical_batch, canonical_clean_mask
+from prefetch import prefetch_row_groups
+from taxi_data import load_zones
+
+COLUMNS = ['fleet', 'pickup_datetime', 'PULocationID', 'DOLocationID', 'passenger_count',
+           'trip_distance', 'payment_type', 'fare_amount', 'tip_amount']
+
+AIRPORTS = {'JFK': 'JFK Airport', 'LaGuardia': 'LaGuardia Airport'}
+
+
+class FleetAccumulator:
+    """Per-fleet aggregates that are updated one batch at a time"""
+
+    def __init__(self, zones):
+        self.n_locations = int(zones.index.max()) + 2
+        boroughs = zones['Borough'].fillna('Unknown')
+        self.boroughs = sorted(boroughs.unique())
+        self.zone_borough = np.full(self.n_locations, self.boroughs.index('Unknown'), dtype=np.int64)
+        self.zone_borough[zones.index] = [self.boroughs.index(b) for b in boroughs]
+        self.airport_ids = {name: zones.index[zones['Zone'] == zone].to_numpy()
+                            for name, zone in AIRPORTS.items()}
+        self.stats = {}
+
+    def _fleet_stats(self, fleet):
+        if fleet not in self.stats:
+            n_boroughs = len(self.boroughs)
+            self.stats[fleet] = {
+                'trips': 0,
+                'hourly': np.zeros(24, dtype=np.int64),
+                'od': np.zeros(n_boroughs * n_boroughs, dtype=np.int64),
+                'airport_hourly': {name: np.zeros(24, dtype=np.int64) for name in AIRPORTS},
+                'tip_trips': 0,
+                'tip_sum': 0.0,
+                'fare_sum': 0.0,
+                'zero_tips': 0,
+            }
+        return self.stats[fleet]
+
+    def add(self, df, fleet):
+        """Fold one cleaned canonical batch into the running aggregates"""
+        stats = self._fleet_stats(fleet)
+        hours = df['pickup_datetime'].dt.hour.to_numpy()
+        pu = df['PULocationID'].to_numpy(np.int64)
+        do = df['DOLocationID'].to_numpy(np.int64)
+
+        stats['trips'] += len(df)
+        stats['hourly'] += np.bincount(hours, minlength=24)
+
+        n_boroughs = len(self.boroughs)
+        od = self.zone_borough[pu] * n_boroughs + self.zone_borough[do]
+        stats['od'] += np.bincount(od, minlength=n_boroughs * n_boroughs)
+
+        for name, ids in self.airport_ids.items():
+            stats['airport_hourly'][name] += np.bincount(hours[np.isin(pu, ids)], minlength=24)
+
+        # Tips: credit card only where payment type is recorded, all HVFHV trips
+        fare = df['fare_amount'].to_numpy()
+        tip = df['tip_amount'].to_numpy()
+        payment = df['payment_type'].to_numpy(dtype=np.float64, na_value=np.nan)
+        tip_mask = (np.isnan(payment) | (payment == 1)) & (fare > 0) & (tip >= 0) & (tip <= fare)
+        stats['tip_trips'] += int(tip_mask.sum())
+        stats['tip_sum'] += float(tip[tip_mask].sum())
+        stats['fare_sum'] += float(fare[tip_mask].sum())
+        stats['zero_tips'] += int((tip[tip_mask] == 0).sum())
+
+    def hourly_table(self):
+        return pd.DataFrame({fleet: s['hourly'] for fleet, s in self.stats.items()}).rename_axis('pickup_hour')
+
+    def route_table(self, top=15):
+        n = len(self.boroughs)
+        routes = [f"{self.boroughs[i // n]} → {self.boroughs[i % n]}" for i in range(n * n)]
+        table = pd.DataFrame({fleet: s['od'] for fleet, s in self.stats.items()}, index=routes)
+        table['All fleets'] = table.sum(axis=1)
+        return table.sort_values('All fleets', ascending=False).head(top)
+
+    def airport_table(self):
+        rows = {}
+        late_night = [22, 23, 0, 1, 2, 3, 4, 5]
+        for fleet, s in self.stats.items():
+            for name, hourly in s['airport_hourly'].items():
+                total = hourly.sum()
+                rows[(fleet, name)] = {
+                    'pickups': int(total),
+                    'late_night_pct': hourly[late_night].sum() / total * 100 if total else np.nan,
+                }
+        return pd.DataFrame.from_dict(rows, orient='index').round(1)
+
+    def tip_table(self):
+        rows = {}
+        for fleet, s in self.stats.items():
+            n = s['tip_trips']
+            rows[fleet] = {
+                'trips': n,
+                'avg_tip': s['tip_sum'] / n if n else np.nan,
+                'tip_pct_of_fares': s['tip_sum'] / s['fare_sum'] * 100 if s['fare_sum'] else np.nan,
+                'zero_tip_pct': s['zero_tips'] / n * 100 if n else np.nan,
+            }
+        return pd.DataFrame.from_dict(rows, orient='index').round(2)
+
+
+# Main execution
+if __name__ == "__main__":
+    print("=" * 70)
+    print("MULTI-FLEET ANALYSIS - Yellow, Green and HVFHV")
+    print("=" * 70)
+
+    files = find_trip_files()
+    if not files:
+        sys.exit("No trip files found in data/")
+    for fleet, paths in files.items():
+        print(f"\n{fleet}: {len(paths)} file(s)")
+        for path in paths:
+            print(f"   {path}")
+
+    def load_clean(fleet):
+        """Decode, adapt and clean a row group on a prefetch thread"""
+        def load(task, table):
+            frames = [batch.to_pandas() for batch in
+                      (canonical_batch(b, fleet, COLUMNS) for b in table.to_batches())]
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+            return df[canonical_clean_mask(df)]
+        return load
+
+    accumulator = FleetAccumulator(load_zones())
+    for fleet, paths in files.items():
+        source_columns = [FLEET_COLUMNS[fleet][c] for c in COLUMNS if c in FLEET_COLUMNS[fleet]]
+        prefetcher = prefetch_row_groups(paths, source_columns, depth=4, workers=2,
+                                         load=load_clean(fleet))
+        for df in prefetcher:
+            accumulator.add(df, fleet)
+        print(f"\n{fleet}:", end='')
+        prefetcher.stats.report()
+
+    print("\n" + "=" * 70)
+    print("TRIPS BY FLEET")
+    print("=" * 70)
+    for fleet, stats in accumulator.stats.items():
+        print(f"{fleet}: {stats['trips']:,} clean trips")
+
+    print("\n" + "=" * 70)
+    print("HOURLY PICKUPS BY FLEET")
+    print("=" * 70)
+    print(accumulator.hourly_table())
+
+    print("\n" + "=" * 70)
+    print("TOP BOROUGH ROUTES (ALL FLEETS)")
+    print("=" * 70)
+    print(accumulator.route_table())
+
+    print("\n" + "=" * 70)
+    print("AIRPORT PICKUPS")
+    print("=" * 70)
+    print(accumulator.airport_table())
+
+    print("\n" + "=" * 70)
+    print("TIPPING BY FLEET")
+    print("=" * 70)
+    print(accumulator.tip_table())
+
+    print("\n" + "=" * 70)
+    print("✓ Multi-fleet analysis complete!")
+    print("=" * 70)
@@ -0,0 +1,193 @@
+"""
+Fleet Schema Adapters
+
+Maps yellow taxi, green taxi and high-volume for-hire (HVFHV) trip files
+onto one canonical, compactly typed trip schema at read time. Only the
+source columns behind the requested canonical columns are read, and
+files are streamed batch by batch, so a 20M-row HVFHV month never has to
+be fully materialized.
+
+Canonical columns missing from a fleet (e.g. passenger_count and
+payment_type for HVFHV) are returned as nulls.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import glob
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from taxi_data import DATA_DIR
+
+CANONICAL_SCHEMA = pa.schema([
+    ('fleet', pa.dictionary(pa.int8(), pa.string())),
+    ('vendor', pa.string()),
+    ('pickup_datetime', pa.timestamp('us')),
+    ('dropoff_datetime', pa.timestamp('us')),
+    ('PULocationID', pa.int16()),
+    ('DOLocationID', pa.int16()),
+    ('passenger_count', pa.int8()),
+    ('trip_distance', pa.float64()),
+    ('RatecodeID', pa.int8()),
+    ('payment_type', pa.int8()),
+    ('fare_amount', pa.float64()),
+    ('tip_amount', pa.float64()),
+])
+
+CANONICAL_COLUMNS = CANONICAL_SCHEMA.names
+
+# canonical column -> source column, per fleet
+FLEET_COLUMNS = {
+    'yellow': {
+        'vendor': 'VendorID',
+        'pickup_datetime': 'tpep_pickup_datetime',
+        'dropoff_datetime': 'tpep_dropoff_datetime',
+        'PULocationID': 'PULocationID',
+        'DOLocationID': 'DOLocationID',
+        'passenger_count': 'passenger_count',
+        'trip_distance': 'trip_distance',
+        'RatecodeID': 'RatecodeID',
+        'payment_type': 'payment_type',
+        'fare_amount': 'fare_amount',
+        'tip_amount': 'tip_amount',
+    },
+    'green': {
+        'vendor': 'VendorID',
+        'pickup_datetime': 'lpep_pickup_datetime',
+        'dropoff_datetime': 'lpep_dropoff_datetime',
+        'PULocationID': 'PULocationID',
+        'DOLocationID': 'DOLocationID',
+        'passenger_count': 'passenger_count',
+        'trip_distance': 'trip_distance',
+        'RatecodeID': 'RatecodeID',
+        'payment_type': 'payment_type',
+        'fare_amount': 'fare_amount',
+        'tip_amount': 'tip_amount',
+    },
+    'fhvhv': {
+        'vendor': 'hvfhs_license_num',
+        'pickup_datetime': 'pickup_datetime',
+        'dropoff_datetime': 'dropoff_datetime',
+        'PULocationID': 'PULocationID',
+        'DOLocationID': 'DOLocationID',
+        'trip_distance': 'trip_miles',
+        'fare_amount': 'base_passenger_fare',
+        'tip_amount': 'tips',
+    },
+}
+
+FILE_PATTERNS = {
+    'yellow': 'yellow_tripdata_*.parquet',
+    'green': 'green_tripdata_*.parquet',
+    'fhvhv': 'fhvhv_tripdata_*.parquet',
+}
+
+
+def detect_fleet(path):
+    """Identify the fleet of a trip file from its name or its columns"""
+    name = os.path.basename(path)
+    for fleet in FLEET_COLUMNS:
+        if name.startswith(fleet + '_'):
+            return fleet
+    columns = set(pq.read_schema(path).names)
+    for fleet, mapping in FLEET_COLUMNS.items():
+        if mapping['pickup_datetime'] in columns and mapping['fare_amount'] in columns:
+            return fleet
+    raise ValueError(f"Cannot determine fleet for {path}")
+
+
+def find_trip_files(data_dir=DATA_DIR, fleets=None):
+    """Trip files in the data directory, grouped by fleet"""
+    files = {}
+    for fleet in fleets or FILE_PATTERNS:
+        matches = [path for path in sorted(glob.glob(os.path.join(data_dir, FILE_PATTERNS[fleet])))
+                   if not path.endswith(('.clean.parquet', '.features.parquet'))]
+        if matches:
+            files[fleet] = matches
+    return files
+
+
+def _to_canonical(column, target, name=None):
+    """Cast a source column to its canonical type"""
+    if column.type == target:
+        return column
+    if pa.types.is_integer(target) and pa.types.is_floating(column.type):
+        # Float-coded ids/counts: nulls stay null, but the values must be whole and fit the target
+        values = pc.drop_null(column)
+        if len(values):
+            limits = np.iinfo(target.to_pandas_dtype())
+            low, high = pc.min_max(values).values()
+            if not pc.all(pc.equal(pc.floor(values), values)).as_py():
+                raise ValueError(f"{name or 'column'} has fractional values; cannot cast to {target}")
+            if low.as_py() < limits.min or high.as_py() > limits.max:
+                raise ValueError(f"{name or 'column'} values {low.as_py()}..{high.as_py()} do not fit in {target}")
+        return pc.cast(column, target)
+    if pa.types.is_string(target) and not pa.types.is_string(column.type):
+        return pc.cast(column, pa.string())
+    return pc.cast(column, target)
+
+
+def canonical_batch(batch, fleet, columns):
+    """Convert one source RecordBatch to the canonical schema"""
+    mapping = FLEET_COLUMNS[fleet]
+    arrays, fields = [], []
+    for name in columns:
+        field = CANONICAL_SCHEMA.field(name)
+        if name == 'fleet':
+            indices = pa.array(np.zeros(batch.num_rows, dtype=np.int8))
+            array = pa.DictionaryArray.from_arrays(indices, pa.array([fleet]))
+        elif name in mapping:
+            array = _to_canonical(batch.column(mapping[name]), field.type, name)
+        else:
+            array = pa.nulls(batch.num_rows, type=field.type)
+        arrays.append(array)
+        fields.append(field)
+    return pa.RecordBatch.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def iter_fleet_batches(path, columns=None, batch_size=256_000, fleet=None):
+    """Stream a trip file as canonical RecordBatches, reading only needed columns"""
+    fleet = fleet or detect_fleet(path)
+    columns = list(columns or CANONICAL_COLUMNS)
+    unknown = set(columns) - set(CANONICAL_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown canonical columns: {sorted(unknown)}")
+
+    mapping = FLEET_COLUMNS[fleet]
+    source_columns = [mapping[name] for name in columns if name in mapping]
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=source_columns):
+        yield canonical_batch(batch, fleet, columns)
+
+
+def iter_trips(files, columns=None, batch_size=256_000):
+    """Stream canonical batches from {fleet: [paths]} across all fleets"""
+    for fleet, paths in files.items():
+        for path in paths:
+            for batch in iter_fleet_batches(path, columns, batch_size, fleet):
+                yield batch
+
+
+def canonical_clean_mask(df):
+    """
+    Standard cleaning rules on a canonical frame.
+
+    Passenger counts are only checked for fleets that record them; the
+    frame needs a `fleet` column for HVFHV rows to pass that rule.
+    """
+    passengers = df['passenger_count']
+    valid_passengers = (passengers > 0) & (passengers <= 6)
+    if 'fleet' in df.columns:
+        no_count = [fleet for fleet, mapping in FLEET_COLUMNS.items() if 'passenger_count' not in mapping]
+        valid_passengers |= df['fleet'].isin(no_count)
+    return (
+        (df['fare_amount'] >= 0) &
+        (df['trip_distance'] > 0) &
+        (df['trip_distance'] <= 100) &
+        valid_passengers
+    )
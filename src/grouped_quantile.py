@@ -0,0 +1,281 @@
+"""
+Grouped Quantile Engine
+
+Medians and quantiles for very many groups (e.g. every OD pair x hour,
+265² x 24 groups) without pandas' per-group quantile machinery:
+
+  - exact: one integer sort on (group code, value rank) puts every
+    group's values in a contiguous sorted segment; quantiles are then read straight out
+    of each segment by offset (with pandas' linear interpolation),
+  - approximate: QuantileSketch keeps sparse per-group counts over
+    log-spaced bins (relative error bound, like DDSketch). Sketches are
+    built batch by batch and merged, so quantiles can be computed over
+    many months without holding the raw values.
+
+Group codes are plain int64 arrays; group_codes() builds them from
+DataFrame key columns and od_hour_codes() gives a fixed encoding for
+pickup zone x dropoff zone x hour that stays stable across batches.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import numpy as np
+import pandas as pd
+
+N_LOCATIONS = 266
+DENSE_LIMIT = 1 << 24
+
+
+def group_codes(df, keys):
+    """Dense int64 group codes for `keys` plus the matching group index"""
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    combined = np.zeros(len(df), dtype=np.int64)
+    levels = []
+    for key in keys:
+        column = df[key]
+        if pd.api.types.is_integer_dtype(column.dtype) and len(column) and \
+                int(column.max()) - int(column.min()) < DENSE_LIMIT:
+            # Small integer ranges (zone IDs, hours) need no hashing
+            low = int(column.min())
+            codes = column.to_numpy(dtype=np.int64) - low
+            uniques = np.arange(low, int(column.max()) + 1)
+        else:
+            codes, uniques = pd.factorize(column, sort=True)
+        # Missing keys (code -1) are dropped like in pandas groupby
+        combined = np.where((codes < 0) | (combined < 0), -1, combined * (len(uniques) + 1) + codes)
+        levels.append(uniques)
+    valid = combined >= 0
+    size = int(np.prod([len(level) + 1 for level in levels], dtype=np.float64))
+    codes = np.full(len(df), -1, dtype=np.int64)
+    if size <= max(DENSE_LIMIT, len(df)):
+        # Small key space: compact with a presence table instead of sorting
+        present = np.zeros(size, dtype=bool)
+        present[combined[valid]] = True
+        uniques = np.flatnonzero(present)
+        codes[valid] = (np.cumsum(present) - 1)[combined[valid]]
+    else:
+        uniques, codes[valid] = np.unique(combined[valid], return_inverse=True)
+
+    # Decode the mixed-radix combined keys back into one level per key
+    parts, remainder = [], uniques
+    for level in reversed(levels):
+        parts.append(level[remainder % (len(level) + 1)])
+        remainder = remainder // (len(level) + 1)
+    arrays = list(reversed(parts))
+    if len(keys) == 1:
+        index = pd.Index(arrays[0], name=keys[0])
+    else:
+        index = pd.MultiIndex.from_arrays(arrays, names=keys)
+    return codes, index
+
+
+def od_hour_codes(pu, do, hour, n_locations=N_LOCATIONS):
+    """Fixed code for (pickup zone, dropoff zone, hour)"""
+    return (np.asarray(pu, dtype=np.int64) * n_locations + np.asarray(do, dtype=np.int64)) * 24 \
+        + np.asarray(hour, dtype=np.int64)
+
+
+def od_hour_index(codes, n_locations=N_LOCATIONS):
+    """MultiIndex (PULocationID, DOLocationID, hour) for od_hour_codes"""
+    codes = np.asarray(codes, dtype=np.int64)
+    od, hour = np.divmod(codes, 24)
+    pu, do = np.divmod(od, n_locations)
+    return pd.MultiIndex.from_arrays([pu, do, hour], names=['PULocationID', 'DOLocationID', 'hour'])
+
+
+def exact_quantiles(codes, values, q=0.5, n_groups=None):
+    """
+    Exact per-group quantiles. Returns (quantiles, counts): an
+    (n_groups, len(q)) array (NaN for empty groups) and the group sizes.
+    """
+    qs = np.atleast_1d(np.asarray(q, dtype=np.float64))
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    keep = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[keep], values[keep]
+    if n_groups is None:
+        n_groups = int(codes.max()) + 1 if len(codes) else 0
+
+    # Replace values by their dense rank so (code, rank) packs into one
+    # int64 key: a single integer sort instead of a two-key lexsort
+    order = np.argsort(values)
+    ranked = values[order]
+    distinct = np.ones(len(ranked), dtype=bool)
+    distinct[1:] = ranked[1:] != ranked[:-1]
+    uniques = ranked[distinct]
+    if n_groups * max(len(uniques), 1) < 2 ** 62:
+        ranks = np.empty(len(values), dtype=np.int64)
+        ranks[order] = np.cumsum(distinct) - 1
+        keys = np.sort(codes * len(uniques) + ranks)
+        sorted_values = uniques[keys % len(uniques)] if len(uniques) else ranked
+    else:
+        sorted_values = values[np.lexsort((values, codes))]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+
+    result = np.full((n_groups, len(qs)), np.nan)
+    present = counts > 0
+    for j, quantile in enumerate(qs):
+        # Linear interpolation between the two closest ranks in each segment
+        position = quantile * (counts[present] - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, counts[present] - 1)
+        fraction = position - low
+        below = sorted_values[starts[present] + low]
+        above = sorted_values[starts[present] + high]
+        result[present, j] = below + (above - below) * fraction
+    return result, counts
+
+
+class QuantileSketch:
+    """Mergeable per-group log-bin histogram with relative-error quantiles"""
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-3, max_value=1e7):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.min_value = min_value
+        self.max_value = max_value
+        self.n_bins = int(np.ceil(np.log(max_value / min_value) / self.log_gamma)) + 1
+        self.width = 2 * self.n_bins + 1  # negative bins, zero bin, positive bins
+        self.keys = np.zeros(0, dtype=np.int64)    # group * width + bin, sorted
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def _bins(self, values):
+        """Signed log-bin index: 0 for |v| <= min_value, ±k otherwise"""
+        magnitude = np.clip(np.abs(values), self.min_value, self.max_value)
+        k = np.ceil(np.log(magnitude / self.min_value) / self.log_gamma).astype(np.int64)
+        k = np.where(np.abs(values) <= self.min_value, 0, np.maximum(k, 1))
+        return np.where(values < 0, -k, k) + self.n_bins
+
+    def _bin_values(self, bins):
+        """Representative value of each bin (within the relative accuracy)"""
+        k = bins - self.n_bins
+        magnitude = self.min_value * self.gamma ** np.abs(k) * 2 / (1 + self.gamma)
+        return np.where(k == 0, 0.0, np.sign(k) * magnitude)
+
+    def _merge_sparse(self, keys, counts):
+        keys = np.concatenate([self.keys, keys])
+        counts = np.concatenate([self.counts, counts])
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts, minlength=len(self.keys)).astype(np.int64)
+
+    def add(self, codes, values):
+        """Fold a batch of (group code, value) pairs into the sketch"""
+        codes = np.asarray(codes, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        keep = (codes >= 0) & ~np.isnan(values)
+        keys = codes[keep] * self.width + self._bins(values[keep])
+        keys, counts = np.unique(keys, return_counts=True)
+        self._merge_sparse(keys, counts)
+        return self
+
+    def merge(self, other):
+        """Combine with a sketch built on other data (same settings)"""
+        if (other.relative_accuracy, other.min_value, other.max_value) != \
+                (self.relative_accuracy, self.min_value, self.max_value):
+            raise ValueError("Can only merge sketches with identical settings")
+        self._merge_sparse(other.keys, other.counts)
+        return self
+
+    def groups(self):
+        """Group codes present in the sketch"""
+        return np.unique(self.keys // self.width)
+
+    def quantiles(self, q=0.5):
+        """(group codes, (n_groups, len(q)) quantile array, group sizes)"""
+        qs = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        group_of_key = self.keys // self.width
+        groups, first = np.unique(group_of_key, return_index=True)
+        cumulative = np.cumsum(self.counts)
+        totals = np.add.reduceat(self.counts, first) if len(first) else np.zeros(0, dtype=np.int64)
+        before = cumulative[first] - self.counts[first]
+
+        result = np.empty((len(groups), len(qs)))
+        for j, quantile in enumerate(qs):
+            # Rank within the group -> first bin whose running count exceeds
+            # it, interpolating between neighbouring ranks like the exact path
+            position = quantile * (totals - 1)
+            low = np.floor(position)
+            high = np.minimum(low + 1, totals - 1)
+            below = self._bin_values(self.keys[np.searchsorted(cumulative, before + low, side='right')] % self.width)
+            above = self._bin_values(self.keys[np.searchsorted(cumulative, before + high, side='right')] % self.width)
+            result[:, j] = below + (above - below) * (position - low)
+        return groups, result, totals
+
+    def nbytes(self):
+        return self.keys.nbytes + self.counts.nbytes
+
+
+def grouped_quantile(df, keys, column, q=0.5, method='exact', relative_accuracy=0.01):
+    """
+    Quantiles of `column` per group of `keys` as a DataFrame with one
+    column per quantile plus 'count' (non-empty groups only).
+    """
+    qs = list(np.atleast_1d(q))
+    codes, index = group_codes(df, keys)
+    values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+    if method == 'exact':
+        result, counts = exact_quantiles(codes, values, qs, n_groups=len(index))
+        present = counts > 0
+        frame = pd.DataFrame(result[present], index=index[present], columns=qs)
+        frame['count'] = counts[present]
+        return frame
+    if method == 'sketch':
+        sketch = QuantileSketch(relative_accuracy).add(codes, values)
+        groups, result, counts = sketch.quantiles(qs)
+        frame = pd.DataFrame(result, index=index[groups], columns=qs)
+        frame['count'] = counts
+        return frame
+    raise ValueError(f"Unknown method: {method} (use 'exact' or 'sketch')")
+
+
+# Main execution
+if __name__ == "__main__":
+    import time
+    from taxi_data import load_clean_trips
+
+    print("=" * 70)
+    print("GROUPED QUANTILES - median fare per OD pair x hour")
+    print("=" * 70)
+
+    df = load_clean_trips(columns=['tpep_pickup_datetime', 'PULocationID', 'DOLocationID',
+                                   'fare_amount', 'trip_distance'])
+    df['hour'] = df['tpep_pickup_datetime'].dt.hour
+    keys = ['PULocationID', 'DOLocationID', 'hour']
+    print(f"\nTrips: {len(df):,}")
+
+    quartiles = [0.25, 0.5, 0.75]
+    start = time.perf_counter()
+    expected_quartiles = df.groupby(keys)['fare_amount'].quantile(quartiles).unstack()
+    pandas_time = time.perf_counter() - start
+    expected = expected_quartiles[0.5]
+    print(f"Groups: {len(expected):,}")
+    print(f"\npandas groupby().quantile():    {pandas_time:.2f}s")
+
+    start = time.perf_counter()
+    exact = grouped_quantile(df, keys, 'fare_amount', q=quartiles)
+    exact_time = time.perf_counter() - start
+    print(f"Exact (sort + segments):        {exact_time:.2f}s ({pandas_time / exact_time:.1f}x)")
+
+    # Fixed OD x hour codes let the sketch be built batch by batch
+    codes = od_hour_codes(df['PULocationID'], df['DOLocationID'], df['hour'])
+    fares = df['fare_amount'].to_numpy()
+    start = time.perf_counter()
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for batch in np.array_split(np.arange(len(df)), 4):
+        sketch.merge(QuantileSketch(relative_accuracy=0.01).add(codes[batch], fares[batch]))
+    groups, medians, counts = sketch.quantiles(0.5)
+    sketch_time = time.perf_counter() - start
+    print(f"Sketch (4 merged batches):      {sketch_time:.2f}s ({pandas_time / sketch_time:.1f}x), "
+          f"{sketch.nbytes() / 1024**2:.1f} MB")
+
+    exact_error = np.abs(exact[quartiles].to_numpy() - expected_quartiles.to_numpy()).max()
+    approx = pd.Series(medians[:, 0], index=od_hour_index(groups)).reindex(expected.index)
+    relative = (approx - expected).abs() / expected.abs().where(expected != 0)
+    print(f"\nExact max abs error vs pandas:  {exact_error:.2e}")
+    print(f"Sketch max relative error:      {relative.max():.2%} (bound {0.01:.0%} on bin values)")
+
+    print("\nFare quartiles by pickup hour (exact):")
+    print(grouped_quantile(df, 'hour', 'fare_amount', q=[0.25, 0.5, 0.75]).round(2))
@@ -10,6 +10,11 @@ Date: November 2024
 
 import pandas as pd
 import os
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+from fare_audit import FareAudit
+from taxi_data import load_zones
 
 # Load and clean data
 data_file = os.path.join('data', 'yellow_tripdata_2024-01.parquet')
@@ -69,4 +74,13 @@ spike_trips['distance_bin'] = pd.cut(spike_trips['trip_distance'], bins=distance
 print("\nTrips by distance range:")
 print(spike_trips['distance_bin'].value_counts().sort_index())
 
-print("\n" + "=" * 70)
\ No newline at end of file
+# Which fare rule each spike trip falls under, from the expected-fare model
+print("\n--- FARE RULES (FARE AUDIT) ---")
+audit = FareAudit(load_zones())
+audited = audit.audit(spike_trips)
+print(audited['rule'].value_counts())
+print(f"\nSpike trips outside their expected fare: {audited['flagged'].sum():,}")
+jfk_share = (audited['rule'] == 'jfk_flat').mean() * 100
+print(f"Explained by the JFK flat fare: {jfk_share:.1f}%")
+
+print("\n" + "=" * 70)
@@ -5,6 +5,14 @@ Hypothesis: Do people tip better during bar-closing hours?
 
 import pandas as pd
 import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+from spill_groupby import groupby_agg
+from bootstrap_stats import BootstrapEngine, print_comparison
+from zone_windows import ZoneWindows
+from taxi_data import load_zones
 
 # Load the data
 print("Loading taxi data...")
@@ -62,7 +70,7 @@ print("\n" + "="*60)
 print("TIPPING BEHAVIOR BY TIME PERIOD")
 print("="*60)
 
-time_summary = filtered_df.groupby('time_period').agg({
+time_summary = groupby_agg(filtered_df, 'time_period', {
     'tip_amount': ['count', 'mean', 'median'],
     'tip_percentage': ['mean', 'median', 'std'],
     'fare_amount': ['mean', 'median']
@@ -90,7 +98,7 @@ print("="*60)
 
 late_night = filtered_df[filtered_df['pickup_hour'].isin([0, 1, 2, 3, 4, 5])]
 
-hourly = late_night.groupby('pickup_hour').agg({
+hourly = groupby_agg(late_night, 'pickup_hour', {
     'tip_amount': 'count',
     'tip_percentage': ['mean', 'median']
 }).round(2)
@@ -106,7 +114,7 @@ late_night['rider_type'] = late_night['passenger_count'].apply(
     lambda x: 'Solo' if x == 1 else 'Group'
 )
 
-late_night_groups = late_night.groupby('rider_type').agg({
+late_night_groups = groupby_agg(late_night, 'rider_type', {
     'tip_amount': ['count', 'mean', 'median'],
     'tip_percentage': ['mean', 'median'],
     'fare_amount': ['mean']
@@ -172,6 +180,54 @@ if len(bar_closing) > 0:
     generous_rate = (bar_closing['tip_percentage'] >= 20).sum() / len(bar_closing) * 100
     print(f"Generous (20%+) rate: {generous_rate:.2f}%")
 
+# Bar-closing surges: trailing 60-minute pickups per zone, minute by minute
+print("\n" + "="*60)
+print("BAR-CLOSING SURGES (PICKUPS IN THE TRAILING 60 MINUTES)")
+print("="*60)
+
+pickups = ZoneWindows.from_trips(df, 'pickup')
+demand = pickups.daily_profile(pickups.rolling(60))
+zone_names = load_zones()['Zone']
+
+# Average demand for windows ending 1am-4am vs the zone's all-day average
+closing_demand = demand[:, 60:240].mean(axis=1)
+all_day = demand.mean(axis=1)
+surges = pd.DataFrame({
+    'zone': zone_names.reindex(range(len(demand))).to_numpy(),
+    'closing_pickups_per_hour': closing_demand,
+    'all_day_pickups_per_hour': all_day,
+})
+surges = surges[surges['all_day_pickups_per_hour'] >= 1]
+surges['surge_ratio'] = surges['closing_pickups_per_hour'] / surges['all_day_pickups_per_hour']
+print(surges.nlargest(10, 'surge_ratio').round(2).to_string())
+
+# Tipping when the pickup zone is busy: demand in the 15 minutes before each late-night trip
+zone_demand = pickups.counts_at(
+    late_night['PULocationID'].to_numpy(), late_night['tpep_pickup_datetime'].to_numpy(), 15
+)
+busy = zone_demand >= np.quantile(zone_demand, 0.75)
+print(f"\nLate-night trips from busy zones (top quartile of 15-min demand): {busy.sum():,}")
+print(f"  Mean tip percentage when busy: {late_night.loc[busy, 'tip_percentage'].mean():.2f}%")
+print(f"  Mean tip percentage otherwise: {late_night.loc[~busy, 'tip_percentage'].mean():.2f}%")
+
+# Significance: late night vs daytime, and per-hour confidence intervals
+print("\n" + "="*60)
+print("SIGNIFICANCE TESTS (BOOTSTRAP)")
+print("="*60)
+
+engine = BootstrapEngine()
+daytime = filtered_df[filtered_df['pickup_hour'].between(6, 17)]
+print_comparison('Late Night (12am-6am)', 'Daytime (6am-6pm)',
+                 engine.mean_diff(late_night['tip_percentage'], daytime['tip_percentage']))
+
+late_solo = late_night.loc[late_night['rider_type'] == 'Solo', 'tip_percentage']
+late_group = late_night.loc[late_night['rider_type'] == 'Group', 'tip_percentage']
+print_comparison('Late Night Group', 'Late Night Solo', engine.mean_diff(late_group, late_solo))
+
+print("\nMean tip percentage by hour (95% bootstrap CI):")
+hourly_ci = engine.group_means(filtered_df['tip_percentage'], filtered_df['pickup_hour'])
+print(hourly_ci.round(2))
+
 print("\n" + "="*60)
 print("CONCLUSION")
 print("="*60)
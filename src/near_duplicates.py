@@ -0,0 +1,257 @@
+"""
+Near-Duplicate Product Descriptions
+
+Finds descriptions that name the same product in slightly different
+ways (case and whitespace variants, typos, "SET OF 3" vs "SET/3")
+without comparing every pair:
+
+  - descriptions are factorized, so work is per distinct value, and
+    normalized (case, punctuation, whitespace, common abbreviations),
+  - character 3-gram shingles are read straight out of one flat byte
+    array of all the normalized strings,
+  - MinHash signatures are computed for blocks of hash functions at once
+    with np.minimum.reduceat over each description's shingles,
+  - LSH banding buckets descriptions whose signatures agree on a whole
+    band; candidate pairs inside a bucket are verified on their
+    estimated Jaccard similarity and merged into clusters with a
+    vectorized union-find.
+
+Cost grows roughly linearly with the number of distinct descriptions.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import numpy as np
+import pandas as pd
+
+PRIME = (1 << 31) - 1  # Mersenne prime for the universal hash family (a * x mod p)
+SHINGLE = 3
+NUM_PERM = 128
+BANDS = 32               # 32 bands x 4 rows: pairs above ~0.5 Jaccard become candidates
+THRESHOLD = 0.7          # estimated Jaccard needed to link two descriptions (a one-letter typo is ~0.75)
+
+# Abbreviations and spellings that should not count as differences
+REPLACEMENTS = [
+    (r'\bSET\s*/\s*(\d+)\b', r'SET OF \1'),
+    (r'\bS/(\d+)\b', r'SET OF \1'),
+    (r'&', ' AND '),
+    (r'[^A-Z0-9 ]+', ' '),
+    (r'\s+', ' '),
+]
+
+
+def normalize(descriptions):
+    """Upper-case, expand abbreviations, drop punctuation, collapse whitespace"""
+    text = pd.Series(descriptions, dtype=object).fillna('').astype(str).str.upper()
+    for pattern, replacement in REPLACEMENTS:
+        text = text.str.replace(pattern, replacement, regex=True)
+    return text.str.strip()
+
+
+def shingle_codes(texts, k=SHINGLE):
+    """(document index, k-gram code) for every character k-gram of every text"""
+    encoded = [f" {text} ".encode('utf-8') for text in texts]  # padded so short words still shingle
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+    flat = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+    starts = np.cumsum(lengths) - lengths
+
+    # Positions where a whole k-gram fits inside its own string
+    n_grams = np.maximum(lengths - k + 1, 0)
+    document = np.repeat(np.arange(len(texts)), n_grams)
+    position = np.arange(n_grams.sum()) - np.repeat(np.cumsum(n_grams) - n_grams, n_grams) \
+        + np.repeat(starts, n_grams)
+    codes = np.zeros(len(position), dtype=np.uint64)
+    for offset in range(k):
+        codes = (codes << np.uint64(8)) | flat[position + offset]
+    return document, codes
+
+
+def minhash(document, codes, n_documents, num_perm=NUM_PERM, seed=0, block=16):
+    """(n_documents, num_perm) MinHash signatures; documents without shingles get PRIME"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+    order = np.argsort(document, kind='stable')
+    # Mix the k-gram codes (Fibonacci hashing) so neighbouring grams land far apart in [0, p)
+    mixed = (codes[order] * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(33)
+    document, codes = document[order], mixed % np.uint64(PRIME)
+    present, first = np.unique(document, return_index=True)
+
+    signatures = np.full((n_documents, num_perm), PRIME, dtype=np.uint64)
+    for start in range(0, num_perm, block):
+        # Both factors < 2^31, so the products fit in uint64 before the modulo
+        hashed = (codes[:, None] * a[None, start:start + block] + b[None, start:start + block]) % np.uint64(PRIME)
+        signatures[present, start:start + block] = np.minimum.reduceat(hashed, first, axis=0)
+    return signatures
+
+
+def band_buckets(signatures, bands=BANDS):
+    """Candidate pairs: documents whose signatures agree on a whole band"""
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    multipliers = np.random.default_rng(1).integers(1, 1 << 62, rows, dtype=np.uint64) | np.uint64(1)
+    pairs = []
+    for band in range(bands):
+        # One 64-bit key per band (wrapping multiply-add over its rows)
+        key = (signatures[:, band * rows:(band + 1) * rows] * multipliers).sum(axis=1)
+        order = np.argsort(key, kind='stable')
+        ordered = key[order]
+        same = ordered[1:] == ordered[:-1]
+        # Link every bucket member to its predecessor and to the bucket's first member
+        bucket_start = np.maximum.accumulate(np.where(np.concatenate([[True], ~same]), np.arange(n), 0))
+        members = np.flatnonzero(same) + 1
+        pairs.append(np.stack([order[members - 1], order[members]], axis=1))
+        pairs.append(np.stack([order[bucket_start[members]], order[members]], axis=1))
+    pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+    pairs = np.sort(pairs, axis=1)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    return np.unique(pairs, axis=0)
+
+
+def estimated_jaccard(signatures, pairs):
+    """Share of MinHash values two documents have in common"""
+    return (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+
+
+def connected_labels(n, pairs):
+    """Union-find over edges: smallest member index per component (min-label propagation)"""
+    labels = np.arange(n)
+    if len(pairs) == 0:
+        return labels
+    u, v = pairs[:, 0], pairs[:, 1]
+    while True:
+        low = np.minimum(labels[u], labels[v])
+        updated = labels.copy()
+        np.minimum.at(updated, u, low)
+        np.minimum.at(updated, v, low)
+        updated = updated[updated]  # pointer jumping
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+class NearDuplicateDetector:
+    """MinHash/LSH clustering of free-text values"""
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, threshold=THRESHOLD, shingle=SHINGLE, seed=0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        self.shingle = shingle
+        self.seed = seed
+
+    def cluster(self, values):
+        """
+        One row per distinct value in a near-duplicate cluster (clusters of
+        two or more distinct values): value, normalized text, line count,
+        cluster id and the cluster's most common value
+        """
+        codes, uniques = pd.factorize(pd.Series(values).dropna())
+        counts = np.bincount(codes, minlength=len(uniques))
+        normalized = normalize(uniques)
+
+        # Placeholders that normalize to nothing ("?", "*") have no shingles and are not descriptions
+        usable = (normalized.str.len() + 2 >= self.shingle).to_numpy()  # texts are padded by one space each side
+        uniques, counts, normalized = uniques[usable], counts[usable], normalized[usable].reset_index(drop=True)
+
+        # Identical after normalization -> same document; MinHash only sees distinct texts
+        doc_codes, texts = pd.factorize(normalized)
+        document, grams = shingle_codes(texts.tolist(), self.shingle)
+        signatures = minhash(document, grams, len(texts), self.num_perm, self.seed)
+        pairs = band_buckets(signatures, self.bands)
+        pairs = pairs[estimated_jaccard(signatures, pairs) >= self.threshold]
+        labels = connected_labels(len(texts), pairs)[doc_codes]
+
+        frame = pd.DataFrame({'value': uniques, 'normalized': normalized.to_numpy(), 'lines': counts,
+                              'cluster': labels})
+        sizes = frame.groupby('cluster')['value'].transform('size')
+        frame = frame[sizes > 1].sort_values(['cluster', 'lines'], ascending=[True, False])
+        frame['canonical'] = frame.groupby('cluster')['value'].transform('first')
+        return frame.reset_index(drop=True)
+
+
+def near_duplicate_summary(clusters):
+    """Per cluster: canonical value, variants and lines affected"""
+    summary = clusters.groupby('cluster').agg(canonical=('canonical', 'first'), variants=('value', 'size'),
+                                              lines=('lines', 'sum'),
+                                              examples=('value', lambda v: list(v[1:4])))
+    return summary.sort_values('lines', ascending=False)
+
+
+def make_synthetic_descriptions(n_products=3000, variant_rate=0.3, seed=0):
+    """Product names plus case/whitespace/typo/abbreviation variants (with line counts)"""
+    rng = np.random.default_rng(seed)
+    # Made-up product words, so distinct products rarely share most of their shingles
+    syllables = ['BA', 'KE', 'LO', 'RI', 'TU', 'MA', 'NE', 'SO', 'PI', 'DU', 'GA', 'FE', 'WO', 'ZI', 'CHA', 'TRO']
+    words = sorted({''.join(rng.choice(syllables, rng.integers(2, 4))) for _ in range(600)})
+    names = set()
+    while len(names) < n_products:
+        size = rng.integers(3, 5)
+        name = ' '.join(rng.choice(words, size, replace=False))
+        if rng.random() < 0.2:
+            name = f"SET OF {rng.integers(2, 7)} {name}"
+        names.add(name)
+    names = sorted(names)
+    values = list(names)
+    for name in names:
+        if rng.random() >= variant_rate:
+            continue
+        kind = rng.integers(0, 4)
+        if kind == 0:
+            variant = name.lower().title()
+        elif kind == 1:
+            variant = '  ' + name.replace(' ', '  ') + ' '
+        elif kind == 2 and len(name) > 8:
+            cut = rng.integers(1, len(name) - 1)
+            variant = name[:cut] + name[cut + 1:]  # dropped character
+        else:
+            variant = name.replace('SET OF ', 'SET/') if name.startswith('SET OF') else name + '.'
+        values.append(variant)
+    lines = np.repeat(values, rng.integers(1, 40, len(values)))
+    return pd.Series(lines, name='Description')
+
+
+# Main execution
+if __name__ == "__main__":
+    import os
+    import time
+    from retail_returns import RETAIL_FILE
+
+    print("=" * 70)
+    print("NEAR-DUPLICATE DESCRIPTIONS (MinHash/LSH)")
+    print("=" * 70)
+
+    if os.path.exists(RETAIL_FILE):
+        descriptions = pd.read_excel(RETAIL_FILE, usecols=['Description'])['Description']
+    else:
+        print(f"\n{RETAIL_FILE} not found - using synthetic descriptions")
+        descriptions = make_synthetic_descriptions()
+    print(f"\nLines: {len(descriptions):,}, distinct descriptions: {descriptions.nunique():,}")
+
+    detector = NearDuplicateDetector()
+    start = time.perf_counter()
+    clusters = detector.cluster(descriptions)
+    print(f"MinHash/LSH clustering: {time.perf_counter() - start:.2f}s")
+    summary = near_duplicate_summary(clusters)
+    print(f"Clusters: {len(summary):,} covering {len(clusters):,} distinct values, "
+          f"{summary['lines'].sum():,} lines")
+    print(summary.head(15).to_string())
+
+    # Brute force on a sample of distinct values: exact shingle-set Jaccard for every pair
+    sample = pd.Series(descriptions.dropna().unique()).sample(800, random_state=0).tolist()
+    sample_clusters = detector.cluster(pd.Series(sample))
+    cluster_of = dict(zip(sample_clusters['value'], sample_clusters['cluster']))
+    normalized = normalize(sample).tolist()
+    padded = [f" {text} " for text in normalized]
+    shingle_sets = [{text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)} for text in padded]
+    start = time.perf_counter()
+    similar = [(i, j) for i in range(len(sample)) for j in range(i + 1, len(sample))
+               if len(shingle_sets[i] & shingle_sets[j]) / max(len(shingle_sets[i] | shingle_sets[j]), 1) >= 0.8]
+    brute_time = time.perf_counter() - start
+    found = sum(1 for i, j in similar if sample[i] in cluster_of and cluster_of[sample[i]] == cluster_of.get(sample[j]))
+    print(f"\nBrute-force pairwise Jaccard on {len(sample)} values: {brute_time:.2f}s "
+          f"(~{brute_time * (descriptions.nunique() / len(sample)) ** 2:.0f}s for all)")
+    print(f"Pairs with Jaccard >= 0.8 found in the same cluster: {found} of {len(similar)}")
@@ -0,0 +1,188 @@
+"""
+Sweep-Line Cab Occupancy
+
+How many trips are in progress at each minute, citywide and per pickup
+borough. Every trip becomes two events, +1 at the minute of pickup and
+-1 at the minute after dropoff; the events are sorted once and a cumulative
+sum gives the occupancy series. Cost is O(n log n) instead of comparing
+every minute against every trip.
+
+Impossible intervals (missing times, dropoff before pickup, trips longer
+than 24 hours) are dropped inline. Events are kept on an absolute minute
+axis as sparse (key, delta) pairs, so accumulators built from different
+months - or different workers - merge exactly, including trips that
+cross a month boundary.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import numpy as np
+import pandas as pd
+
+MINUTE = np.timedelta64(1, 'm')
+MAX_DURATION = np.timedelta64(24, 'h')
+GROUP_SHIFT = np.int64(1) << 40  # key = group * GROUP_SHIFT + minutes since 1970
+CITYWIDE = 'Citywide'
+
+
+class OccupancyAccumulator:
+    """Mergeable +1/-1 event deltas per group on an absolute minute axis"""
+
+    def __init__(self, max_duration=MAX_DURATION):
+        self.max_duration = max_duration
+        self.groups = [CITYWIDE]
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.deltas = np.zeros(0, dtype=np.int64)
+        self.trips = 0
+        self.dropped = {'missing': 0, 'negative': 0, 'too_long': 0}
+
+    def _group_codes(self, labels):
+        """Stable integer code per group label (new labels are appended)"""
+        codes, uniques = pd.factorize(pd.Series(labels).fillna('Unknown'))
+        mapping = []
+        for label in uniques:
+            if label not in self.groups:
+                self.groups.append(label)
+            mapping.append(self.groups.index(label))
+        return np.asarray(mapping, dtype=np.int64)[codes]
+
+    def _merge_events(self, keys, deltas):
+        keys = np.concatenate([self.keys, keys])
+        deltas = np.concatenate([self.deltas, deltas])
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.deltas = np.bincount(inverse, weights=deltas, minlength=len(self.keys)).astype(np.int64)
+        # Drop keys whose deltas cancelled out
+        keep = self.deltas != 0
+        self.keys, self.deltas = self.keys[keep], self.deltas[keep]
+
+    def add(self, pickups, dropoffs, groups=None):
+        """Add trips given pickup/dropoff times and optional group labels"""
+        pickups = np.asarray(pickups, dtype='datetime64[ns]')
+        dropoffs = np.asarray(dropoffs, dtype='datetime64[ns]')
+
+        missing = np.isnat(pickups) | np.isnat(dropoffs)
+        duration = dropoffs - pickups
+        negative = ~missing & (duration < np.timedelta64(0, 'ns'))
+        too_long = ~missing & (duration > self.max_duration)
+        valid = ~(missing | negative | too_long)
+        self.dropped['missing'] += int(missing.sum())
+        self.dropped['negative'] += int(negative.sum())
+        self.dropped['too_long'] += int(too_long.sum())
+        self.trips += int(valid.sum())
+
+        # Active during minute m when pickup < m + 1 and dropoff > m: [floor(pickup), ceil(dropoff))
+        start = pickups[valid].astype('datetime64[m]').astype(np.int64)
+        end = -((-dropoffs[valid].astype(np.int64)) // (60 * 10**9))  # ceil to the minute
+        end = np.maximum(end, start + 1)
+
+        group_keys = [np.zeros(len(start), dtype=np.int64)]
+        if groups is not None:
+            group_keys.append(self._group_codes(np.asarray(groups, dtype=object)[valid]) * GROUP_SHIFT)
+        keys = np.concatenate([base + minutes for base in group_keys for minutes in (start, end)])
+        deltas = np.concatenate([sign for _ in group_keys for sign in
+                                 (np.ones(len(start), dtype=np.int64), -np.ones(len(end), dtype=np.int64))])
+        self._merge_events(keys, deltas)
+        return self
+
+    def add_trips(self, df, zones=None):
+        """Add a trip DataFrame; with zones, also track pickup boroughs"""
+        groups = None
+        if zones is not None:
+            groups = df['PULocationID'].map(zones['Borough']).to_numpy(dtype=object)
+        return self.add(df['tpep_pickup_datetime'].to_numpy(), df['tpep_dropoff_datetime'].to_numpy(), groups)
+
+    def merge(self, other):
+        """Fold another accumulator (e.g. the next month) into this one"""
+        remap = np.asarray([self._group_codes([label])[0] for label in other.groups], dtype=np.int64)
+        group, minutes = np.divmod(other.keys, GROUP_SHIFT)
+        self._merge_events(remap[group] * GROUP_SHIFT + minutes, other.deltas)
+        self.trips += other.trips
+        for reason, count in other.dropped.items():
+            self.dropped[reason] += count
+        return self
+
+    def series(self, start=None, end=None):
+        """Occupied cabs per minute as a DataFrame (one column per group)"""
+        group, minutes = np.divmod(self.keys, GROUP_SHIFT)
+        if start is None:
+            start = minutes.min() if len(minutes) else 0
+        else:
+            start = np.datetime64(start, 'm').astype(np.int64)
+        if end is None:
+            end = minutes.max() if len(minutes) else 0
+        else:
+            end = np.datetime64(end, 'm').astype(np.int64)
+        axis = np.arange(start, end, dtype=np.int64)
+
+        columns = {}
+        for code, label in enumerate(self.groups):
+            selected = group == code
+            event_minutes = minutes[selected]
+            occupancy = np.cumsum(self.deltas[selected])
+            # Occupancy at minute m = running total after the last event at or before m
+            position = np.searchsorted(event_minutes, axis, side='right') - 1
+            columns[label] = np.where(position >= 0, occupancy[np.maximum(position, 0)], 0)
+        index = pd.DatetimeIndex(axis.astype('datetime64[m]').astype('datetime64[ns]'), name='minute')
+        return pd.DataFrame(columns, index=index)
+
+    def save(self, path):
+        np.savez(path, keys=self.keys, deltas=self.deltas, groups=np.asarray(self.groups, dtype=str),
+                 trips=self.trips, dropped=np.asarray(list(self.dropped.values())))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        accumulator = cls()
+        accumulator.keys, accumulator.deltas = data['keys'], data['deltas']
+        accumulator.groups = data['groups'].tolist()
+        accumulator.trips = int(data['trips'])
+        accumulator.dropped = dict(zip(accumulator.dropped, data['dropped'].tolist()))
+        return accumulator
+
+
+# Main execution
+if __name__ == "__main__":
+    import time
+    from taxi_data import load_trips, load_zones
+    from zone_windows import month_bounds
+
+    print("=" * 70)
+    print("CAB OCCUPANCY - trips in progress per minute")
+    print("=" * 70)
+
+    df = load_trips(columns=['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'PULocationID'])
+    zones = load_zones()
+    month_start, month_end = month_bounds(df['tpep_pickup_datetime'].to_numpy())
+    print(f"\nTrips: {len(df):,}")
+
+    start = time.perf_counter()
+    occupancy = OccupancyAccumulator().add_trips(df, zones)
+    series = occupancy.series(month_start, month_end)
+    print(f"Sweep line over {len(series):,} minutes x {len(series.columns)} series: "
+          f"{time.perf_counter() - start:.2f}s")
+    print(f"Dropped intervals: {occupancy.dropped}")
+
+    # Merging two halves must give exactly the same series
+    half = len(df) // 2
+    merged = OccupancyAccumulator().add_trips(df.iloc[:half], zones)
+    merged.merge(OccupancyAccumulator().add_trips(df.iloc[half:], zones))
+    same = merged.series(month_start, month_end)[series.columns].equals(series)
+    print(f"Merged halves identical: {same}")
+
+    # Brute-force check on a sample of minutes
+    valid = df[(df['tpep_dropoff_datetime'] >= df['tpep_pickup_datetime']) &
+               (df['tpep_dropoff_datetime'] - df['tpep_pickup_datetime'] <= pd.Timedelta(hours=24))]
+    sample = series.index[::997]
+    pickup_minute = valid['tpep_pickup_datetime'].dt.floor('min').to_numpy()
+    dropoff_minute = valid['tpep_dropoff_datetime'].dt.ceil('min').to_numpy()
+    brute = [int(((pickup_minute <= m) & (np.maximum(dropoff_minute, pickup_minute + MINUTE) > m)).sum())
+             for m in sample.to_numpy()]
+    print(f"Brute-force check on {len(sample)} minutes: {(series.loc[sample, CITYWIDE].to_numpy() == brute).all()}")
+
+    print("\nPeak occupancy:")
+    print(series.max().sort_values(ascending=False).to_string())
+    print(f"\nBusiest minute citywide: {series[CITYWIDE].idxmax()}")
+
+    print("\nAverage cabs in service by hour of day:")
+    print(series.groupby(series.index.hour).mean().round(1).rename_axis('hour').to_string())
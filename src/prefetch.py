@@ -0,0 +1,171 @@
+"""
+Background Prefetch Pipeline
+
+Overlaps Parquet I/O and decode with computation. While the caller
+aggregates the current batch, background threads read and decode the
+next files or row groups into a bounded window (Parquet decode releases
+the GIL, so the threads genuinely run in parallel with NumPy/pandas
+work). Results are delivered in order.
+
+The prefetcher records how often and how long the consumer had to wait
+(stalls) and how many batches were already decoded when it asked for the
+next one, which is what is needed to size the prefetch depth for a given
+storage device.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow.parquet as pq
+
+_DONE = object()
+
+
+class PrefetchStats:
+    """Queue statistics collected while a Prefetcher is consumed"""
+
+    def __init__(self, depth, workers):
+        self.depth = depth
+        self.workers = workers
+        self.items = 0
+        self.stalls = 0
+        self.stall_seconds = 0.0
+        self.load_seconds = 0.0
+        self.ready_ahead = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def as_dict(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return {
+            'items': self.items,
+            'depth': self.depth,
+            'workers': self.workers,
+            'stalls': self.stalls,
+            'stall_seconds': round(self.stall_seconds, 3),
+            'stall_pct_of_wall': round(self.stall_seconds / elapsed * 100, 1) if elapsed else 0.0,
+            'avg_load_seconds': round(self.load_seconds / self.items, 4) if self.items else 0.0,
+            'avg_ready_ahead': round(self.ready_ahead / self.items, 2) if self.items else 0.0,
+            'wall_seconds': round(elapsed, 3),
+        }
+
+    def report(self):
+        """Print the statistics with a sizing hint"""
+        stats = self.as_dict()
+        print(f"\nPrefetch statistics (depth={stats['depth']}, workers={stats['workers']}):")
+        print(f"  Items delivered: {stats['items']:,}")
+        print(f"  Consumer stalls: {stats['stalls']:,} "
+              f"({stats['stall_seconds']:.2f}s, {stats['stall_pct_of_wall']:.1f}% of wall time)")
+        print(f"  Average load time per item: {stats['avg_load_seconds'] * 1000:.1f} ms")
+        print(f"  Average items ready ahead: {stats['avg_ready_ahead']:.2f}")
+        if stats['stall_pct_of_wall'] > 10:
+            print("  → I/O bound: consider more workers or a deeper prefetch queue")
+        elif stats['avg_ready_ahead'] >= self.depth - 0.5:
+            print("  → Compute bound: the queue stays full, a smaller depth would do")
+
+
+class Prefetcher:
+    """Iterate over `load(item)` results with up to `depth` loads in flight"""
+
+    def __init__(self, items, load, depth=2, workers=2):
+        self.items = iter(items)
+        self.load = load
+        self.depth = max(1, depth)
+        self.workers = max(1, workers)
+        self.stats = PrefetchStats(self.depth, self.workers)
+
+    def _timed_load(self, item):
+        start = time.perf_counter()
+        result = self.load(item)
+        return result, time.perf_counter() - start
+
+    def __iter__(self):
+        window = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prefetch') as pool:
+            def fill():
+                while len(window) < self.depth:
+                    item = next(self.items, _DONE)
+                    if item is _DONE:
+                        return
+                    window.append(pool.submit(self._timed_load, item))
+
+            try:
+                fill()
+                while window:
+                    future = window[0]
+                    self.stats.ready_ahead += sum(f.done() for f in window)
+                    if not future.done():
+                        self.stats.stalls += 1
+                        start = time.perf_counter()
+                        result, load_seconds = future.result()
+                        self.stats.stall_seconds += time.perf_counter() - start
+                    else:
+                        result, load_seconds = future.result()
+                    window.popleft()
+                    fill()  # Start the next load before handing over this one
+                    self.stats.items += 1
+                    self.stats.load_seconds += load_seconds
+                    yield result
+            finally:
+                for pending in window:
+                    pending.cancel()
+                self.stats.finished = time.perf_counter()
+
+
+def row_group_tasks(paths):
+    """(path, row group index) for every row group of every file"""
+    return [(path, index) for path in paths for index in range(pq.ParquetFile(path).num_row_groups)]
+
+
+def prefetch_row_groups(paths, columns=None, depth=4, workers=2, load=None):
+    """Prefetcher yielding one decoded Arrow table per row group"""
+    def read_row_group(task):
+        path, index = task
+        table = pq.ParquetFile(path).read_row_group(index, columns=columns)
+        return load(task, table) if load is not None else table
+
+    return Prefetcher(row_group_tasks(paths), read_row_group, depth, workers)
+
+
+def prefetch_files(paths, columns=None, depth=2, workers=2):
+    """Prefetcher yielding one decoded Arrow table per file"""
+    return Prefetcher(paths, lambda path: pq.read_table(path, columns=columns), depth, workers)
+
+
+# Main execution
+if __name__ == "__main__":
+    import glob
+    import os
+    import sys
+
+    import numpy as np
+
+    pattern = sys.argv[1] if len(sys.argv) > 1 else os.path.join('data', 'yellow_tripdata_*.parquet')
+    paths = sorted(p for p in glob.glob(pattern) if not p.endswith(('.clean.parquet', '.features.parquet')))
+    if not paths:
+        sys.exit(f"No files match {pattern}")
+    columns = ['tpep_pickup_datetime', 'PULocationID', 'fare_amount']
+
+    print("=" * 70)
+    print("PREFETCH PIPELINE - hourly counts and fare sums by pickup zone")
+    print("=" * 70)
+
+    def aggregate(table, totals):
+        hours = table.column('tpep_pickup_datetime').to_numpy().astype('datetime64[h]').astype(np.int64) % 24
+        totals['hourly'] += np.bincount(hours, minlength=24)
+        zones = table.column('PULocationID').to_numpy()
+        totals['fares'] += np.bincount(zones, weights=table.column('fare_amount').to_numpy(), minlength=300)[:300]
+
+    for depth, workers in [(1, 1), (4, 2)]:
+        totals = {'hourly': np.zeros(24, dtype=np.int64), 'fares': np.zeros(300)}
+        start = time.perf_counter()
+        prefetcher = prefetch_row_groups(paths, columns, depth=depth, workers=workers)
+        for table in prefetcher:
+            aggregate(table, totals)
+        print(f"\ndepth={depth}, workers={workers}: {time.perf_counter() - start:.2f}s, "
+              f"{totals['hourly'].sum():,} trips")
+        prefetcher.stats.report()
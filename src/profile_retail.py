@@ -14,7 +14,9 @@ import sys
 
 # Import our profiler class
 sys.path.append(os.path.dirname(__file__))
-from data_profiler import DataProfiler
+from data_profiler import DataProfiler, print_dtype_report
+from retail_returns import match_returns, print_returns_summary
+from near_duplicates import NearDuplicateDetector, near_duplicate_summary
 
 print("=" * 70)
 print("RETAIL DATA QUALITY PROFILING")
@@ -59,6 +61,10 @@ if 'Quantity' in df.columns:
     negative_qty = df[df['Quantity'] < 0]
     print(f"\nNegative Quantities (returns): {len(negative_qty):,} ({len(negative_qty)/len(df)*100:.2f}%)")
     
+    # Link each return to the most recent earlier sale (same customer, product and price)
+    if all(c in df.columns for c in ['CustomerID', 'StockCode', 'UnitPrice', 'InvoiceDate']):
+        print_returns_summary(match_returns(df), df)
+    
 # Check for zero prices
 if 'UnitPrice' in df.columns:
     zero_price = df[df['UnitPrice'] == 0]
@@ -81,4 +87,22 @@ if 'Description' in df.columns:
     
     # Look for duplicate descriptions (might indicate data entry issues)
     duplicate_desc = df['Description'].value_counts()
-    print(f"Most common description: '{duplicate_desc.index[0]}' appears {duplicate_desc.iloc[0]:,} times")
\ No newline at end of file
+    print(f"Most common description: '{duplicate_desc.index[0]}' appears {duplicate_desc.iloc[0]:,} times")
+    
+    # Near-duplicates that exact value_counts miss (case, spacing, typos, SET/3 vs SET OF 3)
+    near_duplicates = NearDuplicateDetector().cluster(df['Description'])
+    if len(near_duplicates):
+        summary = near_duplicate_summary(near_duplicates)
+        print(f"\nNear-duplicate description clusters: {len(summary):,} "
+              f"({len(near_duplicates):,} distinct descriptions, {summary['lines'].sum():,} lines)")
+        print(summary.head(10).to_string())
+    else:
+        print("\nNo near-duplicate descriptions found")
+
+# Compact representation: category codes for invoice/stock/description/country,
+# int32 cents for prices, downcast quantities and customer IDs
+retail_columns = [c for c in df.columns if c != 'desc_length']
+print_dtype_report(profiler.dtype_report()[lambda r: r.index.isin(retail_columns)])
+compact = profiler.compact_schema().apply(df[retail_columns])
+print(f"\nRetail frame with the compact schema: {df[retail_columns].memory_usage(deep=True).sum() / 1024 ** 2:.1f} MB -> "
+      f"{compact.memory_usage(deep=True).sum() / 1024 ** 2:.1f} MB")
@@ -0,0 +1,89 @@
+"""
+Trip Query Client
+
+Standard-library client for the local query service, so analysis
+scripts can ask for aggregates without importing pandas or reloading
+the trip data.
+
+Usage:
+    from query_client import QueryClient
+    client = QueryClient()
+    top = client.series('top_zones', side='pickup', n=15)
+
+Author: Henrik
+Date: November 2024
+"""
+
+import json
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+DEFAULT_URL = 'http://127.0.0.1:8765'
+
+
+class QueryClient:
+    """Thin HTTP client for query_service.py"""
+
+    def __init__(self, base_url=DEFAULT_URL, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _get(self, path, params=None):
+        url = self.base_url + path
+        if params:
+            url += '?' + urlencode(params)
+        try:
+            with urlopen(url, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except HTTPError as exc:
+            detail = json.loads(exc.read().decode('utf-8')).get('error', exc.reason)
+            raise RuntimeError(f"Query failed ({exc.code}): {detail}") from None
+
+    def health(self):
+        """Service status and cache statistics"""
+        return self._get('/health')
+
+    def queries(self):
+        """Names of the available queries"""
+        return self._get('/queries')['queries']
+
+    def query(self, name, **params):
+        """Full response for a query (result plus timing/cache metadata)"""
+        return self._get(f'/query/{name}', params)
+
+    def series(self, name, **params):
+        """Series-shaped result as a list of (label, value) pairs"""
+        result = self.query(name, **params)['result']
+        return list(zip(result['index'], result['values']))
+
+    def table(self, name, **params):
+        """Table-shaped result as a list of row dicts"""
+        result = self.query(name, **params)['result']
+        return [dict(zip(result['columns'], row)) for row in result['data']]
+
+
+# Main execution
+if __name__ == "__main__":
+    client = QueryClient()
+
+    print("=" * 70)
+    print("QUERY SERVICE CLIENT")
+    print("=" * 70)
+    print(f"\nService status: {client.health()}")
+
+    print("\nTop 15 pickup zones:")
+    for zone, trips in client.series('top_zones', side='pickup', n=15):
+        print(f"  {zone:<40} {trips:>10,}")
+
+    print("\nJFK pickups by hour:")
+    for hour, trips in client.series('hourly_counts', zone='JFK'):
+        print(f"  {hour:>2}: {trips:,}")
+
+    print("\nTipping by rider type:")
+    for row in client.table('tip_stats', by='rider_type'):
+        print(f"  {row}")
+
+    print("\nTop borough routes:")
+    for route, trips in client.series('od_counts', level='borough', n=10):
+        print(f"  {route:<30} {trips:>10,}")
@@ -0,0 +1,333 @@
+"""
+Local Trip Query Service
+
+Long-lived daemon that loads the cleaned trips, the zone dimension and
+the time keys once and answers parameterized aggregate queries over HTTP
+(top zones, hourly counts, tip stats by group, OD counts). Requests are
+handled concurrently: the asyncio loop accepts connections while the
+pandas/NumPy work runs on a thread pool. Results are kept in an LRU cache
+and identical in-flight queries share a single computation.
+
+Usage:
+    python src/query_service.py --port 8765
+    curl "http://127.0.0.1:8765/query/top_zones?side=pickup&n=15"
+
+Author: Henrik
+Date: November 2024
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+
+import numpy as np
+import pandas as pd
+
+from taxi_data import DATA_FILE, ZONES_FILE, DAY_ORDER, TIME_PERIODS, load_clean_trips, load_zones
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+TRIP_COLUMNS = [
+    'tpep_pickup_datetime', 'PULocationID', 'DOLocationID', 'passenger_count',
+    'trip_distance', 'fare_amount', 'tip_amount', 'payment_type',
+]
+
+
+class TripStore:
+    """Cleaned trips, zone dimension and time keys held in memory"""
+
+    def __init__(self, data_file=DATA_FILE, zones_file=ZONES_FILE):
+        print(f"Loading trips from {data_file}...")
+        start = time.perf_counter()
+        trips = load_clean_trips(data_file, columns=TRIP_COLUMNS)
+        zones = load_zones(zones_file)
+
+        # Zone dimension as arrays indexed directly by LocationID
+        self.n_locations = int(max(zones.index.max(), trips['PULocationID'].max(),
+                                   trips['DOLocationID'].max())) + 1
+        self.zone_names = np.full(self.n_locations, 'Unknown', dtype=object)
+        self.zone_names[zones.index] = zones['Zone'].fillna('Unknown').values
+        self.zone_boroughs = np.full(self.n_locations, 'Unknown', dtype=object)
+        self.zone_boroughs[zones.index] = zones['Borough'].fillna('Unknown').values
+        self.boroughs = sorted(set(self.zone_boroughs))
+        borough_code = {name: i for i, name in enumerate(self.boroughs)}
+        self.zone_borough_codes = np.array([borough_code[b] for b in self.zone_boroughs], dtype=np.int8)
+
+        # Trip columns as compact NumPy arrays
+        self.pu = trips['PULocationID'].to_numpy(np.int16)
+        self.do = trips['DOLocationID'].to_numpy(np.int16)
+        self.passengers = trips['passenger_count'].to_numpy(np.int8)
+        self.fare = trips['fare_amount'].to_numpy(np.float64)
+        self.distance = trips['trip_distance'].to_numpy(np.float64)
+        self.tip = trips['tip_amount'].to_numpy(np.float64)
+        self.payment_type = trips['payment_type'].to_numpy(np.int8)
+
+        # Time keys
+        pickup = pd.to_datetime(trips['tpep_pickup_datetime'])
+        self.pickup_hour = pickup.dt.hour.to_numpy(np.int8)
+        self.pickup_dow = pickup.dt.dayofweek.to_numpy(np.int8)
+
+        # Tipping subset (credit card, positive fare, tip <= 100% of fare)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tip_pct = self.tip / self.fare * 100
+        self.tip_mask = ((self.payment_type == 1) & (self.fare > 0) &
+                         (self.tip >= 0) & (tip_pct <= 100))
+        self.tip_percentage = np.where(self.tip_mask, tip_pct, np.nan)
+
+        print(f"Loaded {len(self.pu):,} trips in {time.perf_counter() - start:.1f}s")
+
+    def _zone_mask(self, zone, side):
+        """Trip mask for zones whose name contains `zone` (case-insensitive)"""
+        if not zone:
+            return None
+        matches = [i for i, name in enumerate(self.zone_names) if zone.lower() in str(name).lower()]
+        codes = self.pu if side == 'pickup' else self.do
+        return np.isin(codes, matches)
+
+    def top_zones(self, side='pickup', n=15, borough=''):
+        """Most frequent pickup or dropoff zones"""
+        codes = self.pu if side == 'pickup' else self.do
+        counts = np.bincount(codes, minlength=self.n_locations)
+        if borough:
+            counts = np.where(self.zone_boroughs == borough, counts, 0)
+        result = pd.Series(counts, index=self.zone_names).groupby(level=0).sum()
+        return result[result > 0].nlargest(n)
+
+    def hourly_counts(self, zone='', side='pickup', day=''):
+        """Trips by pickup hour, optionally for matching zones or one weekday"""
+        mask = self._zone_mask(zone, side)
+        if day:
+            day_mask = self.pickup_dow == DAY_ORDER.index(day)
+            mask = day_mask if mask is None else mask & day_mask
+        hours = self.pickup_hour if mask is None else self.pickup_hour[mask]
+        return pd.Series(np.bincount(hours, minlength=24), index=pd.RangeIndex(24, name='pickup_hour'))
+
+    def zone_stats(self, zone='JFK', side='pickup'):
+        """Fare and distance summary for trips at matching zones (all trips if no zone)"""
+        mask = self._zone_mask(zone, side)
+        if mask is None:
+            mask = np.ones(len(self.fare), dtype=bool)
+        fare, distance = self.fare[mask], self.distance[mask]
+        hours = self.pickup_hour[mask]
+        late = np.isin(hours, [22, 23, 0, 1, 2, 3, 4, 5])
+        return pd.Series({
+            'trips': int(mask.sum()),
+            'fare_mean': float(fare.mean()) if len(fare) else np.nan,
+            'fare_median': float(np.median(fare)) if len(fare) else np.nan,
+            'distance_mean': float(distance.mean()) if len(distance) else np.nan,
+            'distance_median': float(np.median(distance)) if len(distance) else np.nan,
+            'late_night_pct': float(late.mean() * 100) if len(hours) else np.nan,
+        })
+
+    def tip_stats(self, by='rider_type', zone='', hours=''):
+        """Tip amount and tip percentage summary by rider or time group"""
+        mask = self.tip_mask.copy()
+        zone_mask = self._zone_mask(zone, 'pickup')
+        if zone_mask is not None:
+            mask &= zone_mask
+        if hours:
+            mask &= np.isin(self.pickup_hour, [int(h) for h in hours.split(',')])
+
+        if by == 'rider_type':
+            keys = np.where(self.passengers[mask] == 1, 'Solo', 'Group')
+        elif by == 'passenger_count':
+            keys = self.passengers[mask]
+        elif by == 'pickup_hour':
+            keys = self.pickup_hour[mask]
+        elif by == 'time_period':
+            keys = np.array(TIME_PERIODS)[self.pickup_hour[mask] // 6]
+        else:
+            raise ValueError(f"Unsupported grouping: {by}")
+
+        frame = pd.DataFrame({
+            by: keys,
+            'tip_amount': self.tip[mask],
+            'tip_percentage': self.tip_percentage[mask],
+        })
+        summary = frame.groupby(by).agg(
+            trips=('tip_amount', 'count'),
+            tip_mean=('tip_amount', 'mean'),
+            tip_median=('tip_amount', 'median'),
+            tip_pct_mean=('tip_percentage', 'mean'),
+            tip_pct_median=('tip_percentage', 'median'),
+            zero_tip_pct=('tip_amount', lambda s: (s == 0).mean() * 100),
+        )
+        return summary.round(2)
+
+    def od_counts(self, level='borough', n=20):
+        """Origin-destination trip counts at borough or zone level"""
+        if level == 'borough':
+            size = len(self.boroughs)
+            origin = self.zone_borough_codes[self.pu].astype(np.int64)
+            dest = self.zone_borough_codes[self.do].astype(np.int64)
+            names = np.array(self.boroughs, dtype=object)
+        elif level == 'zone':
+            size = self.n_locations
+            origin, dest = self.pu.astype(np.int64), self.do.astype(np.int64)
+            names = self.zone_names
+        else:
+            raise ValueError(f"Unsupported level: {level}")
+
+        counts = np.bincount(origin * size + dest, minlength=size * size)
+        top = np.argsort(counts)[::-1][:n]
+        top = top[counts[top] > 0]
+        routes = [f"{names[i // size]} → {names[i % size]}" for i in top]
+        return pd.Series(counts[top], index=routes, name='trips')
+
+
+QUERIES = {
+    'top_zones': TripStore.top_zones,
+    'hourly_counts': TripStore.hourly_counts,
+    'zone_stats': TripStore.zone_stats,
+    'tip_stats': TripStore.tip_stats,
+    'od_counts': TripStore.od_counts,
+}
+
+
+def _coerce_params(func, params):
+    """Convert query-string values to the types of the function defaults"""
+    defaults = dict(zip(func.__code__.co_varnames[1:func.__code__.co_argcount],
+                        func.__defaults__ or ()))
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {sorted(unknown)}")
+    coerced = dict(defaults)
+    for name, value in params.items():
+        coerced[name] = type(defaults[name])(value)
+    return coerced
+
+
+def _to_json(result):
+    """Serialize a pandas result into plain JSON-friendly structures"""
+    if isinstance(result, pd.DataFrame):
+        payload = result.reset_index().to_dict(orient='split')
+        payload.pop('index', None)
+        return payload
+    return {'index': result.index.tolist(), 'values': result.tolist()}
+
+
+class QueryService:
+    """Asyncio HTTP front end with an LRU result cache"""
+
+    def __init__(self, store, cache_size=256, workers=4):
+        self.store = store
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.in_flight = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.stats = {'requests': 0, 'cache_hits': 0, 'computed': 0}
+
+    async def run_query(self, name, params):
+        """Answer a query from the cache or compute it on the thread pool"""
+        if name not in QUERIES:
+            raise KeyError(name)
+        func = QUERIES[name]
+        args = _coerce_params(func, params)
+        key = (name, tuple(sorted(args.items())))
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.stats['cache_hits'] += 1
+            return self.cache[key], True
+
+        # Share the computation between identical concurrent requests
+        if key not in self.in_flight:
+            loop = asyncio.get_running_loop()
+            self.in_flight[key] = loop.run_in_executor(
+                self.executor, lambda: _to_json(func(self.store, **args))
+            )
+            self.stats['computed'] += 1
+        try:
+            result = await asyncio.shield(self.in_flight[key])
+        finally:
+            self.in_flight.pop(key, None)
+
+        self.cache[key] = result
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result, False
+
+    async def handle(self, reader, writer):
+        """Serve a single HTTP/1.1 request"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass  # Headers are not needed
+            if not request_line:
+                return
+            method, target = request_line.split(' ')[:2]
+            self.stats['requests'] += 1
+            status, body = await self.dispatch(method, target)
+        except Exception as exc:
+            status, body = 500, {'error': str(exc)}
+
+        payload = json.dumps(body, default=str).encode('utf-8')
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}.get(status, 'Error')
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1') + payload
+        )
+        await writer.drain()
+        writer.close()
+
+    async def dispatch(self, method, target):
+        """Route a request target to a response"""
+        if method != 'GET':
+            return 405, {'error': 'Only GET is supported'}
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+
+        if url.path == '/health':
+            return 200, {'status': 'ok', 'trips': len(self.store.pu), **self.stats,
+                         'cache_entries': len(self.cache)}
+        if url.path == '/queries':
+            return 200, {'queries': sorted(QUERIES)}
+        if url.path.startswith('/query/'):
+            name = url.path[len('/query/'):]
+            start = time.perf_counter()
+            try:
+                result, cached = await self.run_query(name, params)
+            except KeyError:
+                return 404, {'error': f"Unknown query: {name}"}
+            except (ValueError, TypeError) as exc:
+                return 400, {'error': str(exc)}
+            return 200, {
+                'query': name,
+                'params': params,
+                'cached': cached,
+                'elapsed_ms': round((time.perf_counter() - start) * 1000, 2),
+                'result': result,
+            }
+        return 404, {'error': f"Unknown path: {url.path}"}
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Query service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve trip aggregates from memory')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--data-file', default=DATA_FILE)
+    parser.add_argument('--cache-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    store = TripStore(args.data_file)
+    service = QueryService(store, cache_size=args.cache_size, workers=args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\nQuery service stopped")
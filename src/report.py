@@ -0,0 +1,521 @@
+"""
+Consolidated Analysis Report
+
+Renders the project's headline findings (cleaning statistics, the $70
+fare spike, hourly peaks, top zones, JFK vs LaGuardia, borough flows and
+tipping) into docs/report.md and docs/report.html, with figures in
+docs/figures.
+
+The report is built only from small persisted aggregates, never from raw
+trips. One row-group map-reduce pass per trip file produces additive
+count/sum tables (a few hundred KB) that are stored in the result cache,
+keyed by the file's fingerprint and the aggregation code. Rendering reads
+those tables plus the zone lookup, so rewording the report or adding a
+month only recomputes what changed and a rerun takes a second or two.
+Use --refresh to recompute the aggregates anyway.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import argparse
+import html
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(__file__))
+import rowgroup_mapreduce
+from fare_audit import TARIFFS, JFK_ZONE
+from result_cache import ResultCache, dataset_fingerprint, code_version
+from rowgroup_mapreduce import (CLEAN_COLUMNS, Aggregator, FareHistogram, MapReduceExecutor, ODCounts,
+                                TipSums, _numpy)
+from taxi_data import DATA_FILE, ZONES_FILE, TIME_PERIODS, load_zones
+
+REPORT_DIR = 'docs'
+FIGURE_DIR = os.path.join(REPORT_DIR, 'figures')
+AIRPORTS = {'JFK': JFK_ZONE, 'LaGuardia': 138}
+LATE_NIGHT_HOURS = [22, 23, 0, 1, 2, 3, 4, 5]
+SPIKE_FARE = TARIFFS['jfk_flat'].iloc[-1]  # Current JFK <-> Manhattan flat fare
+FARE_EDGES = np.arange(0, 101, 1.0)
+RATECODES = ['1', '2', '3', '4', '5', '6', '99', 'missing']
+AGGREGATE_NAMES = ['report_cleaning', 'report_hourly', 'report_fares', 'report_spike',
+                   'report_airports', 'report_od', 'report_tips']
+
+
+class CleaningCounts(Aggregator):
+    """Raw rows, rows failing each cleaning rule and rows kept"""
+
+    columns = CLEAN_COLUMNS
+    labels = ['raw_rows', 'negative_fare', 'zero_distance', 'over_100_miles', 'invalid_passengers', 'kept']
+
+    def map(self, table, mask):
+        fare = _numpy(table, 'fare_amount')
+        distance = _numpy(table, 'trip_distance')
+        passengers = _numpy(table, 'passenger_count')
+        return np.array([
+            table.num_rows,
+            (fare < 0).sum(),
+            (distance <= 0).sum(),
+            (distance > 100).sum(),
+            (~((passengers > 0) & (passengers <= 6))).sum(),  # Includes missing counts
+            mask.sum(),
+        ], dtype=np.int64)
+
+    def empty(self):
+        return np.zeros(len(self.labels), dtype=np.int64)
+
+    def finalize(self, partial):
+        return pd.Series(partial, index=self.labels, name='rows')
+
+
+class HourlyFares(Aggregator):
+    """Trips and fare sums by pickup hour, plus credit-card tip sums"""
+
+    columns = ['tpep_pickup_datetime', 'fare_amount', 'tip_amount', 'payment_type']
+    labels = ['trips', 'fare_sum', 'card_trips', 'card_tip_sum', 'card_fare_sum']
+
+    def map(self, table, mask):
+        hours = _numpy(table, 'tpep_pickup_datetime').astype('datetime64[h]').astype(np.int64) % 24
+        fare = _numpy(table, 'fare_amount')
+        tip = _numpy(table, 'tip_amount')
+        card = mask & (_numpy(table, 'payment_type') == 1) & (fare > 0) & (tip >= 0) & (tip <= fare)
+        return np.stack([
+            np.bincount(hours[mask], minlength=24).astype(np.float64),
+            np.bincount(hours[mask], weights=fare[mask], minlength=24),
+            np.bincount(hours[card], minlength=24).astype(np.float64),
+            np.bincount(hours[card], weights=tip[card], minlength=24),
+            np.bincount(hours[card], weights=fare[card], minlength=24),
+        ])
+
+    def empty(self):
+        return np.zeros((len(self.labels), 24))
+
+    def finalize(self, partial):
+        return pd.DataFrame(partial.T, columns=self.labels).rename_axis('pickup_hour')
+
+
+class SpikeProfile(Aggregator):
+    """Trips within a dollar band around a fare: distance, JFK ends and rate codes"""
+
+    columns = ['fare_amount', 'trip_distance', 'RatecodeID', 'PULocationID', 'DOLocationID']
+
+    def __init__(self, fare=SPIKE_FARE, width=0.5):
+        self.low, self.high = fare - width, fare + width
+
+    def map(self, table, mask):
+        fare = _numpy(table, 'fare_amount')
+        keep = mask & (fare >= self.low) & (fare < self.high)
+        ratecode = _numpy(table, 'RatecodeID')[keep].astype(np.float64)
+        # Rate codes 1-6 keep their slot, 99 goes to slot 6, missing/other to slot 7
+        slot = np.where(np.isin(ratecode, [1, 2, 3, 4, 5, 6]), np.nan_to_num(ratecode) - 1,
+                        np.where(ratecode == 99, 6, 7)).astype(np.int64)
+        touches_jfk = (_numpy(table, 'PULocationID')[keep] == JFK_ZONE) | \
+            (_numpy(table, 'DOLocationID')[keep] == JFK_ZONE)
+        return np.concatenate([
+            [keep.sum(), _numpy(table, 'trip_distance')[keep].sum(), touches_jfk.sum()],
+            np.bincount(slot, minlength=len(RATECODES)),
+        ]).astype(np.float64)
+
+    def empty(self):
+        return np.zeros(3 + len(RATECODES))
+
+    def finalize(self, partial):
+        index = ['trips', 'distance_sum', 'jfk_trips'] + [f'ratecode_{code}' for code in RATECODES]
+        return pd.Series(partial, index=index, name='value')
+
+
+class AirportStats(Aggregator):
+    """Pickups by hour and fare/distance sums for the airport zones"""
+
+    columns = ['tpep_pickup_datetime', 'PULocationID', 'fare_amount', 'trip_distance']
+
+    def __init__(self, airports=AIRPORTS):
+        self.airports = airports
+
+    def map(self, table, mask):
+        hours = _numpy(table, 'tpep_pickup_datetime').astype('datetime64[h]').astype(np.int64) % 24
+        pickup = _numpy(table, 'PULocationID')
+        fare = _numpy(table, 'fare_amount')
+        distance = _numpy(table, 'trip_distance')
+        rows = []
+        for zone in self.airports.values():
+            at = mask & (pickup == zone)
+            rows.append(np.concatenate([np.bincount(hours[at], minlength=24).astype(np.float64),
+                                        [fare[at].sum(), distance[at].sum()]]))
+        return np.array(rows)
+
+    def empty(self):
+        return np.zeros((len(self.airports), 26))
+
+    def finalize(self, partial):
+        columns = [f'h{hour:02d}' for hour in range(24)] + ['fare_sum', 'distance_sum']
+        return pd.DataFrame(partial, index=pd.Index(list(self.airports), name='airport'), columns=columns)
+
+
+class PassengerTipTotals(TipSums):
+    """TipSums kept as plain totals, so partial results from several files add up"""
+
+    def finalize(self, partial):
+        counts, tips, fares, zero = partial
+        frame = pd.DataFrame({'card_trips': counts, 'tip_sum': tips, 'fare_sum': fares, 'zero_tips': zero})
+        return frame.rename_axis('passenger_count')
+
+
+def compute_file_aggregates(path, n_workers=None):
+    """One map-reduce pass over a trip file: {aggregate name: small additive table}"""
+    executor = MapReduceExecutor(n_workers=n_workers)
+    (cleaning, hourly, fares, spike, airports, od, tips), _ = executor.run(
+        path, [CleaningCounts(), HourlyFares(), FareHistogram(FARE_EDGES), SpikeProfile(), AirportStats(),
+               ODCounts(), PassengerTipTotals()]
+    )
+    fares.index = pd.Index(FARE_EDGES[:-1], name='fare_bin')  # Left edges; intervals do not store well
+    od = od.stack().rename('trips')
+    return {
+        'report_cleaning': cleaning,
+        'report_hourly': hourly,
+        'report_fares': fares,
+        'report_spike': spike,
+        'report_airports': airports,
+        'report_od': od[od > 0],
+        'report_tips': tips,
+    }
+
+
+def aggregate_version():
+    """Code version of everything that shapes the stored aggregates"""
+    return code_version(compute_file_aggregates, CleaningCounts, HourlyFares, SpikeProfile, AirportStats,
+                        PassengerTipTotals, rowgroup_mapreduce.__file__)
+
+
+def load_aggregates(paths, cache=None, refresh=False, n_workers=None):
+    """
+    Aggregates of all files combined, from the result cache where possible.
+    Returns (aggregates, names of the files that had to be scanned).
+    """
+    cache = cache or ResultCache()
+    version = aggregate_version()
+    combined, scanned = {}, []
+    for path in paths:
+        fingerprint = dataset_fingerprint(path)
+
+        def compute(path=path):
+            scanned.append(path)
+            return compute_file_aggregates(path, n_workers)
+
+        if refresh:
+            computed = compute()
+            for name in AGGREGATE_NAMES:
+                cache.put(name, {}, fingerprint, version, computed[name])
+            values = computed
+        else:
+            values = cache.get_or_compute_many(AGGREGATE_NAMES, compute, fingerprint=fingerprint, version=version)
+        for name, value in values.items():
+            combined[name] = value if name not in combined else combined[name].add(value, fill_value=0)
+    return combined, scanned
+
+
+# ----------------------------------------------------------------------
+# Report content: a list of blocks, rendered to Markdown or HTML
+# ----------------------------------------------------------------------
+def _number(value, decimals=0):
+    return f"{value:,.{decimals}f}"
+
+
+def _percent(part, whole, decimals=1):
+    return f"{part / whole * 100:.{decimals}f}%" if whole else "n/a"
+
+
+def _save_figure(fig, name, figure_dir):
+    path = os.path.join(figure_dir, name)
+    fig.savefig(path, dpi=150, bbox_inches='tight')
+    return path
+
+
+def build_report(aggregates, zones, sources, figure_dir=FIGURE_DIR):
+    """Report blocks: ('heading', level, text), ('text', text), ('list', items),
+    ('table', DataFrame of strings) and ('figure', path, caption)"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    os.makedirs(figure_dir, exist_ok=True)
+    cleaning = aggregates['report_cleaning']
+    hourly = aggregates['report_hourly']
+    fares = aggregates['report_fares']
+    spike = aggregates['report_spike']
+    airports = aggregates['report_airports']
+    od = aggregates['report_od']
+    tips = aggregates['report_tips']
+    raw, kept = cleaning['raw_rows'], cleaning['kept']
+
+    blocks = [
+        ('heading', 1, "NYC Taxi Analysis Report"),
+        ('text', f"Sources: {', '.join(os.path.basename(path) for path in sources)}. "
+                 f"Generated {time.strftime('%Y-%m-%d %H:%M')} from cached aggregates."),
+    ]
+
+    # 1. Data quality
+    rules = pd.DataFrame({
+        'Rule': ['Fare amount >= $0', 'Trip distance > 0', 'Trip distance <= 100 miles', 'Passenger count 1-6'],
+        'Records failing': [_number(cleaning[label]) for label in
+                            ['negative_fare', 'zero_distance', 'over_100_miles', 'invalid_passengers']],
+        'Share of raw': [_percent(cleaning[label], raw) for label in
+                         ['negative_fare', 'zero_distance', 'over_100_miles', 'invalid_passengers']],
+    })
+    blocks += [
+        ('heading', 2, "1. Data Quality"),
+        ('list', [f"Raw records: {_number(raw)}",
+                  f"After cleaning: {_number(kept)}",
+                  f"Removed: {_number(raw - kept)} ({_percent(raw - kept, raw, 2)})"]),
+        ('table', rules),
+        ('text', "A record can fail several rules, so the failures add up to more than the removed rows."),
+    ]
+
+    # 2. The fare spike
+    spike_bin = np.floor(SPIKE_FARE)
+    neighbours = fares.loc[spike_bin - 10:spike_bin + 10].drop(spike_bin)
+    fig, ax = plt.subplots(figsize=(12, 5))
+    colors = np.where(fares.index == spike_bin, 'crimson', 'steelblue')
+    ax.bar(fares.index, fares.to_numpy(), width=1.0, align='edge', color=colors)
+    ax.set_xlabel('Fare amount ($)')
+    ax.set_ylabel('Trips')
+    ax.set_title('Fare distribution (clean trips, $1 bins)')
+    blocks += [
+        ('heading', 2, f"2. Fare Analysis - The ${SPIKE_FARE:.0f} Spike"),
+        ('list', [f"Trips with fares of ${SPIKE_FARE - 0.5:.2f}-${SPIKE_FARE + 0.5:.2f}: {_number(spike['trips'])} "
+                  f"(the ${spike_bin:.0f} bin holds {fares.loc[spike_bin] / max(neighbours.median(), 1):.0f}x "
+                  f"the median of its neighbouring $1 bins)",
+                  f"RatecodeID 2 (JFK flat fare): {_percent(spike['ratecode_2'], spike['trips'])}",
+                  f"Pickup or dropoff at JFK: {_percent(spike['jfk_trips'], spike['trips'])}",
+                  f"Average distance: {spike['distance_sum'] / max(spike['trips'], 1):.1f} miles"]),
+        ('figure', _save_figure(fig, 'report_fare_distribution.png', figure_dir), "Fare distribution"),
+    ]
+    plt.close(fig)
+
+    # 3. Temporal patterns
+    trips_by_hour = hourly['trips']
+    mean_fare = hourly['fare_sum'] / trips_by_hour.where(trips_by_hour > 0)
+    peaks = trips_by_hour.nlargest(3).index
+    table = pd.DataFrame({
+        'Hour': [f"{hour:02d}:00" for hour in hourly.index],
+        'Trips': [_number(v) for v in trips_by_hour],
+        'Share': [_percent(v, trips_by_hour.sum()) for v in trips_by_hour],
+        'Mean fare': [f"${v:.2f}" for v in mean_fare],
+    })
+    fig, ax = plt.subplots(figsize=(12, 5))
+    ax.bar(hourly.index, trips_by_hour.to_numpy(), color='steelblue')
+    ax.set_xlabel('Pickup hour')
+    ax.set_ylabel('Trips')
+    ax.set_xticks(range(24))
+    fare_ax = ax.twinx()
+    fare_ax.plot(hourly.index, mean_fare.to_numpy(), color='darkorange', marker='o')
+    fare_ax.set_ylabel('Mean fare ($)', color='darkorange')
+    fare_ax.set_ylim(0, mean_fare.max() * 1.3)
+    ax.set_title('Trips and mean fare by pickup hour')
+    blocks += [
+        ('heading', 2, "3. Temporal Patterns"),
+        ('list', [f"Busiest hours: {', '.join(f'{hour:02d}:00' for hour in peaks)}",
+                  f"Quietest hour: {trips_by_hour.idxmin():02d}:00",
+                  f"Mean fare ranges from ${mean_fare.min():.2f} to ${mean_fare.max():.2f} across the day"]),
+        ('figure', _save_figure(fig, 'report_hourly_distribution.png', figure_dir), "Hourly distribution"),
+        ('table', table),
+    ]
+    plt.close(fig)
+
+    # 4. Airports
+    hour_columns = [f'h{hour:02d}' for hour in range(24)]
+    pickups = airports[hour_columns].sum(axis=1)
+    late = airports[[f'h{hour:02d}' for hour in LATE_NIGHT_HOURS]].sum(axis=1)
+    comparison = pd.DataFrame({
+        name: [_number(pickups[name]),
+               _percent(late[name], pickups[name]),
+               f"${airports.loc[name, 'fare_sum'] / max(pickups[name], 1):.2f}",
+               f"{airports.loc[name, 'distance_sum'] / max(pickups[name], 1):.1f} miles"]
+        for name in airports.index
+    }, index=['Pickups', 'Late-night pickups (10PM-5AM)', 'Average fare', 'Average distance'])
+    comparison = comparison.rename_axis('Metric').reset_index()
+    shares = airports[hour_columns].div(pickups.where(pickups > 0), axis=0) * 100
+    fig, ax = plt.subplots(figsize=(12, 5))
+    for name in shares.index:
+        ax.plot(range(24), shares.loc[name].to_numpy(), marker='o', label=name)
+    ax.set_xlabel('Pickup hour')
+    ax.set_ylabel('Share of pickups (%)')
+    ax.set_xticks(range(24))
+    ax.legend()
+    ax.set_title('Airport pickups by hour')
+    gap = (late / pickups.where(pickups > 0) * 100)
+    blocks += [
+        ('heading', 2, "4. Airport Analysis - JFK vs LaGuardia"),
+        ('table', comparison),
+        ('text', f"JFK's late-night share is {gap['JFK'] - gap['LaGuardia']:+.1f} percentage points "
+                 f"relative to LaGuardia."),
+        ('figure', _save_figure(fig, 'report_airport_hourly.png', figure_dir), "Airport pickups by hour"),
+    ]
+    plt.close(fig)
+
+    # 5. Top zones
+    names = zones['Zone']
+    top_pickups = od.groupby(level='PULocationID').sum().nlargest(10)
+    top_dropoffs = od.groupby(level='DOLocationID').sum().nlargest(10)
+    total = od.sum()
+    fig, ax = plt.subplots(figsize=(12, 6))
+    ax.barh(names.reindex(top_pickups.index).fillna('Unknown').to_numpy()[::-1], top_pickups.to_numpy()[::-1],
+            color='steelblue')
+    ax.set_xlabel('Pickups')
+    ax.set_title('Top 10 pickup zones')
+    blocks += [('heading', 2, "5. Geographic Patterns")]
+    for title, top in [("Top pickup zones", top_pickups), ("Top dropoff zones", top_dropoffs)]:
+        blocks += [
+            ('heading', 3, title),
+            ('table', pd.DataFrame({'Zone': names.reindex(top.index).fillna('Unknown').to_numpy(),
+                                    'Trips': [_number(v) for v in top],
+                                    'Share': [_percent(v, total) for v in top]})),
+        ]
+    blocks.append(('figure', _save_figure(fig, 'report_top_pickup_zones.png', figure_dir), "Top pickup zones"))
+    plt.close(fig)
+
+    # 6. Borough flows
+    boroughs = zones['Borough']
+    flows = od.groupby([boroughs.reindex(od.index.get_level_values('PULocationID')).fillna('Unknown').to_numpy(),
+                        boroughs.reindex(od.index.get_level_values('DOLocationID')).fillna('Unknown').to_numpy()]).sum()
+    routes = flows.nlargest(10)
+    queens_in = flows.get(('Queens', 'Manhattan'), 0)
+    queens_out = flows.get(('Manhattan', 'Queens'), 0)
+    from_borough = flows.groupby(level=0).sum()
+    blocks += [
+        ('heading', 2, "6. Inter-Borough Flows"),
+        ('list', [f"Queens -> Manhattan: {_number(queens_in)} trips",
+                  f"Manhattan -> Queens: {_number(queens_out)} trips",
+                  f"Ratio: {queens_in / max(queens_out, 1):.1f}:1",
+                  f"Manhattan share of pickups: {_percent(from_borough.get('Manhattan', 0), total)}"]),
+        ('table', pd.DataFrame({'Route': [f"{a} -> {b}" for a, b in routes.index],
+                                'Trips': [_number(v) for v in routes],
+                                'Share': [_percent(v, total) for v in routes]})),
+    ]
+
+    # 7. Tipping (credit-card trips, tips of 0-100% of the fare)
+    tips = tips[tips['card_trips'] > 0]
+    by_period = hourly.groupby(hourly.index // 6).sum()
+    blocks += [
+        ('heading', 2, "7. Tipping"),
+        ('text', "Credit-card trips only (cash tips are not recorded), tips between 0% and 100% of the fare."),
+        ('heading', 3, "By passenger count"),
+        ('table', pd.DataFrame({
+            'Passengers': tips.index.astype(int).astype(str),
+            'Trips': [_number(v) for v in tips['card_trips']],
+            'Average tip': [f"${v:.2f}" for v in tips['tip_sum'] / tips['card_trips']],
+            'Tips / fares': [_percent(t, f) for t, f in zip(tips['tip_sum'], tips['fare_sum'])],
+            'Zero tips': [_percent(z, n) for z, n in zip(tips['zero_tips'], tips['card_trips'])],
+        })),
+        ('heading', 3, "By time of day"),
+        ('table', pd.DataFrame({
+            'Period': [TIME_PERIODS[int(period)] for period in by_period.index],
+            'Trips': [_number(v) for v in by_period['card_trips']],
+            'Average tip': [f"${t / n:.2f}" if n else "n/a"
+                            for t, n in zip(by_period['card_tip_sum'], by_period['card_trips'])],
+            'Tips / fares': [_percent(t, f) for t, f in zip(by_period['card_tip_sum'], by_period['card_fare_sum'])],
+        })),
+    ]
+    return blocks
+
+
+def _relative(path, base):
+    return os.path.relpath(path, base).replace(os.sep, '/')
+
+
+def render_markdown(blocks, base_dir=REPORT_DIR):
+    """Blocks as GitHub-flavored Markdown"""
+    lines = []
+    for block in blocks:
+        kind = block[0]
+        if kind == 'heading':
+            lines += ['#' * block[1] + ' ' + block[2], '']
+        elif kind == 'text':
+            lines += [block[1], '']
+        elif kind == 'list':
+            lines += [f"- {item}" for item in block[1]] + ['']
+        elif kind == 'table':
+            frame = block[1]
+            lines.append('| ' + ' | '.join(map(str, frame.columns)) + ' |')
+            lines.append('|' + '|'.join('---' for _ in frame.columns) + '|')
+            lines += ['| ' + ' | '.join(map(str, row)) + ' |' for row in frame.itertuples(index=False)]
+            lines.append('')
+        elif kind == 'figure':
+            lines += [f"![{block[2]}]({_relative(block[1], base_dir)})", '']
+    return '\n'.join(lines)
+
+
+def render_html(blocks, base_dir=REPORT_DIR):
+    """Blocks as a standalone HTML page"""
+    title = next((block[2] for block in blocks if block[0] == 'heading'), "Report")
+    body = []
+    for block in blocks:
+        kind = block[0]
+        if kind == 'heading':
+            body.append(f"<h{block[1]}>{html.escape(block[2])}</h{block[1]}>")
+        elif kind == 'text':
+            body.append(f"<p>{html.escape(block[1])}</p>")
+        elif kind == 'list':
+            body.append('<ul>' + ''.join(f"<li>{html.escape(item)}</li>" for item in block[1]) + '</ul>')
+        elif kind == 'table':
+            body.append(block[1].to_html(index=False, border=0, classes='report'))
+        elif kind == 'figure':
+            body.append(f'<img src="{html.escape(_relative(block[1], base_dir))}" '
+                        f'alt="{html.escape(block[2])}">')
+    style = ("body{font-family:sans-serif;max-width:960px;margin:2em auto;color:#222}"
+             "table.report{border-collapse:collapse;margin:1em 0}"
+             "table.report th,table.report td{padding:4px 10px;border-bottom:1px solid #ddd;text-align:right}"
+             "img{max-width:100%}")
+    return (f"<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n<title>{html.escape(title)}</title>\n"
+            f"<style>{style}</style>\n</head>\n<body>\n" + '\n'.join(body) + "\n</body>\n</html>\n")
+
+
+def write_report(blocks, report_dir=REPORT_DIR, formats=('md', 'html')):
+    """Write report.md / report.html; returns the paths written"""
+    os.makedirs(report_dir, exist_ok=True)
+    renderers = {'md': render_markdown, 'html': render_html}
+    paths = []
+    for fmt in formats:
+        path = os.path.join(report_dir, f'report.{fmt}')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(renderers[fmt](blocks, report_dir))
+        paths.append(path)
+    return paths
+
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the analysis report from cached aggregates")
+    parser.add_argument('files', nargs='*', default=[DATA_FILE], help="Trip files to report on")
+    parser.add_argument('--refresh', action='store_true', help="Recompute the aggregates even if cached")
+    parser.add_argument('--format', choices=['md', 'html', 'both'], default='both')
+    parser.add_argument('--output-dir', default=REPORT_DIR)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for the aggregation pass")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("ANALYSIS REPORT")
+    print("=" * 70)
+
+    start = time.perf_counter()
+    cache = ResultCache()
+    aggregates, scanned = load_aggregates(args.files, cache, args.refresh, args.workers)
+    aggregation = time.perf_counter() - start
+    if scanned:
+        print(f"\nAggregated {', '.join(scanned)} in {aggregation:.2f}s")
+    else:
+        print(f"\nAll aggregates cached ({aggregation:.2f}s)")
+    size = sum(value.memory_usage(deep=True).sum() if isinstance(value, pd.DataFrame)
+               else value.memory_usage(deep=True) for value in aggregates.values())
+    print(f"Aggregate tables: {len(aggregates)}, {size / 1024:.0f} KB in memory")
+
+    start = time.perf_counter()
+    blocks = build_report(aggregates, load_zones(ZONES_FILE), args.files,
+                          os.path.join(args.output_dir, 'figures'))
+    formats = ['md', 'html'] if args.format == 'both' else [args.format]
+    paths = write_report(blocks, args.output_dir, formats)
+    print(f"Rendered {', '.join(paths)} in {time.perf_counter() - start:.2f}s")
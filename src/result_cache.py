@@ -0,0 +1,246 @@
+"""
+Persistent Analysis Result Cache
+
+Memoizes analysis outputs on disk so rerunning a script (or building the
+report) does not repeat the full pipeline. Each result is keyed by
+
+  - the dataset fingerprint (file size, mtime and Parquet footer stats),
+  - the analysis parameters, and
+  - a code version (hash of the function that computes the result),
+
+so only analyses whose inputs or logic changed are recomputed. Series and
+DataFrames are stored as small Parquet files, plain values as JSON. The
+cache is bounded in size and evicts the least recently used entries.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from taxi_data import DATA_DIR
+
+CACHE_DIR = os.path.join(DATA_DIR, 'cache', 'results')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+INDEX_FILE = 'index.json'
+
+
+def dataset_fingerprint(*paths):
+    """Stable fingerprint of one or more input files"""
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+        if path.endswith('.parquet'):
+            metadata = pq.ParquetFile(path).metadata
+            digest.update(f"|{metadata.num_rows}|{metadata.num_row_groups}".encode())
+    return digest.hexdigest()[:16]
+
+
+def code_version(*objects):
+    """Hash of the source code of functions/classes/modules (or file paths)"""
+    digest = hashlib.sha256()
+    for obj in objects:
+        if isinstance(obj, str) and os.path.exists(obj):
+            with open(obj, 'rb') as f:
+                digest.update(f.read())
+        else:
+            digest.update(inspect.getsource(obj).encode())
+    return digest.hexdigest()[:16]
+
+
+class ResultCache:
+    """Size-bounded LRU cache of analysis results on disk"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}  # A corrupt index only costs recomputation
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=1, default=str)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def make_key(name, params, fingerprint, version):
+        payload = json.dumps([name, params, fingerprint, version], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+    # ------------------------------------------------------------------
+    # Serialization
+    # ------------------------------------------------------------------
+    def _write(self, key, value):
+        """Store a value; returns (file name, kind)"""
+        base = os.path.join(self.cache_dir, key)
+        if isinstance(value, (pd.Series, pd.DataFrame)):
+            is_series = isinstance(value, pd.Series)
+            frame = value.to_frame(name=value.name if value.name is not None else 'value') \
+                if is_series else value
+            try:
+                frame.to_parquet(base + '.parquet')
+                return key + '.parquet', 'series' if is_series else 'frame'
+            except Exception:
+                # e.g. non-string column labels; keep it as a pickle instead
+                if os.path.exists(base + '.parquet'):
+                    os.remove(base + '.parquet')
+        else:
+            try:
+                payload = json.dumps(value)
+                with open(base + '.json', 'w') as f:
+                    f.write(payload)
+                return key + '.json', 'json'
+            except TypeError:
+                pass
+        with open(base + '.pkl', 'wb') as f:
+            pickle.dump(value, f)
+        return key + '.pkl', 'pickle'
+
+    def _read(self, entry):
+        path = os.path.join(self.cache_dir, entry['file'])
+        kind = entry['kind']
+        if kind == 'series':
+            frame = pd.read_parquet(path)
+            series = frame.iloc[:, 0]
+            return series.rename(None) if series.name == 'value' else series
+        if kind == 'frame':
+            return pd.read_parquet(path)
+        if kind == 'json':
+            with open(path) as f:
+                return json.load(f)
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def get(self, name, params, fingerprint, version, default=None):
+        """Cached value, or `default` on a miss"""
+        key = self.make_key(name, params, fingerprint, version)
+        entry = self.index.get(key)
+        if entry is None or not os.path.exists(os.path.join(self.cache_dir, entry['file'])):
+            return default
+        entry['last_access'] = time.time()
+        entry['hits'] = entry.get('hits', 0) + 1
+        self._save_index()
+        return self._read(entry)
+
+    def put(self, name, params, fingerprint, version, value):
+        """Store a value and evict least recently used entries if over budget"""
+        key = self.make_key(name, params, fingerprint, version)
+        file_name, kind = self._write(key, value)
+        self.index[key] = {
+            'name': name,
+            'params': params,
+            'fingerprint': fingerprint,
+            'version': version,
+            'file': file_name,
+            'kind': kind,
+            'bytes': os.path.getsize(os.path.join(self.cache_dir, file_name)),
+            'created': time.time(),
+            'last_access': time.time(),
+            'hits': 0,
+        }
+        self._evict()
+        self._save_index()
+        return value
+
+    def get_or_compute(self, name, compute, params=None, fingerprint='', version=''):
+        """Return the cached result or compute, store and return it"""
+        params = params or {}
+        missing = object()
+        value = self.get(name, params, fingerprint, version, default=missing)
+        if value is not missing:
+            return value
+        return self.put(name, params, fingerprint, version, compute())
+
+    def get_or_compute_many(self, names, compute, params=None, fingerprint='', version=''):
+        """
+        Like get_or_compute for an analysis that produces several named
+        results at once: `compute()` returns {name: value} and only runs
+        if any of them is missing.
+        """
+        params = params or {}
+        missing = object()
+        values = {name: self.get(name, params, fingerprint, version, default=missing) for name in names}
+        if all(value is not missing for value in values.values()):
+            return values
+        computed = compute()
+        for name in names:
+            self.put(name, params, fingerprint, version, computed[name])
+        return {name: computed[name] for name in names}
+
+    def latest(self, name, fingerprint=None):
+        """Most recently created entry for an analysis name (any parameters)"""
+        entries = [e for e in self.index.values()
+                   if e['name'] == name and (fingerprint is None or e['fingerprint'] == fingerprint)]
+        if not entries:
+            return None
+        entry = max(entries, key=lambda e: e['created'])
+        if not os.path.exists(os.path.join(self.cache_dir, entry['file'])):
+            return None
+        return self._read(entry)
+
+    def total_bytes(self):
+        return sum(entry['bytes'] for entry in self.index.values())
+
+    def _evict(self):
+        by_age = sorted(self.index.items(), key=lambda item: item[1]['last_access'])
+        total = self.total_bytes()
+        for key, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            path = os.path.join(self.cache_dir, entry['file'])
+            if os.path.exists(path):
+                os.remove(path)
+            total -= entry['bytes']
+            del self.index[key]
+
+    def clear(self):
+        for entry in self.index.values():
+            path = os.path.join(self.cache_dir, entry['file'])
+            if os.path.exists(path):
+                os.remove(path)
+        self.index = {}
+        self._save_index()
+
+    def summary(self):
+        """Cached entries as a DataFrame"""
+        if not self.index:
+            return pd.DataFrame(columns=['name', 'kind', 'bytes', 'hits'])
+        frame = pd.DataFrame.from_dict(self.index, orient='index')
+        return frame[['name', 'kind', 'bytes', 'hits', 'fingerprint', 'version']].sort_values('name')
+
+
+# Main execution
+if __name__ == "__main__":
+    cache = ResultCache()
+    print("=" * 70)
+    print("RESULT CACHE")
+    print("=" * 70)
+    print(f"\nLocation: {cache.cache_dir}")
+    print(f"Entries: {len(cache.index):,}")
+    print(f"Size: {cache.total_bytes() / 1024:.1f} KB of {cache.max_bytes / 1024**2:.0f} MB")
+    if cache.index:
+        print()
+        print(cache.summary().to_string())
@@ -0,0 +1,241 @@
+"""
+Row-Group Parallel Map-Reduce
+
+Single-pass aggregates (hourly counts, OD counts, tip sums, fare
+histograms) are independent per Parquet row group. The executor assigns
+row groups to a process pool; each worker reads only the columns its
+aggregators need, applies the standard cleaning rules, and returns small
+partial results (dense count/sum arrays) that the parent merges as they
+arrive. Throughput scales with the number of cores for multi-file inputs.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import multiprocessing
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+CLEAN_COLUMNS = ['fare_amount', 'trip_distance', 'passenger_count']
+N_LOCATIONS = 266
+
+
+def _numpy(table, name):
+    """Column as a NumPy array (nulls become NaN for numeric columns)"""
+    column = table.column(name)
+    if column.null_count and not str(column.type).startswith('timestamp'):
+        return column.to_numpy().astype(np.float64)
+    return column.to_numpy()
+
+
+def _clean_mask(table):
+    """Standard cleaning rules evaluated on an Arrow table"""
+    fare = _numpy(table, 'fare_amount')
+    distance = _numpy(table, 'trip_distance')
+    passengers = _numpy(table, 'passenger_count')
+    return (fare >= 0) & (distance > 0) & (distance <= 100) & (passengers > 0) & (passengers <= 6)
+
+
+class Aggregator(ABC):
+    """Base class: map a row group to a partial, merge partials, finalize"""
+
+    columns = []
+
+    @abstractmethod
+    def map(self, table, mask):
+        """Partial result for one row group (`mask` = rows passing the cleaning rules)"""
+
+    @abstractmethod
+    def empty(self):
+        """Partial result for no rows (used when there are no row groups)"""
+
+    def merge(self, a, b):
+        return a + b
+
+    def finalize(self, partial):
+        return partial
+
+
+class HourlyCounts(Aggregator):
+    """Trips by pickup hour"""
+
+    def __init__(self, time_column='tpep_pickup_datetime'):
+        self.time_column = time_column
+        self.columns = [time_column]
+
+    def map(self, table, mask):
+        times = _numpy(table, self.time_column)[mask]
+        hours = times.astype('datetime64[h]').astype(np.int64) % 24
+        return np.bincount(hours, minlength=24)
+
+    def empty(self):
+        return np.zeros(24, dtype=np.int64)
+
+    def finalize(self, partial):
+        return pd.Series(partial, index=pd.RangeIndex(24, name='pickup_hour'), name='trips')
+
+
+class ODCounts(Aggregator):
+    """Dense pickup × dropoff zone trip counts"""
+
+    columns = ['PULocationID', 'DOLocationID']
+
+    def __init__(self, n_locations=N_LOCATIONS):
+        self.n_locations = n_locations
+
+    def map(self, table, mask):
+        pu = _numpy(table, 'PULocationID')[mask].astype(np.int64)
+        do = _numpy(table, 'DOLocationID')[mask].astype(np.int64)
+        keys = pu * self.n_locations + do
+        return np.bincount(keys, minlength=self.n_locations ** 2)[:self.n_locations ** 2]
+
+    def empty(self):
+        return np.zeros(self.n_locations ** 2, dtype=np.int64)
+
+    def finalize(self, partial):
+        matrix = partial.reshape(self.n_locations, self.n_locations)
+        return pd.DataFrame(matrix).rename_axis(index='PULocationID', columns='DOLocationID')
+
+
+class TipSums(Aggregator):
+    """Credit-card tip totals and counts by passenger count"""
+
+    columns = ['payment_type', 'tip_amount', 'fare_amount', 'passenger_count']
+    max_passengers = 6
+
+    def map(self, table, mask):
+        payment = _numpy(table, 'payment_type')
+        tip = _numpy(table, 'tip_amount')
+        fare = _numpy(table, 'fare_amount')
+        passengers = np.nan_to_num(_numpy(table, 'passenger_count')).astype(np.int64)
+        keep = mask & (payment == 1) & (fare > 0) & (tip >= 0) & (tip <= fare)
+        size = self.max_passengers + 1
+        return np.stack([
+            np.bincount(passengers[keep], minlength=size)[:size].astype(np.float64),
+            np.bincount(passengers[keep], weights=tip[keep], minlength=size)[:size],
+            np.bincount(passengers[keep], weights=fare[keep], minlength=size)[:size],
+            np.bincount(passengers[keep], weights=(tip[keep] == 0), minlength=size)[:size],
+        ])
+
+    def empty(self):
+        return np.zeros((4, self.max_passengers + 1))
+
+    def finalize(self, partial):
+        counts, tips, fares, zero = partial
+        frame = pd.DataFrame({
+            'trips': counts.astype(np.int64),
+            'tip_sum': tips,
+            'avg_tip': tips / np.where(counts > 0, counts, np.nan),
+            'tip_pct_of_fares': tips / np.where(fares > 0, fares, np.nan) * 100,
+            'zero_tip_pct': zero / np.where(counts > 0, counts, np.nan) * 100,
+        }).rename_axis('passenger_count')
+        return frame[frame['trips'] > 0]
+
+
+class FareHistogram(Aggregator):
+    """Histogram of fare amounts over fixed bin edges"""
+
+    columns = ['fare_amount']
+
+    def __init__(self, edges=None):
+        self.edges = np.arange(0, 102, 2.0) if edges is None else np.asarray(edges, dtype=np.float64)
+
+    def map(self, table, mask):
+        return np.histogram(_numpy(table, 'fare_amount')[mask], bins=self.edges)[0]
+
+    def empty(self):
+        return np.zeros(len(self.edges) - 1, dtype=np.int64)
+
+    def finalize(self, partial):
+        # np.histogram bins are [a, b) except the last one, which includes the top edge
+        left, right = self.edges[:-1], self.edges[1:]
+        intervals = [pd.Interval(a, b, closed='both' if i == len(left) - 1 else 'left')
+                     for i, (a, b) in enumerate(zip(left, right))]
+        return pd.Series(partial, index=pd.Index(intervals, name='fare_bin'), name='trips')
+
+
+def _map_row_group(task):
+    """Worker: read one row group's projected columns and map every aggregator"""
+    path, index, aggregators, clean = task
+    columns = sorted(set(c for agg in aggregators for c in agg.columns) |
+                     (set(CLEAN_COLUMNS) if clean else set()))
+    table = pq.ParquetFile(path).read_row_group(index, columns=columns)
+    mask = _clean_mask(table) if clean else np.ones(table.num_rows, dtype=bool)
+    return [agg.map(table, mask) for agg in aggregators], int(mask.sum())
+
+
+class MapReduceExecutor:
+    """Distribute row groups over worker processes and merge the partials"""
+
+    def __init__(self, n_workers=None):
+        self.can_fork = 'fork' in multiprocessing.get_all_start_methods()
+        if n_workers is None:
+            n_workers = os.cpu_count() if self.can_fork else 1
+        self.n_workers = max(1, n_workers)
+
+    def run(self, paths, aggregators, clean=True):
+        """Aggregate every row group of `paths`; returns (results, rows used)"""
+        if isinstance(paths, str):
+            paths = [paths]
+        tasks = [(path, index, aggregators, clean)
+                 for path in paths for index in range(pq.ParquetFile(path).num_row_groups)]
+
+        # Start from empty partials so no paths / no row groups give empty results
+        partials, rows = [agg.empty() for agg in aggregators], 0
+
+        def reduce(result):
+            nonlocal partials, rows
+            values, n = result
+            rows += n
+            partials = [agg.merge(a, b) for agg, a, b in zip(aggregators, partials, values)]
+
+        if self.n_workers == 1 or len(tasks) == 1:
+            for task in tasks:
+                reduce(_map_row_group(task))
+        else:
+            context = multiprocessing.get_context('fork' if self.can_fork else None)
+            with ProcessPoolExecutor(max_workers=self.n_workers, mp_context=context) as pool:
+                for future in as_completed(pool.submit(_map_row_group, task) for task in tasks):
+                    reduce(future.result())
+
+        return [agg.finalize(p) for agg, p in zip(aggregators, partials)], rows
+
+
+# Main execution
+if __name__ == "__main__":
+    import time
+    from taxi_data import DATA_FILE, load_clean_trips
+
+    print("=" * 70)
+    print("ROW-GROUP MAP-REDUCE")
+    print("=" * 70)
+    print(f"\n{DATA_FILE}: {pq.ParquetFile(DATA_FILE).num_row_groups} row groups")
+
+    start = time.perf_counter()
+    df = load_clean_trips(columns=['tpep_pickup_datetime', 'PULocationID', 'DOLocationID', 'fare_amount'])
+    expected_hourly = df['tpep_pickup_datetime'].dt.hour.value_counts().sort_index()
+    expected_od = df.groupby(['PULocationID', 'DOLocationID']).size()
+    expected_hist = np.histogram(df['fare_amount'], bins=np.arange(0, 102, 2.0))[0]
+    baseline = time.perf_counter() - start
+    print(f"\npandas read_parquet + groupby: {baseline:.2f}s")
+
+    for workers in sorted({1, os.cpu_count() or 1}):
+        executor = MapReduceExecutor(n_workers=workers)
+        start = time.perf_counter()
+        (hourly, od, tips, hist), rows = executor.run(
+            DATA_FILE, [HourlyCounts(), ODCounts(), TipSums(), FareHistogram()]
+        )
+        elapsed = time.perf_counter() - start
+        print(f"Map-reduce with {workers} worker(s): {elapsed:.2f}s ({baseline / elapsed:.1f}x), {rows:,} rows")
+
+    od_long = od.stack()
+    print(f"\nHourly counts match: {(hourly.values == expected_hourly.values).all()}")
+    print(f"OD counts match: {(od_long[od_long > 0] == expected_od).all()}")
+    print(f"Fare histogram matches: {(hist.values == expected_hist).all()}")
+    print("\nTipping by passenger count:")
+    print(tips.round(2))
@@ -0,0 +1,177 @@
+"""
+Schema-Evolution-Aware Multi-Year Reader
+
+TLC files from different years disagree on column spelling
+(`airport_fee` vs `Airport_fee`), on which columns exist
+(`congestion_surcharge` appears mid-series) and on types (int vs double
+`passenger_count`, ns vs us timestamps). This reader resolves one unified
+schema for a whole file set from the Parquet footers alone, then streams
+the files batch by batch, casting only the columns whose type differs
+in that file and filling columns the file lacks with nulls.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import glob
+import os
+import sys
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from taxi_data import DATA_DIR
+
+TIMESTAMP_UNIT = 'us'
+
+
+def _unify_types(a, b, timestamp_unit=TIMESTAMP_UNIT):
+    """Smallest common type that holds values of both types"""
+    if a == b:
+        return a
+    if pa.types.is_null(a):
+        return b
+    if pa.types.is_null(b):
+        return a
+    if pa.types.is_timestamp(a) and pa.types.is_timestamp(b):
+        return pa.timestamp(timestamp_unit, tz=a.tz or b.tz)
+    if pa.types.is_integer(a) and pa.types.is_integer(b):
+        width = max(a.bit_width, b.bit_width)
+        signed = pa.types.is_signed_integer(a) or pa.types.is_signed_integer(b)
+        if signed and not (pa.types.is_signed_integer(a) and pa.types.is_signed_integer(b)):
+            width = min(64, width * 2)
+        return getattr(pa, f"int{width}")() if signed else getattr(pa, f"uint{width}")()
+    if (pa.types.is_integer(a) or pa.types.is_floating(a)) and \
+            (pa.types.is_integer(b) or pa.types.is_floating(b)):
+        return pa.float64()
+    if (pa.types.is_string(a) or pa.types.is_large_string(a)) and \
+            (pa.types.is_string(b) or pa.types.is_large_string(b)):
+        return pa.large_string()
+    raise TypeError(f"Cannot unify column types {a} and {b}")
+
+
+class UnifiedSchema:
+    """Unified schema for a file set plus the per-file read plans"""
+
+    def __init__(self, paths, aliases=None, timestamp_unit=TIMESTAMP_UNIT):
+        self.paths = list(paths)
+        self.aliases = {k.lower(): v for k, v in (aliases or {}).items()}
+        self.file_schemas = {path: pq.read_schema(path) for path in self.paths}
+
+        # Name resolution is case-insensitive; the latest file's spelling wins
+        spelling, types, order = {}, {}, []
+        for path in self.paths:
+            for field in self.file_schemas[path]:
+                key = self._key(field.name)
+                if key not in types:
+                    order.append(key)
+                    types[key] = field.type
+                else:
+                    types[key] = _unify_types(types[key], field.type, timestamp_unit)
+                spelling[key] = self.aliases.get(key, field.name)
+        # Normalize any remaining timestamp units, even if every file agrees
+        for key, dtype in types.items():
+            if pa.types.is_timestamp(dtype) and dtype.unit != timestamp_unit:
+                types[key] = pa.timestamp(timestamp_unit, tz=dtype.tz)
+
+        self.schema = pa.schema([pa.field(spelling[key], types[key]) for key in order])
+        self.plans = {path: self._plan(path) for path in self.paths}
+
+    def _key(self, name):
+        return self.aliases.get(name.lower(), name).lower()
+
+    def _plan(self, path):
+        """For each unified column: source column name (or None) and whether it needs a cast"""
+        source = {self._key(field.name): field for field in self.file_schemas[path]}
+        plan = []
+        for field in self.schema:
+            match = source.get(self._key(field.name))
+            if match is None:
+                plan.append((field, None, False))
+            else:
+                plan.append((field, match.name, match.type != field.type))
+        return plan
+
+    def differences(self):
+        """Per-file list of renamed, cast and missing columns"""
+        report = {}
+        for path, plan in self.plans.items():
+            changes = []
+            for field, source_name, needs_cast in plan:
+                if source_name is None:
+                    changes.append(f"missing {field.name} (filled with nulls)")
+                    continue
+                if source_name != field.name:
+                    changes.append(f"rename {source_name} → {field.name}")
+                if needs_cast:
+                    source_type = self.file_schemas[path].field(source_name).type
+                    changes.append(f"cast {field.name}: {source_type} → {field.type}")
+            report[path] = changes
+        return report
+
+    def _project(self, columns):
+        if columns is None:
+            return list(self.schema.names)
+        lookup = {self._key(name): name for name in self.schema.names}
+        missing = [c for c in columns if self._key(c) not in lookup]
+        if missing:
+            raise KeyError(f"Columns not found in any file: {missing}")
+        return [lookup[self._key(c)] for c in columns]
+
+    def iter_batches(self, columns=None, batch_size=256_000):
+        """Stream every file as RecordBatches in the unified schema"""
+        names = self._project(columns)
+        schema = pa.schema([self.schema.field(name) for name in names])
+        for path in self.paths:
+            plan = {field.name: (source, cast) for field, source, cast in self.plans[path]}
+            source_columns = [plan[name][0] for name in names if plan[name][0] is not None]
+            parquet_file = pq.ParquetFile(path)
+            for batch in parquet_file.iter_batches(batch_size=batch_size, columns=source_columns):
+                arrays = []
+                for field in schema:
+                    source, needs_cast = plan[field.name]
+                    if source is None:
+                        arrays.append(pa.nulls(batch.num_rows, type=field.type))
+                    elif needs_cast:
+                        # Timestamp unit changes truncate sub-unit precision
+                        arrays.append(pc.cast(batch.column(source), field.type,
+                                              safe=not pa.types.is_timestamp(field.type)))
+                    else:
+                        arrays.append(batch.column(source))  # Passed through untouched
+                yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def read(self, columns=None, batch_size=256_000):
+        """All files as one Arrow table in the unified schema"""
+        names = self._project(columns)
+        schema = pa.schema([self.schema.field(name) for name in names])
+        return pa.Table.from_batches(self.iter_batches(columns, batch_size), schema=schema)
+
+
+def resolve_unified_schema(paths, aliases=None, timestamp_unit=TIMESTAMP_UNIT):
+    """Unified schema for a set of Parquet files (reads footers only)"""
+    return UnifiedSchema(sorted(paths), aliases, timestamp_unit)
+
+
+# Main execution
+if __name__ == "__main__":
+    pattern = sys.argv[1] if len(sys.argv) > 1 else os.path.join(DATA_DIR, 'yellow_tripdata_*.parquet')
+    paths = [p for p in glob.glob(pattern) if not p.endswith(('.clean.parquet', '.features.parquet'))]
+    if not paths:
+        sys.exit(f"No files match {pattern}")
+
+    print("=" * 70)
+    print("UNIFIED SCHEMA ACROSS FILES")
+    print("=" * 70)
+
+    unified = resolve_unified_schema(paths)
+    print(f"\n{len(paths)} file(s)")
+    print(unified.schema)
+
+    print("\n" + "=" * 70)
+    print("PER-FILE ADJUSTMENTS")
+    print("=" * 70)
+    for path, changes in unified.differences().items():
+        print(f"\n{os.path.basename(path)}:")
+        for change in changes or ['(matches unified schema)']:
+            print(f"  {change}")
@@ -0,0 +1,290 @@
+"""
+Out-of-Core Group-By
+
+Hash-partitioned aggregation for group-bys whose intermediate state does
+not fit in memory (e.g. zone pair x day x hour over several years).
+Chunks are reduced as they arrive; once the buffered state exceeds the
+memory budget it is hash-partitioned on the group keys and spilled to
+Arrow files on disk. Each partition is then aggregated independently,
+so only one partition has to be in memory at a time.
+
+Supports count, sum, mean, var, std and exact median. Without medians
+only mergeable partials (count, sum, mean, M2) are kept per group; with
+medians the raw projected values are spilled instead.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from grouped_quantile import group_codes, exact_quantiles
+
+SUPPORTED_FUNCS = ('count', 'sum', 'mean', 'var', 'std', 'median')
+
+
+def _normalize_aggs(aggs):
+    """Turn a pandas-style {column: func or [funcs]} spec into lists"""
+    normalized = {}
+    flat = True
+    for column, funcs in aggs.items():
+        if isinstance(funcs, str):
+            funcs = [funcs]
+        else:
+            flat = False
+        for func in funcs:
+            if func not in SUPPORTED_FUNCS:
+                raise ValueError(f"Unsupported aggregation '{func}' (supported: {SUPPORTED_FUNCS})")
+        normalized[column] = list(funcs)
+    return normalized, flat
+
+
+class SpillGroupBy:
+    """Group-by aggregation that spills hash partitions to disk"""
+
+    def __init__(self, keys, aggs, memory_budget_mb=512, n_partitions=32, spill_dir=None):
+        self.keys = [keys] if isinstance(keys, str) else list(keys)
+        self.aggs, self.flat = _normalize_aggs(aggs)
+        self.value_columns = list(self.aggs)
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.n_partitions = n_partitions
+        self.raw_mode = any('median' in funcs for funcs in self.aggs.values())
+
+        self.spill_dir = spill_dir
+        self._own_spill_dir = spill_dir is None
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.spill_files = {p: [] for p in range(n_partitions)}
+        self.spill_count = 0
+        self.rows_seen = 0
+
+    # ------------------------------------------------------------------
+    # Ingest
+    # ------------------------------------------------------------------
+    def add(self, chunk):
+        """Consume one chunk of rows"""
+        chunk = chunk[self.keys + self.value_columns]
+        self.rows_seen += len(chunk)
+        if not self.raw_mode:
+            chunk = self._partials(chunk)
+        self.buffer.append(chunk)
+        self.buffer_bytes += int(chunk.memory_usage(index=False, deep=True).sum())
+
+        if self.buffer_bytes > self.memory_budget:
+            state = pd.concat(self.buffer, ignore_index=True)
+            if not self.raw_mode:
+                state = self._combine(state)
+            # Re-aggregation may have shrunk the state enough to keep it
+            state_bytes = int(state.memory_usage(index=False, deep=True).sum())
+            if state_bytes > self.memory_budget // 2:
+                self._spill(state)
+                self.buffer, self.buffer_bytes = [], 0
+            else:
+                self.buffer, self.buffer_bytes = [state], state_bytes
+        return self
+
+    def _partials(self, chunk):
+        """Reduce a chunk to mergeable per-group partial aggregates"""
+        grouped = chunk.groupby(self.keys, observed=True, sort=False)
+        parts = {}
+        for column in self.value_columns:
+            stats = grouped[column].agg(['count', 'sum', 'mean', 'var'])
+            parts[(column, 'n')] = stats['count']
+            parts[(column, 'sum')] = stats['sum']
+            parts[(column, 'mean')] = stats['mean']
+            parts[(column, 'm2')] = (stats['var'] * (stats['count'] - 1)).fillna(0.0)
+        partials = pd.DataFrame(parts)
+        partials.columns = [f"{c}__{s}" for c, s in partials.columns]
+        return partials.reset_index()
+
+    def _combine(self, partials):
+        """Merge partial aggregates that share the same group keys"""
+        grouped = partials.groupby(self.keys, observed=True, sort=False)
+        combined = {}
+        for column in self.value_columns:
+            n_col, sum_col = f"{column}__n", f"{column}__sum"
+            mean_col, m2_col = f"{column}__mean", f"{column}__m2"
+            n = grouped[n_col].transform('sum')
+            weighted = (partials[mean_col] * partials[n_col]).fillna(0.0)
+            mean = weighted.groupby([partials[k] for k in self.keys], observed=True, sort=False).transform('sum') / n
+            # Chan et al. parallel variance update
+            spread = partials[n_col] * (partials[mean_col] - mean) ** 2
+            contribution = partials[m2_col] + spread.fillna(0.0)
+            combined[n_col] = partials[n_col]
+            combined[sum_col] = partials[sum_col]
+            combined[m2_col] = contribution
+        frame = pd.DataFrame(combined)
+        for key in self.keys:
+            frame[key] = partials[key]
+        result = frame.groupby(self.keys, observed=True, sort=False).sum()
+        for column in self.value_columns:
+            n = result[f"{column}__n"]
+            result[f"{column}__mean"] = result[f"{column}__sum"] / n.where(n > 0)
+        return result.reset_index()
+
+    def _spill(self, state):
+        """Hash-partition the state on the group keys and write it to disk"""
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='spill_groupby_')
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        hashes = pd.util.hash_pandas_object(state[self.keys], index=False).to_numpy()
+        partition_ids = (hashes % np.uint64(self.n_partitions)).astype(np.int64)
+        order = np.argsort(partition_ids, kind='stable')
+        bounds = np.searchsorted(partition_ids[order], np.arange(self.n_partitions + 1))
+
+        for p in range(self.n_partitions):
+            rows = order[bounds[p]:bounds[p + 1]]
+            if len(rows) == 0:
+                continue
+            path = os.path.join(self.spill_dir, f"part-{p:04d}-{self.spill_count:06d}.arrow")
+            state.iloc[rows].reset_index(drop=True).to_feather(path)
+            self.spill_files[p].append(path)
+        self.spill_count += 1
+
+    # ------------------------------------------------------------------
+    # Finalize
+    # ------------------------------------------------------------------
+    def _finalize(self, state):
+        """Compute the requested aggregations for one in-memory partition"""
+        if self.raw_mode:
+            return self._finalize_raw(state)
+
+        state = self._combine(state).set_index(self.keys)
+        out = {}
+        for column, funcs in self.aggs.items():
+            n = state[f"{column}__n"]
+            var = state[f"{column}__m2"] / (n - 1).where(n > 1)
+            values = {
+                'count': n.astype(np.int64),
+                'sum': state[f"{column}__sum"],
+                'mean': state[f"{column}__mean"],
+                'var': var,
+                'std': np.sqrt(var),
+            }
+            for func in funcs:
+                out[(column, func)] = values[func]
+        result = pd.DataFrame(out)
+        result.columns = pd.MultiIndex.from_tuples(result.columns)
+        return result
+
+    def _finalize_raw(self, state):
+        """Aggregate raw rows; medians come from the grouped quantile engine"""
+        grouped = state.groupby(self.keys, observed=True)
+        codes, index = group_codes(state, self.keys)
+        out = {}
+        for column, funcs in self.aggs.items():
+            for func in funcs:
+                if func == 'median':
+                    values = state[column].to_numpy(dtype=np.float64, na_value=np.nan)
+                    medians, _ = exact_quantiles(codes, values, 0.5, n_groups=len(index))
+                    out[(column, func)] = medians[:, 0]
+                else:
+                    out[(column, func)] = grouped[column].agg(func).to_numpy()
+        result = pd.DataFrame(out, index=index)
+        result.columns = pd.MultiIndex.from_tuples(result.columns)
+        return result
+
+    def result(self):
+        """Aggregate every partition and return a pandas-style result"""
+        if self.spill_count == 0:
+            state = pd.concat(self.buffer, ignore_index=True) if self.buffer else None
+            result = self._finalize(state) if state is not None else pd.DataFrame()
+        else:
+            if self.buffer:
+                self._spill(pd.concat(self.buffer, ignore_index=True))
+                self.buffer, self.buffer_bytes = [], 0
+            pieces = []
+            for p in range(self.n_partitions):
+                if not self.spill_files[p]:
+                    continue
+                state = pd.concat([pd.read_feather(path) for path in self.spill_files[p]],
+                                  ignore_index=True)
+                pieces.append(self._finalize(state))
+            result = pd.concat(pieces)
+
+        if len(result):
+            result = result.sort_index()
+        if self.flat:
+            result.columns = [column for column, _ in result.columns]
+        return result
+
+    def close(self):
+        """Remove spill files created by this operator"""
+        if self.spill_dir and self._own_spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+        self.spill_files = {p: [] for p in range(self.n_partitions)}
+
+
+def _chunks(df, n_chunks=16):
+    """Split a DataFrame into row slices for chunked aggregation"""
+    step = max(1, len(df) // n_chunks)
+    return (df.iloc[i:i + step] for i in range(0, len(df), step))
+
+
+def groupby_agg(data, keys, aggs, memory_budget_mb=512, n_partitions=32, spill_dir=None):
+    """
+    Drop-in replacement for `df.groupby(keys).agg(aggs)`.
+
+    `data` can be a DataFrame or an iterable of DataFrame chunks (e.g. one
+    per month). Small inputs go straight through pandas; anything larger
+    than the memory budget is aggregated out of core.
+    """
+    if isinstance(data, pd.DataFrame):
+        if data.memory_usage(index=False, deep=True).sum() <= memory_budget_mb * 1024 * 1024:
+            return data.groupby(keys).agg(aggs)
+        data = _chunks(data)
+
+    operator = SpillGroupBy(keys, aggs, memory_budget_mb, n_partitions, spill_dir)
+    try:
+        for chunk in data:
+            operator.add(chunk)
+        return operator.result()
+    finally:
+        operator.close()
+
+
+def groupby_size(data, keys, memory_budget_mb=512, n_partitions=32, spill_dir=None):
+    """Out-of-core equivalent of `df.groupby(keys).size()`"""
+    if isinstance(data, pd.DataFrame):
+        if data.memory_usage(index=False, deep=True).sum() <= memory_budget_mb * 1024 * 1024:
+            return data.groupby(keys).size()
+        data = _chunks(data)
+
+    key_list = [keys] if isinstance(keys, str) else list(keys)
+    counted = (chunk[key_list].assign(_one=1) for chunk in data)
+    result = groupby_agg(counted, key_list, {'_one': 'sum'}, memory_budget_mb, n_partitions, spill_dir)
+    return result['_one'].astype(np.int64).rename(None)
+
+
+# Main execution
+if __name__ == "__main__":
+    import time
+    from taxi_data import load_clean_trips
+
+    print("=" * 70)
+    print("OUT-OF-CORE GROUP-BY CHECK")
+    print("=" * 70)
+
+    df = load_clean_trips(columns=['tpep_pickup_datetime', 'PULocationID', 'DOLocationID',
+                                   'fare_amount', 'tip_amount'])
+    df['pickup_hour'] = df['tpep_pickup_datetime'].dt.hour
+    keys = ['PULocationID', 'DOLocationID', 'pickup_hour']
+    aggs = {'fare_amount': ['count', 'sum', 'mean', 'var', 'median'], 'tip_amount': ['mean']}
+
+    start = time.perf_counter()
+    expected = df.groupby(keys).agg(aggs)
+    print(f"\npandas groupby: {time.perf_counter() - start:.2f}s, {len(expected):,} groups")
+
+    start = time.perf_counter()
+    chunks = (df.iloc[i:i + 250_000] for i in range(0, len(df), 250_000))
+    result = groupby_agg(chunks, keys, aggs, memory_budget_mb=16)
+    print(f"Spilling groupby (16 MB budget): {time.perf_counter() - start:.2f}s, {len(result):,} groups")
+
+    diff = (result - expected).abs().max().max()
+    print(f"Max absolute difference vs pandas: {diff:.2e}")
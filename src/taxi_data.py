@@ -0,0 +1,133 @@
+"""
+Shared Trip Data Loading
+
+Central place for the data paths, the standard cleaning rules and the
+zone lookup that every analysis script repeats. Long-running tools
+(query service, feature store, caches) import from here so they all see
+the same cleaned trips.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import numpy as np
+import pandas as pd
+import os
+
+# Data locations (relative to the project root, like the scripts)
+DATA_DIR = 'data'
+DATA_FILE = os.path.join(DATA_DIR, 'yellow_tripdata_2024-01.parquet')
+ZONES_FILE = os.path.join(DATA_DIR, 'taxi_zone_lookup.csv')
+CLEAN_FILE = os.path.join(DATA_DIR, 'yellow_tripdata_2024-01.clean.parquet')
+
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+TIME_PERIODS = ['Late Night (12am-6am)', 'Morning (6am-12pm)',
+                'Afternoon (12pm-6pm)', 'Evening (6pm-12am)']
+
+
+def load_trips(data_file=DATA_FILE, columns=None, schema=None):
+    """Load raw trip records, optionally projecting a subset of columns
+    and converting them to a compact schema (see DataProfiler.compact_schema)"""
+    df = pd.read_parquet(data_file, columns=columns)
+    return schema.apply(df) if schema is not None else df
+
+
+def clean_mask(df):
+    """Boolean mask for the cleaning rules used throughout the project"""
+    return (
+        (df['fare_amount'] >= 0) &           # No negative fares
+        (df['trip_distance'] > 0) &          # Actual trips
+        (df['trip_distance'] <= 100) &       # Reasonable distance
+        (df['passenger_count'] > 0) &        # At least one passenger
+        (df['passenger_count'] <= 6)         # Reasonable passenger count
+    )
+
+
+def clean_trips(df):
+    """Apply the standard cleaning rules"""
+    return df[clean_mask(df)].reset_index(drop=True)
+
+
+def load_clean_trips(data_file=DATA_FILE, columns=None, schema=None):
+    """Load trips and apply the standard cleaning rules (then the compact schema, if given)"""
+    if columns is not None:
+        rule_columns = ['fare_amount', 'trip_distance', 'passenger_count']
+        load_columns = list(dict.fromkeys(list(columns) + rule_columns))
+        df = clean_trips(load_trips(data_file, load_columns))[list(columns)]
+    else:
+        df = clean_trips(load_trips(data_file))
+    return schema.apply(df) if schema is not None else df
+
+
+def write_clean_snapshot(data_file=DATA_FILE, snapshot_file=CLEAN_FILE):
+    """Clean the raw trips once and persist them as a Parquet snapshot"""
+    df = load_clean_trips(data_file)
+    df.to_parquet(snapshot_file, index=False)
+    return df
+
+
+def load_clean_snapshot(columns=None, snapshot_file=CLEAN_FILE, data_file=DATA_FILE):
+    """Load the cleaned snapshot, writing it first if it is missing or stale"""
+    if (not os.path.exists(snapshot_file) or
+            os.path.getmtime(snapshot_file) < os.path.getmtime(data_file)):
+        print(f"Writing cleaned snapshot {snapshot_file}...")
+        write_clean_snapshot(data_file, snapshot_file)
+    return pd.read_parquet(snapshot_file, columns=columns)
+
+
+def load_zones(zones_file=ZONES_FILE):
+    """Load the taxi zone lookup indexed by LocationID"""
+    return pd.read_csv(zones_file).set_index('LocationID')
+
+
+def make_synthetic_trips(n=200_000, seed=0, month='2024-01'):
+    """
+    Random trips with the yellow taxi schema, including the dirty records
+    the cleaning rules target (negative fares, zero/missing passengers,
+    zero distances, stray timestamps, dropoffs before pickups, $70 JFK
+    flat fares).
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64(f"{month}-01T00:00:00", 'us')
+    days = ((start.astype('datetime64[M]') + 1).astype('datetime64[D]') - start.astype('datetime64[D]')).astype(int)
+    pickup = start + (rng.random(n) * days * 86400e6).astype('timedelta64[us]')
+    stray = rng.random(n) < 0.0005
+    pickup[stray] -= np.timedelta64(365 * 5, 'D').astype('timedelta64[us]')
+    duration = (rng.gamma(2.0, 7.0, n) * 60e6).astype('timedelta64[us]')
+    duration[rng.random(n) < 0.001] *= -1
+
+    distance = np.round(rng.gamma(1.5, 2.0, n), 2)
+    distance[rng.random(n) < 0.01] = 0.0
+    ratecode = rng.choice([1, 2, 3, 4, 5, 99], n, p=[.9, .05, .01, .01, .02, .01]).astype(np.float64)
+    fare = np.where(ratecode == 2, 70.0, np.round(3 + 3.5 * distance + rng.gamma(1.0, 2.0, n), 2))
+    fare[rng.random(n) < 0.01] *= -1
+    payment = rng.choice([1, 2, 3, 4], n, p=[.75, .2, .03, .02])
+    tip = np.where(payment == 1, np.round(np.abs(fare) * rng.choice([0, .1, .15, .2, .25, .3], n), 2), 0.0)
+    passengers = rng.choice([0, 1, 2, 3, 4, 5, 6], n, p=[.02, .7, .14, .05, .03, .03, .03]).astype(np.float64)
+    passengers[rng.random(n) < 0.02] = np.nan
+    pickup_zone = np.where(rng.random(n) < 0.6, rng.choice([132, 138, 161, 236, 237, 230, 48, 79], n),
+                           rng.integers(1, 266, n))
+    pickup_zone[ratecode == 2] = 132
+    airport_fee = np.where(np.isin(pickup_zone, [132, 138]), 1.75, 0.0)
+
+    return pd.DataFrame({
+        'VendorID': rng.choice([1, 2], n).astype(np.int32),
+        'tpep_pickup_datetime': pickup,
+        'tpep_dropoff_datetime': pickup + duration,
+        'passenger_count': passengers,
+        'trip_distance': distance,
+        'RatecodeID': ratecode,
+        'store_and_fwd_flag': rng.choice(['N', 'Y'], n, p=[.99, .01]),
+        'PULocationID': pickup_zone.astype(np.int32),
+        'DOLocationID': rng.integers(1, 266, n).astype(np.int32),
+        'payment_type': payment.astype(np.int64),
+        'fare_amount': fare,
+        'extra': rng.choice([0, 1, 2.5], n),
+        'mta_tax': 0.5,
+        'tip_amount': tip,
+        'tolls_amount': np.where(rng.random(n) < 0.05, 6.94, 0.0),
+        'improvement_surcharge': 1.0,
+        'total_amount': np.round(fare + tip + 1.5 + airport_fee, 2),
+        'congestion_surcharge': 2.5,
+        'Airport_fee': airport_fee,
+    })
@@ -12,6 +12,10 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+from context_join import ContextJoiner, available_tables
 
 # Set style
 sns.set_style("whitegrid")
@@ -104,5 +108,18 @@ off_peak_hours = hourly_trips.nsmallest(5)
 print("\nTop 5 quietest hours:")
 print(off_peak_hours)
 
+# Context: holidays plus any weather/event tables in data/context
+print("\n5. HOURLY PATTERN IN CONTEXT")
+joiner = ContextJoiner(available_tables())
+context = joiner.decode(joiner.join(df_clean[['tpep_pickup_datetime', 'pickup_hour']]))
+holiday_share = pd.crosstab(context['pickup_hour'], context['holiday_is_holiday'].map({0: 'Regular day', 1: 'Holiday'}),
+                            normalize='columns') * 100
+print("Share of each day type's trips by hour (%):")
+print(holiday_share.round(2))
+for table in joiner.tables[1:]:
+    for column, categories in table.categories.items():
+        print(f"\nTrips by hour and {table.name} {column}:")
+        print(pd.crosstab(context['pickup_hour'], context[f"{table.name}_{column}"]))
+
 print("\n" + "=" * 70)
 print("✓ Time analysis complete! Check docs/figures/ for visualizations.")
\ No newline at end of file
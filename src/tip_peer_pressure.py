@@ -5,6 +5,12 @@ Hypothesis: Does peer pressure affect tipping behavior?
 
 import pandas as pd
 import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+from spill_groupby import groupby_agg, groupby_size
+from bootstrap_stats import BootstrapEngine, print_comparison
 
 # Load the data
 print("Loading taxi data...")
@@ -64,7 +70,7 @@ print("\n" + "="*60)
 print("TIPPING BEHAVIOR: SOLO VS GROUPS")
 print("="*60)
 
-summary = filtered_df.groupby('rider_type').agg({
+summary = groupby_agg(filtered_df, 'rider_type', {
     'tip_amount': ['count', 'mean', 'median'],
     'tip_percentage': ['mean', 'median', 'std'],
     'fare_amount': ['mean', 'median']
@@ -77,7 +83,7 @@ print("\n" + "="*60)
 print("TIPPING BEHAVIOR BY PASSENGER COUNT")
 print("="*60)
 
-detailed = filtered_df.groupby('passenger_count').agg({
+detailed = groupby_agg(filtered_df, 'passenger_count', {
     'tip_amount': ['count', 'mean', 'median'],
     'tip_percentage': ['mean', 'median'],
     'fare_amount': ['mean']
@@ -130,15 +136,25 @@ def categorize_tip(pct):
 
 filtered_df['tip_category'] = filtered_df['tip_percentage'].apply(categorize_tip)
 
-tip_cats = filtered_df.groupby(['rider_type', 'tip_category']).size().unstack(fill_value=0)
+tip_cats = groupby_size(filtered_df, ['rider_type', 'tip_category']).unstack(fill_value=0)
 tip_cats_pct = tip_cats.div(tip_cats.sum(axis=1), axis=0) * 100
 
 print("\nPercentage of trips in each tip category:")
 print(tip_cats_pct.round(1))
 
+# Significance of the Solo vs Group difference
+print("\n" + "="*60)
+print("SIGNIFICANCE TEST (BOOTSTRAP)")
+print("="*60)
+
+engine = BootstrapEngine()
+solo_pct = filtered_df.loc[filtered_df['rider_type'] == 'Solo', 'tip_percentage']
+group_pct = filtered_df.loc[filtered_df['rider_type'] == 'Group', 'tip_percentage']
+print_comparison('Group', 'Solo', engine.mean_diff(group_pct, solo_pct))
+
 print("\n" + "="*60)
 print("CONCLUSION")
 print("="*60)
 print("\nCompare the mean/median tip percentages between Solo and Group riders.")
-print("If groups tip significantly higher, peer pressure might be at play.")
+print("If groups tip significantly higher (CI above zero), peer pressure might be at play.")
 print("If they tip similarly or lower, maybe not so much!")
\ No newline at end of file
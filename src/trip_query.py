@@ -0,0 +1,446 @@
+"""
+Lazy Trip Query Builder
+
+Builds a logical plan instead of materializing every intermediate:
+
+    (TripQuery().clean()
+        .filter(('PU_Zone', 'contains', 'JFK'))
+        .derive('pickup_hour')
+        .group_by('pickup_hour')
+        .agg(trips='size', median_fare=('fare_amount', 'median'))
+        .collect())
+
+Before execution the plan is optimized:
+
+  - filters on raw columns are pushed down into the Parquet scan
+    (row-group statistics skip data that cannot match),
+  - filters on zone attributes (PU_Zone, DO_Borough, ...) are resolved
+    against the 265-row zone dimension into LocationID sets, so they are
+    pushed down too and the zone join only runs on surviving rows,
+  - only the columns the plan actually needs are read,
+  - the remaining filters (on derived columns) are fused into one mask
+    that is applied once.
+
+Execution is in memory, streaming (batch-wise partial aggregation) or
+partitioned (out-of-core spill group-by), chosen from the estimated size.
+
+Author: Henrik
+Date: November 2024
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from taxi_data import DATA_FILE, ZONES_FILE, DAY_ORDER, TIME_PERIODS, load_zones
+from spill_groupby import SpillGroupBy
+
+CLEAN_PREDICATES = [
+    ('fare_amount', '>=', 0),
+    ('trip_distance', '>', 0),
+    ('trip_distance', '<=', 100),
+    ('passenger_count', '>', 0),
+    ('passenger_count', '<=', 6),
+]
+
+ZONE_ATTRIBUTES = {'Zone', 'Borough', 'service_zone'}
+ZONE_SIDES = {'PU': 'PULocationID', 'DO': 'DOLocationID'}
+
+
+def _pickup(df):
+    return pd.to_datetime(df['tpep_pickup_datetime'])
+
+
+def _duration_min(df):
+    return (pd.to_datetime(df['tpep_dropoff_datetime']) - _pickup(df)).dt.total_seconds() / 60
+
+
+# name -> (input columns, vectorized function)
+DERIVATIONS = {
+    'pickup_hour': (['tpep_pickup_datetime'], lambda df: _pickup(df).dt.hour),
+    'pickup_day': (['tpep_pickup_datetime'], lambda df: pd.Categorical.from_codes(
+        _pickup(df).dt.dayofweek, categories=DAY_ORDER)),
+    'pickup_date': (['tpep_pickup_datetime'], lambda df: _pickup(df).dt.date),
+    'time_period': (['pickup_hour'], lambda df: pd.Categorical.from_codes(
+        df['pickup_hour'].to_numpy() // 6, categories=TIME_PERIODS)),
+    'tip_percentage': (['tip_amount', 'fare_amount'], lambda df: (
+        df['tip_amount'] / df['fare_amount'].where(df['fare_amount'] > 0) * 100)),
+    'rider_type': (['passenger_count'], lambda df: pd.Categorical.from_codes(
+        (df['passenger_count'].to_numpy() != 1).astype(np.int8), categories=['Solo', 'Group'])),
+    'trip_duration_min': (['tpep_pickup_datetime', 'tpep_dropoff_datetime'], _duration_min),
+    'avg_speed_mph': (['trip_distance', 'trip_duration_min'], lambda df: (
+        df['trip_distance'] / (df['trip_duration_min'].where(df['trip_duration_min'] > 0) / 60))),
+    'route': (['PU_Borough', 'DO_Borough'], lambda df: (
+        df['PU_Borough'].astype(object) + ' → ' + df['DO_Borough'].astype(object))),
+    'trip_type': (['PU_Borough', 'DO_Borough'], lambda df: np.where(
+        df['PU_Borough'].astype(object) == df['DO_Borough'].astype(object),
+        'Within Borough', 'Cross-Borough')),
+}
+
+
+def _zone_column(name):
+    """('PU', 'Zone') for 'PU_Zone', else None"""
+    side, _, attribute = name.partition('_')
+    if side in ZONE_SIDES and attribute in ZONE_ATTRIBUTES:
+        return side, attribute
+    return None
+
+
+def evaluate_predicate(series, op, value):
+    """Vectorized predicate on a pandas Series"""
+    if op == '==':
+        return series == value
+    if op == '!=':
+        return series != value
+    if op == '<':
+        return series < value
+    if op == '<=':
+        return series <= value
+    if op == '>':
+        return series > value
+    if op == '>=':
+        return series >= value
+    if op == 'in':
+        return series.isin(list(value))
+    if op == 'not in':
+        return ~series.isin(list(value))
+    if op == 'between':
+        return series.between(*value)
+    if op == 'contains':
+        return series.astype(str).str.contains(value, case=False, na=False)
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+def predicate_expression(column, op, value):
+    """Predicate as a pyarrow dataset expression (for scan pushdown)"""
+    field = pc.field(column)
+    if op == '==':
+        return field == value
+    if op == '!=':
+        return field != value
+    if op == '<':
+        return field < value
+    if op == '<=':
+        return field <= value
+    if op == '>':
+        return field > value
+    if op == '>=':
+        return field >= value
+    if op == 'in':
+        return field.isin(list(value))
+    if op == 'not in':
+        return ~field.isin(list(value))
+    if op == 'between':
+        return (field >= value[0]) & (field <= value[1])
+    return None  # Not pushable (e.g. substring match on a raw column)
+
+
+class TripQuery:
+    """Immutable, lazily evaluated query over the trip Parquet file(s)"""
+
+    def __init__(self, source=DATA_FILE, zones_file=ZONES_FILE, _ops=None):
+        self.source = source
+        self.zones_file = zones_file
+        self.ops = list(_ops or [])
+
+    def _with(self, *op):
+        return TripQuery(self.source, self.zones_file, self.ops + [op])
+
+    # ------------------------------------------------------------------
+    # Builder API
+    # ------------------------------------------------------------------
+    def filter(self, *predicates):
+        """Keep rows matching all (column, op, value) predicates"""
+        for predicate in predicates:
+            if len(predicate) != 3:
+                raise ValueError(f"Predicates are (column, op, value) tuples, got {predicate!r}")
+        return self._with('filter', list(predicates))
+
+    def clean(self):
+        """Apply the project's standard cleaning rules"""
+        return self.filter(*CLEAN_PREDICATES)
+
+    def with_zones(self, side='both'):
+        """Attach Zone/Borough/service_zone for pickup, dropoff or both"""
+        sides = {'pickup': ['PU'], 'dropoff': ['DO'], 'both': ['PU', 'DO']}[side]
+        return self._with('zones', sides)
+
+    def derive(self, *names):
+        """Add derived columns (see DERIVATIONS)"""
+        unknown = [n for n in names if n not in DERIVATIONS]
+        if unknown:
+            raise ValueError(f"Unknown derived columns: {unknown} (available: {sorted(DERIVATIONS)})")
+        return self._with('derive', list(names))
+
+    def select(self, *columns):
+        """Restrict the output columns"""
+        return self._with('select', list(columns))
+
+    def group_by(self, *keys):
+        return self._with('group_by', list(keys))
+
+    def agg(self, **named):
+        """Named aggregations: name=(column, func) or name='size'"""
+        if not any(op[0] == 'group_by' for op in self.ops):
+            raise ValueError("agg() requires group_by() first")
+        return self._with('agg', named)
+
+    def top(self, n, by=None):
+        """Largest n rows of the aggregated result"""
+        return self._with('top', (n, by))
+
+    # ------------------------------------------------------------------
+    # Planning
+    # ------------------------------------------------------------------
+    def _plan(self):
+        """Optimize the logical plan into a physical one"""
+        predicates, zone_sides, derived, select = [], set(), [], None
+        keys, aggs, top = None, None, None
+        for op, arg in self.ops:
+            if op == 'filter':
+                predicates += arg
+            elif op == 'zones':
+                zone_sides.update(arg)
+            elif op == 'derive':
+                derived += [n for n in arg if n not in derived]
+            elif op == 'select':
+                select = arg
+            elif op == 'group_by':
+                keys = arg
+            elif op == 'agg':
+                aggs = {name: ('__size__', 'size') if spec == 'size' else spec for name, spec in arg.items()}
+            elif op == 'top':
+                top = arg
+
+        # Split filters: zone-attribute filters are resolved on the zone
+        # dimension into LocationID sets, so they reach the scan as well
+        zones = load_zones(self.zones_file)
+        pushdown, residual = [], []
+        for column, op, value in predicates:
+            zone = _zone_column(column)
+            if zone is not None:
+                side, attribute = zone
+                matches = zones.index[evaluate_predicate(zones[attribute], op, value)].tolist()
+                pushdown.append((ZONE_SIDES[side], 'in', matches))
+            elif column in DERIVATIONS or predicate_expression(column, op, value) is None:
+                residual.append((column, op, value))
+            else:
+                pushdown.append((column, op, value))
+
+        # Columns read after the scan (pushed-down filters need nothing more)
+        used = set(keys or []) | set(select or []) | {column for column, _, _ in residual}
+        if aggs:
+            used |= {column for column, _ in aggs.values() if column != '__size__'}
+        full_rows = select is None and keys is None
+        if full_rows:
+            used |= set(derived)
+
+        # Derivations in dependency order, collecting zone attributes and raw inputs
+        ordered, zone_columns, raw = [], {}, set()
+
+        def need(name):
+            zone = _zone_column(name)
+            if name in DERIVATIONS:
+                if name not in ordered:
+                    for dependency in DERIVATIONS[name][0]:
+                        need(dependency)
+                    ordered.append(name)
+            elif zone is not None:
+                zone_columns.setdefault(zone[0], set()).add(zone[1])
+            else:
+                raw.add(name)
+
+        for name in sorted(used):
+            need(name)
+        if full_rows:
+            for side in zone_sides:
+                zone_columns.setdefault(side, set()).update(ZONE_ATTRIBUTES)
+        raw |= {ZONE_SIDES[side] for side in zone_columns}
+
+        return {
+            'pushdown': pushdown,
+            'residual': residual,
+            'zone_columns': {side: sorted(attrs) for side, attrs in zone_columns.items()},
+            'derived': ordered,
+            'columns': None if full_rows else sorted(raw),
+            'select': select,
+            'keys': keys,
+            'aggs': aggs,
+            'top': top,
+            # LocationID-indexed arrays for the post-filter zone lookup
+            'lookups': {attribute: zones[attribute].reindex(range(int(zones.index.max()) + 1))
+                        .to_numpy(dtype=object) for attribute in ZONE_ATTRIBUTES},
+        }
+
+    def explain(self):
+        """Print the optimized physical plan"""
+        plan = self._plan()
+        print("Physical plan:")
+        print(f"  Scan {self.source}")
+        print(f"    columns: {plan['columns'] or 'all'}")
+        for column, op, value in plan['pushdown']:
+            shown = f"{len(value)} ids" if op == 'in' and len(value) > 5 else value
+            print(f"    pushdown filter: {column} {op} {shown}")
+        for side, attrs in plan['zone_columns'].items():
+            print(f"  Zone lookup ({side}, after filters): {attrs}")
+        if plan['derived']:
+            print(f"  Derive: {plan['derived']}")
+        if plan['residual']:
+            print(f"  Fused mask: {plan['residual']}")
+        if plan['keys']:
+            print(f"  Group by {plan['keys']}: {plan['aggs']}")
+        if plan['top']:
+            print(f"  Top {plan['top'][0]}")
+        return plan
+
+    # ------------------------------------------------------------------
+    # Execution
+    # ------------------------------------------------------------------
+    def _dataset(self):
+        return ds.dataset(self.source, format='parquet')
+
+    def _filter_expression(self, plan):
+        expression = None
+        for predicate in plan['pushdown']:
+            part = predicate_expression(*predicate)
+            expression = part if expression is None else expression & part
+        return expression
+
+    def _prepare(self, df, plan):
+        """Zone lookup, derivations and the fused residual mask for one frame"""
+        for side, attributes in plan['zone_columns'].items():
+            ids = df[ZONE_SIDES[side]].to_numpy()
+            for attribute in attributes:
+                # Array lookup by LocationID instead of a merge
+                values = plan['lookups'][attribute]
+                valid = (ids >= 0) & (ids < len(values))
+                column = np.full(len(ids), None, dtype=object)
+                column[valid] = values[ids[valid]]
+                df[f"{side}_{attribute}"] = column
+        for name in plan['derived']:
+            df[name] = DERIVATIONS[name][1](df)
+
+        if plan['residual']:
+            mask = np.ones(len(df), dtype=bool)
+            for column, op, value in plan['residual']:
+                mask &= evaluate_predicate(df[column], op, value).to_numpy(dtype=bool)
+            df = df[mask]
+
+        if plan['keys']:
+            needed = list(plan['keys']) + [c for c, _ in plan['aggs'].values() if c != '__size__']
+            df = df[list(dict.fromkeys(needed))]
+        elif plan['select']:
+            df = df[plan['select']]
+        return df
+
+    def _aggregate_memory(self, df, plan):
+        named = {}
+        for name, (column, func) in plan['aggs'].items():
+            named[name] = (plan['keys'][0], 'size') if func == 'size' else (column, func)
+        return df.groupby(plan['keys'], observed=True).agg(**named)
+
+    def _aggregate_chunks(self, frames, plan, memory_budget_mb):
+        specs = {}
+        for name, (column, func) in plan['aggs'].items():
+            column = '__one__' if func == 'size' else column
+            specs.setdefault(column, [])
+            func = 'sum' if func == 'size' else func
+            if func not in specs[column]:
+                specs[column].append(func)
+        operator = SpillGroupBy(plan['keys'], specs, memory_budget_mb=memory_budget_mb)
+        try:
+            for df in frames:
+                if '__one__' in specs:
+                    df = df.assign(__one__=1)
+                operator.add(df)
+            result = operator.result()
+        finally:
+            operator.close()
+
+        output = pd.DataFrame(index=result.index)
+        for name, (column, func) in plan['aggs'].items():
+            if func == 'size':
+                output[name] = result[('__one__', 'sum')].astype(np.int64)
+            else:
+                output[name] = result[(column, func)]
+        return output
+
+    def _finish(self, result, plan):
+        if plan['top']:
+            n, by = plan['top']
+            by = by or result.columns[0]
+            result = result.nlargest(n, by)
+        elif plan['keys']:
+            result = result.sort_index()
+        return result
+
+    def estimated_bytes(self, plan=None):
+        """Rough in-memory size of the projected scan (before filtering)"""
+        plan = plan or self._plan()
+        dataset = self._dataset()
+        rows = sum(pq.ParquetFile(f).metadata.num_rows for f in dataset.files)
+        n_columns = len(plan['columns']) if plan['columns'] else len(dataset.schema)
+        return rows * n_columns * 8
+
+    def collect(self, mode='auto', memory_budget_mb=1024, batch_size=500_000):
+        """Execute the plan: 'memory', 'streaming', 'partitioned' or 'auto'"""
+        plan = self._plan()
+        budget = memory_budget_mb * 1024 * 1024
+        if mode == 'auto':
+            size = self.estimated_bytes(plan)
+            mode = 'memory' if size < budget / 4 else ('streaming' if size < budget * 4 else 'partitioned')
+
+        scanner = self._dataset().scanner(columns=plan['columns'], filter=self._filter_expression(plan),
+                                          batch_size=batch_size)
+        if mode == 'memory':
+            df = self._prepare(scanner.to_table().to_pandas(), plan)
+            result = self._aggregate_memory(df, plan) if plan['keys'] else df.reset_index(drop=True)
+            return self._finish(result, plan)
+
+        frames = (self._prepare(batch.to_pandas(), plan) for batch in scanner.to_batches())
+        if not plan['keys']:
+            return self._finish(pd.concat(frames, ignore_index=True), plan)
+        # Streaming keeps partial state in memory; partitioned lets it spill
+        chunk_budget = memory_budget_mb if mode == 'streaming' else max(1, memory_budget_mb // 8)
+        return self._finish(self._aggregate_chunks(frames, plan, chunk_budget), plan)
+
+
+# Main execution
+if __name__ == "__main__":
+    import time
+
+    print("=" * 70)
+    print("LAZY TRIP QUERIES - existing analyses in a few lines each")
+    print("=" * 70)
+
+    trips = TripQuery().clean()
+
+    queries = {
+        'Top 15 pickup zones (geo_analysis)':
+            trips.group_by('PU_Zone').agg(trips='size').top(15),
+        'JFK pickups by hour (airport_analysis)':
+            trips.filter(('PU_Zone', 'contains', 'JFK')).group_by('pickup_hour')
+                 .agg(trips='size', median_fare=('fare_amount', 'median')),
+        'Top 10 borough routes (borough_flows)':
+            trips.group_by('route').agg(trips='size', avg_fare=('fare_amount', 'mean')).top(10, 'trips'),
+        'Tipping by rider type (tip_peer_pressure)':
+            TripQuery().filter(('payment_type', '==', 1), ('fare_amount', '>', 0), ('tip_amount', '>=', 0),
+                               ('passenger_count', 'between', (1, 6)), ('tip_percentage', '<=', 100))
+                       .group_by('rider_type')
+                       .agg(trips='size', tip_pct_mean=('tip_percentage', 'mean'),
+                            tip_pct_median=('tip_percentage', 'median')),
+        'Trips by time period (late_night_tips)':
+            trips.group_by('time_period').agg(trips='size', avg_tip=('tip_amount', 'mean')),
+    }
+
+    for title, query in queries.items():
+        print(f"\n{title}")
+        print("-" * 70)
+        query.explain()
+        for mode in ['memory', 'streaming']:
+            start = time.perf_counter()
+            result = query.collect(mode=mode)
+            print(f"  {mode}: {time.perf_counter() - start:.2f}s")
+        print(result.round(2).to_string())
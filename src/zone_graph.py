@@ -0,0 +1,243 @@
+"""
+Zone Flow Graph
+
+The trip network at zone level: a weighted directed graph with an edge
+from pickup zone to dropoff zone. It is stored as a sparse CSR adjacency
+(indptr / indices / weights) built with one sort of the PU/DO code
+arrays, in pure NumPy, so a graph per day or per hour of a whole year is
+cheap to build and compare. On top of it:
+
+  - in/out strength and net inflow per zone (overall or by hour),
+  - PageRank by power iteration, each step a bincount over the edges,
+  - strongly connected clusters with an iterative Tarjan walk of the CSR,
+  - cosine similarity between graphs (e.g. each day vs the month).
+
+Author: Henrik
+Date: November 2024
+"""
+
+import numpy as np
+import pandas as pd
+
+N_LOCATIONS = 266
+
+
+class ZoneGraph:
+    """Weighted directed zone graph in CSR form"""
+
+    def __init__(self, indptr, indices, weights, n_nodes=N_LOCATIONS):
+        self.n_nodes = n_nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @classmethod
+    def from_codes(cls, sources, targets, weights=None, n_nodes=N_LOCATIONS):
+        """Build the CSR adjacency from source/target code arrays (duplicate edges are summed)"""
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        valid = (sources >= 0) & (sources < n_nodes) & (targets >= 0) & (targets < n_nodes)
+        keys = sources[valid] * n_nodes + targets[valid]
+        if weights is None:
+            edge_keys, edge_weights = np.unique(keys, return_counts=True)
+            edge_weights = edge_weights.astype(np.float64)
+        else:
+            edge_keys, inverse = np.unique(keys, return_inverse=True)
+            edge_weights = np.bincount(inverse, weights=np.asarray(weights, dtype=np.float64)[valid],
+                                       minlength=len(edge_keys))
+        rows, columns = np.divmod(edge_keys, n_nodes)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_nodes))])
+        return cls(indptr, columns, edge_weights, n_nodes)
+
+    @classmethod
+    def from_trips(cls, df, weight_column=None, n_nodes=N_LOCATIONS):
+        """Pickup -> dropoff graph of a trip DataFrame (trip counts or summed weights)"""
+        weights = df[weight_column].to_numpy(dtype=np.float64) if weight_column else None
+        return cls.from_codes(df['PULocationID'].to_numpy(), df['DOLocationID'].to_numpy(), weights, n_nodes)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    def rows(self):
+        """Source node of every edge"""
+        return np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+
+    def edge_keys(self):
+        """source * n_nodes + target per edge (sorted)"""
+        return self.rows() * self.n_nodes + self.indices
+
+    def out_strength(self):
+        return np.bincount(self.rows(), weights=self.weights, minlength=self.n_nodes)
+
+    def in_strength(self):
+        return np.bincount(self.indices, weights=self.weights, minlength=self.n_nodes)
+
+    def net_inflow(self):
+        """Arrivals minus departures per zone"""
+        return self.in_strength() - self.out_strength()
+
+    def transpose(self):
+        """Graph with every edge reversed"""
+        return ZoneGraph.from_codes(self.indices, self.rows(), self.weights, self.n_nodes)
+
+    def pagerank(self, damping=0.85, tol=1e-10, max_iter=200):
+        """Stationary visit probability of a random rider following trips"""
+        rows = self.rows()
+        out = self.out_strength()
+        active = (out > 0) | (self.in_strength() > 0)
+        teleport = active / active.sum()
+        transition = self.weights / out[rows]
+        dangling = active & (out == 0)
+
+        rank = teleport.copy()
+        for _ in range(max_iter):
+            spread = np.bincount(self.indices, weights=rank[rows] * transition, minlength=self.n_nodes)
+            updated = damping * (spread + rank[dangling].sum() * teleport) + (1 - damping) * teleport
+            converged = np.abs(updated - rank).sum() < tol
+            rank = updated
+            if converged:
+                break
+        return rank
+
+    def strongly_connected_components(self):
+        """Component label per node (iterative Tarjan; nodes without edges get their own label)"""
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+        n = self.n_nodes
+        index = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        labels = np.full(n, -1, dtype=np.int64)
+        stack = []
+        counter = 0
+        component = 0
+
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, indptr[root])]
+            while work:
+                node, position = work[-1]
+                if position < indptr[node + 1]:
+                    work[-1] = (node, position + 1)
+                    target = indices[position]
+                    if index[target] == -1:
+                        index[target] = low[target] = counter
+                        counter += 1
+                        stack.append(target)
+                        on_stack[target] = True
+                        work.append((target, indptr[target]))
+                    elif on_stack[target]:
+                        low[node] = min(low[node], index[target])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        labels[member] = component
+                        if member == node:
+                            break
+                    component += 1
+        return labels
+
+    def cosine(self, other):
+        """Cosine similarity of two graphs' edge weight vectors"""
+        _, mine, theirs = np.intersect1d(self.edge_keys(), other.edge_keys(), assume_unique=True,
+                                         return_indices=True)
+        dot = (self.weights[mine] * other.weights[theirs]).sum()
+        return dot / (np.linalg.norm(self.weights) * np.linalg.norm(other.weights))
+
+    def edges(self):
+        """Edge list as a DataFrame"""
+        return pd.DataFrame({'source': self.rows(), 'target': self.indices, 'weight': self.weights})
+
+
+def graphs_by(sources, targets, groups, n_groups, weights=None, n_nodes=N_LOCATIONS):
+    """One graph per group code (hour, day, ...), from a single combined build"""
+    groups = np.asarray(groups, dtype=np.int64)
+    combined = ZoneGraph.from_codes(groups * n_nodes + np.asarray(sources, dtype=np.int64), targets,
+                                    weights, n_groups * n_nodes)
+    graphs = []
+    for group in range(n_groups):
+        # Rows group * n_nodes ... (group + 1) * n_nodes of the combined CSR are this group's graph
+        lo, hi = combined.indptr[group * n_nodes], combined.indptr[(group + 1) * n_nodes]
+        indptr = combined.indptr[group * n_nodes:(group + 1) * n_nodes + 1] - lo
+        graphs.append(ZoneGraph(indptr, combined.indices[lo:hi], combined.weights[lo:hi], n_nodes))
+    return graphs
+
+
+def hourly_net_inflow(df, n_nodes=N_LOCATIONS):
+    """24 x zone array of arrivals minus departures by hour of pickup"""
+    hours = df['tpep_pickup_datetime'].dt.hour.to_numpy()
+    arrivals = np.bincount(hours * n_nodes + df['DOLocationID'].to_numpy(), minlength=24 * n_nodes)
+    departures = np.bincount(hours * n_nodes + df['PULocationID'].to_numpy(), minlength=24 * n_nodes)
+    return (arrivals - departures).reshape(24, n_nodes)
+
+
+# Main execution
+if __name__ == "__main__":
+    import time
+    from taxi_data import load_clean_trips, load_zones
+
+    print("=" * 70)
+    print("ZONE FLOW GRAPH")
+    print("=" * 70)
+
+    df = load_clean_trips(columns=['tpep_pickup_datetime', 'PULocationID', 'DOLocationID'])
+    zones = load_zones()
+    names = zones['Zone'].reindex(range(N_LOCATIONS))
+    print(f"\nTrips: {len(df):,}")
+
+    start = time.perf_counter()
+    graph = ZoneGraph.from_trips(df)
+    print(f"CSR graph: {graph.n_edges:,} edges over {graph.n_nodes} zones in {time.perf_counter() - start:.3f}s")
+
+    # Dense reference for the small zone graph
+    dense = np.zeros((N_LOCATIONS, N_LOCATIONS))
+    np.add.at(dense, (df['PULocationID'].to_numpy(), df['DOLocationID'].to_numpy()), 1)
+    print(f"Net inflow matches dense matrix: {np.allclose(graph.net_inflow(), dense.sum(0) - dense.sum(1))}")
+
+    metrics = pd.DataFrame({'Zone': names, 'net_inflow': graph.net_inflow(), 'pagerank': graph.pagerank(),
+                            'in_trips': graph.in_strength()})
+    print("\nLargest net importers (more dropoffs than pickups):")
+    print(metrics.nlargest(5, 'net_inflow').round(5).to_string())
+    print("\nLargest net exporters:")
+    print(metrics.nsmallest(5, 'net_inflow').round(5).to_string())
+    print("\nMost attractive zones by PageRank:")
+    print(metrics.nlargest(10, 'pagerank').round(5).to_string())
+
+    labels = graph.strongly_connected_components()
+    sizes = pd.Series(labels).value_counts()
+    print(f"\nStrongly connected clusters: {len(sizes)} "
+          f"(largest {sizes.iloc[0]} zones, {(sizes == 1).sum()} singletons)")
+    # Check: every pair inside a cluster reaches each other (boolean transitive closure)
+    reach = (dense > 0) | np.eye(N_LOCATIONS, dtype=bool)
+    for _ in range(int(np.ceil(np.log2(N_LOCATIONS)))):
+        reach = reach | ((reach.astype(np.float32) @ reach.astype(np.float32)) > 0)
+    mutual = reach & reach.T
+    print(f"Clusters match mutual reachability: {(mutual == (labels[:, None] == labels[None, :])).all()}")
+
+    hourly = hourly_net_inflow(df)
+    top = metrics.nlargest(3, 'in_trips').index
+    print("\nNet inflow by hour for the busiest destination zones:")
+    print(pd.DataFrame(hourly[:, top], columns=names[top]).rename_axis('hour').to_string())
+
+    start = time.perf_counter()
+    day = df['tpep_pickup_datetime'].dt.day.to_numpy() - 1
+    daily = graphs_by(df['PULocationID'].to_numpy(), df['DOLocationID'].to_numpy(), day, 31)
+    hourly_graphs = graphs_by(df['PULocationID'].to_numpy(), df['DOLocationID'].to_numpy(),
+                              df['tpep_pickup_datetime'].dt.hour.to_numpy(), 24)
+    print(f"\n31 daily + 24 hourly graphs built in {time.perf_counter() - start:.3f}s")
+    similarity = pd.Series([g.cosine(graph) for g in daily], index=range(1, 32), name='cosine_vs_month')
+    print("Days least like the month as a whole:")
+    print(similarity.nsmallest(5).round(4).to_string())
+    print(f"3am vs 6pm graph similarity: {hourly_graphs[3].cosine(hourly_graphs[18]):.4f}")